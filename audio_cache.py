@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""Cache degli audio serviti dai link '/a/' e '/p/' (e dal bottone 'a:').
+
+Ogni click faceva un download_audio completo (yt-dlp + transcodifica MP3), poi
+il file si leggeva tutto in memoria e si cancellava: riascoltare, spostarsi nel
+player o cliccare la stessa card da dieci persone = dieci yt-dlp. Qui:
+
+  - l'MP3 resta in temp_dir/nello_audio_cache/<hash chiave>.mp3, con accanto un
+    .json (titolo, autore, estensione, quando è stato creato); chiave =
+    core.media_key del link, come la cache media. Le voci ricavate dal video già
+    consegnato (audio_derive) possono essere anche .m4a (AAC copiato così com'è);
+  - i frontend lo servono DA QUI senza cancellarlo (il web server in streaming,
+    con Range: il player di '/p/' parte subito e può saltare avanti);
+  - i click contemporanei sullo stesso link fanno un solo download (inflight);
+  - budget AUDIO_CACHE_MAX_MB (si sfrattano gli audio usati meno di recente) e
+    scadenza AUDIO_CACHE_TTL_HOURS.
+
+Niente indice da tenere allineato: il file e il suo .json sono la voce.
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from typing import Dict, Optional
+
+import core
+import inflight
+import janitor
+
+logger = logging.getLogger(__name__)
+
+MAX_BYTES = max(1, int(float(os.getenv('AUDIO_CACHE_MAX_MB', '128')) * 1024 * 1024))
+TTL = int(float(os.getenv('AUDIO_CACHE_TTL_HOURS', '24')) * 3600)
+CACHE_DIRNAME = 'nello_audio_cache'
+MIME = {'mp3': 'audio/mpeg', 'm4a': 'audio/mp4'}
+
+
+class AudioCache:
+    def __init__(self, root: str, max_bytes: int = MAX_BYTES, ttl: int = TTL):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'joined': 0, 'stores': 0, 'evictions': 0,
+                       'from_video': 0}
+        os.makedirs(root, exist_ok=True)
+
+    def _base(self, key: str) -> str:
+        return os.path.join(self.root, hashlib.sha1(key.encode('utf-8')).hexdigest()[:20])
+
+    def _files(self):
+        """Audio in cache (tutto tranne i .json)."""
+        return [os.path.join(self.root, n) for n in os.listdir(self.root)
+                if os.path.splitext(n)[1][1:] in MIME]
+
+    def _drop(self, base: str):
+        for ext in list(MIME) + ['json']:
+            try:
+                os.remove(f"{base}.{ext}")
+            except OSError:
+                pass
+
+    def _lookup_locked(self, key: str) -> Optional[Dict]:
+        base = self._base(key)
+        try:
+            with open(base + '.json', 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            path = f"{base}.{data.get('ext') or 'mp3'}"
+            if time.time() - float(data.get('t', 0)) > self.ttl or os.path.getsize(path) <= 0:
+                raise ValueError('scaduto')
+        except (OSError, ValueError):
+            self._drop(base)
+            return None
+        data['file_path'] = path
+        return data
+
+    def has(self, key: str) -> bool:
+        """C'è già un audio valido per `key`? (senza contare hit/miss)"""
+        if not key:
+            return False
+        with self._lock:
+            return self._lookup_locked(key) is not None
+
+    def get(self, key: str) -> Optional[Dict]:
+        """{'success', 'file_path', 'title', 'uploader', 'mime'} dalla cache, o
+        None. Il file NON va cancellato da chi lo riceve."""
+        if not key:
+            return None
+        with self._lock:
+            data = self._lookup_locked(key)
+            if data is None:
+                self._stats['misses'] += 1
+                return None
+            try:
+                os.utime(data['file_path'])     # ultimo uso: per lo sfratto LRU
+            except OSError:
+                pass
+            self._stats['hits'] += 1
+            if data.get('source') == 'video':
+                self._stats['from_video'] += 1
+        ext = os.path.splitext(data['file_path'])[1][1:]
+        return {'success': True, 'file_path': data['file_path'], 'title': data.get('title'),
+                'uploader': data.get('uploader'), 'mime': MIME.get(ext, 'audio/mpeg'),
+                'from_cache': True}
+
+    def put(self, key: str, path: str, title: Optional[str] = None,
+            uploader: Optional[str] = None, source: str = 'download') -> Optional[str]:
+        """Sposta l'audio `path` (.mp3 o .m4a) in cache sotto `key`; ritorna il
+        path in cache (o None se non è stato possibile: `path` resta dov'era)."""
+        ext = os.path.splitext(path or '')[1][1:].lower()
+        if not key or ext not in MIME or not os.path.exists(path):
+            return None
+        base = self._base(key)
+        dest = f"{base}.{ext}"
+        with self._lock:
+            self._drop(base)           # eventuale voce vecchia (anche con altra estensione)
+            try:
+                os.replace(path, dest)
+                with open(base + '.json', 'w', encoding='utf-8') as f:
+                    json.dump({'key': key, 'title': title, 'uploader': uploader, 'ext': ext,
+                               'source': source, 't': time.time()}, f)
+            except OSError as e:
+                logger.warning(f"Audio cache: put fallito per {key}: {e}")
+                return None
+            janitor.discard(path)      # non esiste più: solo fuori dagli artefatti
+            self._stats['stores'] += 1
+            self._enforce_budget(keep=dest)
+        return dest
+
+    def _enforce_budget(self, keep: str):
+        """LRU sugli mtime (toccati a ogni hit); mai il file appena messo."""
+        try:
+            sized = [(os.path.getmtime(p), os.path.getsize(p), p) for p in self._files()]
+        except OSError:
+            return
+        total = sum(s for _, s, _ in sized)
+        for _, size, p in sorted(sized):
+            if total <= self.max_bytes:
+                break
+            if p == keep:
+                continue
+            self._drop(os.path.splitext(p)[0])
+            total -= size
+            self._stats['evictions'] += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            try:
+                files = self._files()
+                size = sum(os.path.getsize(p) for p in files)
+            except OSError:
+                files, size = [], 0
+            looked = self._stats['hits'] + self._stats['misses']
+            return dict(self._stats, entries=len(files), bytes=size, max_bytes=self.max_bytes,
+                        hit_rate=(self._stats['hits'] / looked) if looked else 0.0)
+
+    async def fetch(self, url: str, produce) -> Dict:
+        """Audio di `url`: dalla cache o, se manca, da `produce()` (coroutine che
+        ritorna un risultato download_audio), una volta sola per i click
+        contemporanei. Il file del risultato sta in cache: non va cancellato."""
+        key = core.media_key(url)
+        hit = self.get(key)
+        if hit:
+            return hit
+
+        async def _produce():
+            info = await produce()
+            if not (isinstance(info, dict) and info.get('success')):
+                return info
+            cached = self.put(key, info.get('file_path'), info.get('title'), info.get('uploader'))
+            if cached:
+                info = dict(info, file_path=cached)
+            return info
+
+        info, joined = await inflight.coalesce(f"audio:{key}", _produce, clone=lambda r: r)
+        if joined:
+            with self._lock:
+                self._stats['joined'] += 1
+        return info
+
+
+_caches: Dict[str, AudioCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(temp_dir: str) -> AudioCache:
+    """Cache audio del processo (una per temp_dir)."""
+    root = os.path.join(temp_dir, CACHE_DIRNAME)
+    with _caches_lock:
+        if root not in _caches:
+            _caches[root] = AudioCache(root)
+        return _caches[root]
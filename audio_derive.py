@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""Audio ricavato dal video appena consegnato, invece di riscaricarlo.
+
+Ogni card video ha i link '/a/' e '/p/' (e su Telegram il bottone 'a:'): al
+click download_audio tornava sulla piattaforma con yt-dlp (per YouTube anche
+con un'altra extract_info per il controllo durata), quando il video intero era
+su disco pochi secondi prima. Qui, dopo l'invio:
+
+  - il frontend passa il file a schedule() invece di cancellarlo: il download
+    ORIGINALE, non la copia di transcode.fit (audio ricodificato a bitrate più
+    basso; se il frontend ha ricompresso, tiene l'originale fino a qui);
+  - in background media_probe guarda la traccia audio e ffmpeg la estrae: copia
+    senza ricodificare se è AAC (-> .m4a) o MP3 (-> .mp3), altrimenti MP3 192k
+    come download_audio;
+  - il risultato va nella cache audio sotto core.media_key del link postato:
+    '/a/', '/p/' e 'a:' lo servono senza toccare la rete;
+  - il video si cancella comunque alla fine (come faceva il frontend).
+
+Budget: solo video fino a AUDIO_DERIVE_MAX_MB, al massimo AUDIO_DERIVE_PENDING
+lavori in coda (gli altri si saltano: il click farà il download come prima),
+ffmpeg nello slot 'ffmpeg' dello scheduler a priorità bassa e con timeout
+AUDIO_DERIVE_TIMEOUT. AUDIO_FROM_VIDEO=0 lo spegne.
+"""
+
+import os
+import asyncio
+import hashlib
+import logging
+import threading
+from typing import Dict, Optional
+
+import core
+import janitor
+import scheduler
+import audio_cache
+import media_probe
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.getenv('AUDIO_FROM_VIDEO', '1') == '1'
+MAX_SOURCE_BYTES = int(float(os.getenv('AUDIO_DERIVE_MAX_MB', '60')) * 1024 * 1024)
+MAX_PENDING = max(1, int(os.getenv('AUDIO_DERIVE_PENDING', '4')))
+TIMEOUT = max(5, int(os.getenv('AUDIO_DERIVE_TIMEOUT', '60')))
+
+# Codec che si copiano così come sono -> estensione del file in cache
+_COPY = {'aac': 'm4a', 'mp3': 'mp3'}
+
+_lock = threading.Lock()
+_pending = [0]
+_tasks = set()       # riferimenti ai task in volo (asyncio tiene solo weakref)
+_stats = {'derived': 0, 'copied': 0, 'encoded': 0, 'skipped': 0, 'no_audio': 0,
+          'failed': 0, 'busy': 0, 'bytes': 0}
+
+
+def _remove(path: Optional[str]):
+    try:
+        if path and os.path.exists(path):
+            os.remove(path)
+    except OSError:
+        pass
+
+
+async def _extract(video: str, codec: str, out_base: str) -> Optional[str]:
+    """Estrae la traccia audio di `video`; path del file prodotto o None."""
+    ext = _COPY.get(codec, 'mp3')
+    out = janitor.track(f"{out_base}.{ext}")
+    cmd = ['ffmpeg', '-y', '-v', 'error', '-threads', '1', '-i', video, '-vn', '-map', '0:a:0']
+    if codec in _COPY:
+        cmd += ['-c:a', 'copy']
+        if ext == 'm4a':
+            cmd += ['-movflags', '+faststart']
+    else:
+        cmd += ['-c:a', 'libmp3lame', '-b:a', '192k']
+    cmd.append(out)
+    proc = None
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *cmd, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
+        await asyncio.wait_for(proc.wait(), timeout=TIMEOUT)
+    except asyncio.TimeoutError:
+        try:
+            proc.kill()
+        except Exception:
+            pass
+        logger.warning(f"Audio dal video: timeout dopo {TIMEOUT}s ({os.path.basename(video)})")
+        janitor.discard(out)
+        return None
+    except Exception as e:
+        logger.warning(f"Audio dal video: ffmpeg non avviato: {e}")
+        janitor.discard(out)
+        return None
+    if proc.returncode != 0 or not os.path.exists(out) or os.path.getsize(out) <= 0:
+        janitor.discard(out)
+        return None
+    return out
+
+
+async def _derive(url: str, video: str, title: Optional[str], uploader: Optional[str],
+                  cache: 'audio_cache.AudioCache', owner: str):
+    key = core.media_key(url)
+    try:
+        # Priorità bassa: i download e le compressioni di chi aspetta vengono prima
+        async with scheduler.slot('ffmpeg', owner, scheduler.HEAVY):
+            if cache.has(key):        # arrivato nel frattempo (click sul link)
+                with _lock:
+                    _stats['skipped'] += 1
+                return
+            # Probe condiviso (media_probe): di norma già fatto da chi ha inviato
+            info = await media_probe.probe(video)
+            if info is None or not info.has_audio:
+                with _lock:
+                    _stats['failed' if info is None else 'no_audio'] += 1
+                return
+            codec = info.acodec
+            base = os.path.join(os.path.dirname(video),
+                                f"audio_{hashlib.md5(key.encode('utf-8')).hexdigest()[:12]}_v")
+            out = await _extract(video, codec, base)
+        if not out:
+            with _lock:
+                _stats['failed'] += 1
+            return
+        size = os.path.getsize(out)
+        if not cache.put(key, out, title, uploader, source='video'):
+            janitor.discard(out)
+            with _lock:
+                _stats['failed'] += 1
+            return
+        with _lock:
+            _stats['derived'] += 1
+            _stats['copied' if codec in _COPY else 'encoded'] += 1
+            _stats['bytes'] += size
+        logger.info(f"Audio dal video: {codec} -> {os.path.splitext(out)[1]} "
+                    f"({size / 1024:.0f} KB) per {key[:80]}")
+    except Exception as e:
+        with _lock:
+            _stats['failed'] += 1
+        logger.warning(f"Audio dal video fallito ({url}): {e}")
+    finally:
+        _remove(video)
+        with _lock:
+            _pending[0] -= 1
+
+
+def schedule(url: str, video: Optional[str], info: Dict, temp_dir: str, owner: str) -> bool:
+    """Dopo l'invio di un video: ricava l'audio in background e poi cancella il
+    file. True se il file è stato preso in carico (il chiamante NON lo cancella);
+    False se non serve o non c'è posto: il file resta al chiamante."""
+    if not ENABLED or not url or not video or not os.path.exists(video):
+        return False
+    if os.path.splitext(video)[1].lower() not in core.VIDEO_EXTS:
+        return False
+    try:
+        if os.path.getsize(video) > MAX_SOURCE_BYTES:
+            return False
+        loop = asyncio.get_running_loop()
+    except (OSError, RuntimeError):
+        return False
+    cache = audio_cache.get_cache(temp_dir)
+    if cache.has(core.media_key(url)):
+        return False
+    with _lock:
+        if _pending[0] >= MAX_PENDING:
+            _stats['busy'] += 1
+            return False
+        _pending[0] += 1
+    title = (info or {}).get('title')
+    uploader = (info or {}).get('uploader') or (info or {}).get('channel')
+    task = loop.create_task(_derive(url, video, title, uploader, cache, owner))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return True
+
+
+def stats() -> Dict:
+    with _lock:
+        return dict(_stats, pending=_pending[0], enabled=ENABLED)
@@ -0,0 +1,649 @@
+#!/usr/bin/env python3
+"""Benchmark end-to-end del downloader, tutto in locale (niente rete).
+
+Avvia degli stand-in HTTP locali al posto dei servizi veri:
+
+  - CDN finta: /m/{byte}/{nome}.{ext} serve un media della dimensione chiesta;
+  - Instagram: /api/v1/media/{id}/info/ (carosello) e la pagina HTML del post
+    (JSON embedded con carousel_media, come quella vera);
+  - Cobalt (API v10, POST sulla root) e TIKWM (/api/);
+  - pagine TikTok /photo/ e Facebook (foto con og:image, video con playable_url).
+
+Un SocialMediaDownloader vero viene instradato sugli stand-in da un adapter di
+requests montato sulla sua sessione (l'host originale viaggia in X-Bench-Host);
+yt-dlp è sostituito da uno stub che "estrae" info puntate alla CDN finta, così si
+misura tutto quello che sta attorno: scelta delle slide, fetch paralleli, hash,
+dedupe, fallback. Per ogni scenario:
+
+  - latency_s:   tempo della chiamata (download_video o la singola strategia);
+  - bytes/files: quanto è stato scaricato davvero (file del risultato);
+  - throughput_mb_s: bytes / latency;
+  - peak_rss_mb: picco di RSS del processo durante lo scenario (campionato da
+    /proc/self/status; altrove ru_maxrss, che è il picco dall'avvio).
+
+Scenari: yt-dlp (video singolo, caroselli di varie dimensioni), fetch di un
+video a flusso unico e a segmenti (video_single / video_segmented: con
+--cdn-conn-mbps la CDN limita la banda per connessione, come quelle vere che
+strozzano i download lunghi), ogni fallback
+(cobalt, tiktok photo + TIKWM, instagram_api, instagram_html, facebook foto e
+video) e carico concorrente (K download di caroselli insieme). L'output è JSON
+(stdout o --out) per confrontare le esecuzioni nel tempo.
+
+Uso:
+    python bench_e2e.py                              # tutti gli scenari, 5 giri
+    python bench_e2e.py --scenarios cobalt,carousel --carousel 3,10,30 --out e2e.json
+    python bench_e2e.py --scenarios load --concurrency 1,8,32 --cdn-latency-ms 40
+    python bench_e2e.py --scenarios video_single,video_segmented --video-mb 32 --cdn-conn-mbps 4
+"""
+
+import os
+import sys
+import json
+import atexit
+import re
+import time
+import socket
+import shutil
+import asyncio
+import hashlib
+import argparse
+import tempfile
+import threading
+import statistics
+from urllib.parse import urlsplit, urlunsplit
+
+from aiohttp import web, ClientConnectionError
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BENCH_HOST_HEADER = 'X-Bench-Host'
+COBALT_URL = 'https://cobalt.bench'
+CDN = 'https://cdn.bench'
+MB = 1024 * 1024
+
+# Prima di importare il downloader: cache media spenta (ogni giro deve scaricare
+# davvero), statistiche dei tentativi e temp_dir isolate, una sola istanza Cobalt
+BENCH_DIR = tempfile.mkdtemp(prefix='nello_bench_')
+# Via all'uscita, DOPO gli atexit registrati in seguito (LIFO): il flush finale
+# di strategy_stats scrive ancora qui
+atexit.register(shutil.rmtree, BENCH_DIR, ignore_errors=True)
+os.environ.update({
+    'MEDIA_CACHE_MAX_MB': '0',
+    'STRATEGY_STATS_PATH': os.path.join(BENCH_DIR, 'strategy_stats.json'),
+    'COBALT_INSTANCES': COBALT_URL,
+    'COBALT_PROBE_MIN': '0',
+    'SMD_HEDGE_DELAY': '0',
+})
+for _k in ('SMD_PROXY', 'HTTPS_PROXY', 'HTTP_PROXY'):
+    os.environ.pop(_k, None)
+tempfile.tempdir = BENCH_DIR
+
+sys.path.insert(0, HERE)
+from requests.adapters import HTTPAdapter  # noqa: E402
+
+import inflight  # noqa: E402
+import segmented  # noqa: E402
+import smd_http  # noqa: E402
+from social_downloader import SocialMediaDownloader  # noqa: E402
+
+_ALPHABET = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_'
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _shortcode(n: int) -> str:
+    """Shortcode Instagram valido (base64 di Instagram) e diverso per ogni giro."""
+    out = ''
+    n = n + 64 ** 5
+    while n:
+        n, r = divmod(n, 64)
+        out = _ALPHABET[r] + out
+    return out
+
+
+def _media_id(shortcode: str) -> int:
+    result = 0
+    for char in shortcode:
+        result = result * 64 + _ALPHABET.index(char)
+    return result
+
+
+def cdn_url(size: int, name: str) -> str:
+    return f"{CDN}/m/{size}/{name}"
+
+
+# --------------------------
+# Stand-in HTTP
+# --------------------------
+
+_RANGE = re.compile(r'bytes=(\d+)-(\d*)$')
+_CONTENT_TYPES = {'jpg': 'image/jpeg', 'png': 'image/png', 'webp': 'image/webp',
+                  'mp4': 'video/mp4', 'm4a': 'audio/mp4', 'mp3': 'audio/mpeg'}
+
+
+class StandIns:
+    """Un solo server aiohttp per tutti gli host finti: il routing guarda
+    X-Bench-Host (messo dall'adapter) e il path. `config` regola dimensioni e
+    latenze; `served` conta richieste e byte mandati per host."""
+
+    def __init__(self, port: int, config: dict):
+        self.port = port
+        self.config = config
+        self.served = {}
+        self._block = os.urandom(MB)   # payload: 1 MB casuale ripetuto, ruotato per nome
+        self._loop = None
+
+    def _count(self, host: str, nbytes: int = 0):
+        s = self.served.setdefault(host, {'requests': 0, 'bytes': 0})
+        s['requests'] += 1
+        s['bytes'] += nbytes
+
+    async def _api_delay(self):
+        ms = self.config.get('api_latency_ms', 0)
+        if ms:
+            await asyncio.sleep(ms / 1000)
+
+    # --- CDN ---
+    async def cdn(self, request: web.Request, size: int, name: str):
+        ext = name.rsplit('.', 1)[-1].lower()
+        ms = self.config.get('cdn_latency_ms', 0)
+        if ms:
+            await asyncio.sleep(ms / 1000)
+        headers = {'Content-Type': _CONTENT_TYPES.get(ext, 'application/octet-stream')}
+        start, end, status = 0, size - 1, 200
+        m = _RANGE.match(request.headers.get('Range', ''))
+        if m and self.config.get('cdn_ranges', True):
+            start = int(m.group(1))
+            end = min(int(m.group(2)), size - 1) if m.group(2) else size - 1
+            status = 206
+            headers['Content-Range'] = f"bytes {start}-{end}/{size}"
+        if self.config.get('cdn_ranges', True):
+            headers['Accept-Ranges'] = 'bytes'
+        resp = web.StreamResponse(status=status, headers=headers)
+        resp.content_length = end - start + 1
+        # Contenuto diverso per ogni nome (stesso byte alla stessa posizione in
+        # ogni richiesta, anche a Range): altrimenti le slide della stessa
+        # dimensione sarebbero identiche e il dedupe del downloader le fonderebbe
+        shift = int(hashlib.md5(name.encode('utf-8')).hexdigest()[:8], 16) % MB
+        # Banda limitata PER CONNESSIONE (come certe CDN): --cdn-conn-mbps
+        rate = self.config.get('cdn_conn_mbps', 0) * MB
+        t0 = time.monotonic()
+        sent = start
+        chunk = 256 * 1024
+        try:
+            await resp.prepare(request)
+            while sent <= end:
+                n = min(chunk, end + 1 - sent)
+                off = (sent + shift) % MB
+                part = self._block[off:off + n]
+                if len(part) < n:
+                    part += self._block[:n - len(part)]
+                await resp.write(part)
+                sent += n
+                if rate:
+                    ahead = (sent - start) / rate - (time.monotonic() - t0)
+                    if ahead > 0:
+                        await asyncio.sleep(ahead)
+            await resp.write_eof()
+        except (ConnectionError, ClientConnectionError):
+            pass   # il client ha chiuso prima (la prima parte di un download a segmenti)
+        self._count('cdn.bench', sent - start)
+        return resp
+
+    # --- Instagram ---
+    def _ig_items(self, media_id, n: int):
+        size = self.config['image_bytes']
+        return [{'pk': f"{media_id}_{i}", 'id': f"{media_id}_{i}",
+                 'image_versions2': {'candidates': [
+                     {'url': cdn_url(size, f"ig_{media_id}_{i}.jpg"), 'width': 1080, 'height': 1350}]}}
+                for i in range(1, n + 1)]
+
+    async def ig_api(self, request: web.Request, media_id: str):
+        await self._api_delay()
+        self._count('www.instagram.com')
+        item = {'id': media_id, 'caption': {'text': 'Bench carousel (api)'},
+                'carousel_media': self._ig_items(media_id, self.config['carousel'])}
+        return web.json_response({'items': [item], 'status': 'ok'})
+
+    async def ig_page(self, request: web.Request, code: str):
+        await self._api_delay()
+        self._count('www.instagram.com')
+        blob = {'require': [{'data': {'items': [{
+            'code': code, 'carousel_media': self._ig_items(code, self.config['carousel'])}]}}]}
+        filler = '<div class="x1n2onr6">' + ' ' * 64 + '</div>'
+        page = ('<!DOCTYPE html><html><head><title>Instagram</title>'
+                '<meta property="og:description" content="Bench carousel (html)" />'
+                '</head><body>' + filler * self.config.get('html_filler', 200) +
+                '<script type="application/json" data-sjs>' + json.dumps(blob) + '</script>'
+                '</body></html>')
+        return web.Response(text=page, content_type='text/html')
+
+    # --- TikTok / TIKWM ---
+    async def tiktok_page(self, request: web.Request):
+        await self._api_delay()
+        self._count('www.tiktok.com')
+        # Pagina "da datacenter": niente JSON né caption -> il fallback passa da TIKWM
+        return web.Response(text='<!DOCTYPE html><html><head><title>TikTok - Make Your Day</title>'
+                                 '</head><body></body></html>', content_type='text/html')
+
+    async def tikwm(self, request: web.Request):
+        await self._api_delay()
+        self._count('www.tikwm.com')
+        form = await request.post()
+        tag = abs(hash(form.get('url', ''))) % 10 ** 8
+        size = self.config['image_bytes']
+        images = [cdn_url(size, f"tk_{tag}_{i}.jpg") for i in range(1, self.config['carousel'] + 1)]
+        return web.json_response({'code': 0, 'msg': 'success',
+                                  'data': {'images': images, 'title': 'Bench tiktok photo'}})
+
+    # --- Cobalt ---
+    async def cobalt(self, request: web.Request):
+        await self._api_delay()
+        self._count('cobalt.bench')
+        if request.method == 'GET':
+            return web.json_response({'cobalt': {'version': '10.bench', 'url': COBALT_URL}})
+        body = await request.json()
+        tag = abs(hash(body.get('url', ''))) % 10 ** 8
+        return web.json_response({'status': 'tunnel', 'filename': f"cobalt_{tag}.mp4",
+                                  'url': cdn_url(self.config['video_bytes'], f"cobalt_{tag}.mp4")})
+
+    # --- Facebook ---
+    async def facebook(self, request: web.Request):
+        await self._api_delay()
+        self._count('www.facebook.com')
+        tag = request.query.get('fbid') or request.query.get('v') or '0'
+        if request.path.startswith('/watch'):
+            mp4 = cdn_url(self.config['video_bytes'], f"fb_{tag}.mp4").replace('/', '\\/')
+            page = ('<html><head><title>Bench video | Facebook</title>'
+                    '<meta property="og:type" content="video.other" />'
+                    '<meta property="og:title" content="Bench video | Facebook" /></head><body>'
+                    '<script>{"playable_url":"' + mp4 + '"}</script></body></html>')
+        else:
+            img = cdn_url(self.config['image_bytes'], f"fb_{tag}.jpg")
+            page = ('<html><head><title>Bench photo</title>'
+                    f'<meta property="og:image" content="{img}" /></head><body></body></html>')
+        return web.Response(text=page, content_type='text/html')
+
+    async def _route(self, request: web.Request):
+        host = request.headers.get(BENCH_HOST_HEADER, '')
+        path = request.path
+        if host == 'cdn.bench' and path.startswith('/m/'):
+            parts = path.split('/')
+            return await self.cdn(request, int(parts[2]), parts[3])
+        if host == 'cobalt.bench':
+            return await self.cobalt(request)
+        if host.endswith('instagram.com'):
+            if path.startswith('/api/v1/media/'):
+                return await self.ig_api(request, path.split('/')[4])
+            return await self.ig_page(request, path.strip('/').split('/')[-1])
+        if host.endswith('tikwm.com'):
+            return await self.tikwm(request)
+        if host.endswith('tiktok.com'):
+            return await self.tiktok_page(request)
+        if host.endswith('facebook.com'):
+            return await self.facebook(request)
+        return web.Response(status=404, text=f"stand-in sconosciuto: {host}{path}")
+
+    def start(self):
+        ready = threading.Event()
+
+        def _serve():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            app = web.Application()
+            app.router.add_route('*', '/{tail:.*}', self._route)
+            runner = web.AppRunner(app, access_log=None)
+            self._loop.run_until_complete(runner.setup())
+            self._loop.run_until_complete(web.TCPSite(runner, '127.0.0.1', self.port).start())
+            ready.set()
+            self._loop.run_forever()
+
+        threading.Thread(target=_serve, name='bench-standins', daemon=True).start()
+        if not ready.wait(10):
+            raise RuntimeError('stand-in HTTP non partiti')
+
+
+class LocalRoute(HTTPAdapter):
+    """Adapter requests che manda TUTTO agli stand-in locali: host e schema
+    diventano 127.0.0.1:port, path e query restano, l'host vero va in un header.
+    Stesse dimensioni di pool della sessione di produzione (smd_http)."""
+
+    def __init__(self, port: int):
+        super().__init__(pool_connections=smd_http.HTTP_POOL_HOSTS,
+                         pool_maxsize=smd_http.HTTP_POOL_PER_HOST)
+        self.port = port
+
+    def send(self, request, **kwargs):
+        parts = urlsplit(request.url)
+        if parts.hostname != '127.0.0.1':
+            request.headers[BENCH_HOST_HEADER] = parts.hostname or ''
+            request.url = urlunsplit(('http', f"127.0.0.1:{self.port}", parts.path, parts.query, ''))
+        kwargs['proxies'] = {}
+        return super().send(request, **kwargs)
+
+
+# --------------------------
+# Misure
+# --------------------------
+
+def _rss_kb() -> int:
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    import resource
+    return int(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+class RssSampler:
+    """Picco di RSS in una finestra di tempo (campioni ogni `interval` s)."""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.start_kb = self.peak_kb = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.start_kb = self.peak_kb = _rss_kb()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='bench-rss', daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak_kb = max(self.peak_kb, _rss_kb())
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak_kb = max(self.peak_kb, _rss_kb())
+
+
+def _result_files(result) -> list:
+    if not isinstance(result, dict) or not result.get('success'):
+        return []
+    if result.get('type') == 'video':
+        return [result['file_path']]
+    return list(result.get('files') or [])
+
+
+def _p95(values: list) -> float:
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=20)[-1]
+
+
+# --------------------------
+# Downloader instradato sugli stand-in
+# --------------------------
+
+class Bench:
+    def __init__(self, standins: StandIns):
+        self.standins = standins
+        self.catalog = {}   # id nel link -> info dict restituito dallo stub yt-dlp
+        self._seq = 0
+        self.dl = SocialMediaDownloader()
+        self.dl.retry_delay = 0
+        route = LocalRoute(standins.port)
+        session = self.dl.http.session
+        session.trust_env = False
+        session.mount('https://', route)
+        session.mount('http://', route)
+        # Cobalt userebbe cloudscraper se installato: qui passa dalla stessa sessione
+        self.dl.http._scraper_failed = True
+        self.dl.instagram_cookies = self._write_ig_cookies()
+        self.dl.extract_info = self._fake_extract_info
+        self.dl.download_with_ytdlp = self._fake_download_with_ytdlp
+
+    def _write_ig_cookies(self) -> str:
+        path = os.path.join(BENCH_DIR, 'bench_instagram_cookies.txt')
+        exp = int(time.time()) + 86400
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('# Netscape HTTP Cookie File\n')
+            f.write(f".instagram.com\tTRUE\t/\tTRUE\t{exp}\tsessionid\tbench%3Asession\n")
+            f.write(f".instagram.com\tTRUE\t/\tTRUE\t{exp}\tcsrftoken\tbenchcsrf\n")
+        return path
+
+    def next_id(self) -> str:
+        self._seq += 1
+        return _shortcode(self._seq)
+
+    # --- stub yt-dlp ---
+    @staticmethod
+    def _link_id(url: str) -> str:
+        return urlsplit(url).path.strip('/').split('/')[-1]
+
+    async def _fake_extract_info(self, url: str, attempt: int = 0):
+        """extract_info senza yt-dlp: info dal catalogo (None = yt-dlp fallisce)."""
+        return self.catalog.get(self._link_id(url))
+
+    async def _fake_download_with_ytdlp(self, url: str, attempt: int = 0, info=None):
+        """download_with_ytdlp senza yt-dlp: scarica info['url'] dalla CDN finta
+        con lo stesso fetch a blocchi degli altri percorsi."""
+        info = info or self.catalog.get(self._link_id(url))
+        if not info or not info.get('url'):
+            return None
+        path = os.path.join(self.dl.temp_dir, f"{info['title'][:40]}_{info['id']}.mp4")
+        return await asyncio.to_thread(self.dl._fetch_to_file, info['url'], path, None, 60, None, True)
+
+    async def fetch_video(self, code: str, segmented_dl: bool):
+        """Solo il fetch di un video dalla CDN finta, a segmenti o a flusso unico."""
+        path = os.path.join(self.dl.temp_dir, f"fetch_{code}.mp4")
+        url = cdn_url(self.standins.config['video_bytes'], f"f_{code}.mp4")
+        ok = await asyncio.to_thread(self.dl._fetch_to_file, url, path, None, 60, None, segmented_dl)
+        return {'success': bool(ok), 'type': 'video', 'file_path': ok}
+
+    def add_video(self, code: str):
+        self.catalog[code] = {'id': code, 'title': 'Bench video', 'uploader': 'bench',
+                              'ext': 'mp4', 'duration': 30,
+                              'url': cdn_url(self.standins.config['video_bytes'], f"v_{code}.mp4")}
+
+    def add_carousel(self, code: str, n: int):
+        size = self.standins.config['image_bytes']
+        self.catalog[code] = {'id': code, 'title': 'Bench carousel', 'uploader': 'bench',
+                              '_type': 'playlist',
+                              'entries': [{'id': f"{code}_{i}", 'ext': 'jpg',
+                                           'url': cdn_url(size, f"c_{code}_{i}.jpg")}
+                                          for i in range(1, n + 1)]}
+
+    async def strategy(self, name: str, url: str):
+        """Una sola strategia di fallback, come la chiama la fase di emergenza."""
+        platform = self.dl.detect_platform(url)
+        self.dl.last_fallback_title = None
+        for sname, factory in self.dl._fallback_strategies(platform, url, 'Contenuto', 'Sconosciuto'):
+            if sname == name:
+                return await factory()
+        raise ValueError(f"strategia {name} non disponibile per {platform}")
+
+
+async def _measure(call, expect_files: int = 0) -> dict:
+    with RssSampler() as rss:
+        t0 = time.perf_counter()
+        error = None
+        try:
+            result = await call()
+        except Exception as e:
+            result, error = None, f"{type(e).__name__}: {e}"
+        latency = time.perf_counter() - t0
+    files = _result_files(result)
+    nbytes = sum(os.path.getsize(p) for p in files if os.path.exists(p))
+    inflight.drop_result_files(result)
+    row = {'ok': bool(files), 'latency_s': round(latency, 4), 'files': len(files), 'bytes': nbytes,
+           'throughput_mb_s': round(nbytes / MB / latency, 2) if latency > 0 else None,
+           'peak_rss_mb': round(rss.peak_kb / 1024, 1),
+           'rss_delta_mb': round((rss.peak_kb - rss.start_kb) / 1024, 1)}
+    if expect_files and len(files) != expect_files and not error:
+        # Slide perse o fuse (es. contenuti identici tolti dal dedupe): i numeri
+        # misurerebbero un altro carosello
+        row['ok'] = False
+        error = f"attesi {expect_files} file, arrivati {len(files)}"
+    if error:
+        row['error'] = error[:200]
+    return row
+
+
+def _scenario_calls(bench: Bench, name: str, n: int):
+    """Factory della chiamata per un giro dello scenario (link nuovo ogni volta)."""
+    code = bench.next_id()
+    dl = bench.dl
+    if name == 'ytdlp_video':
+        bench.add_video(code)
+        return lambda: dl.download_video(f"https://www.instagram.com/reel/{code}/")
+    if name == 'ytdlp_carousel':
+        bench.add_carousel(code, n)
+        return lambda: dl.download_video(f"https://www.instagram.com/p/{code}/")
+    if name in ('video_segmented', 'video_single'):
+        return lambda: bench.fetch_video(code, name == 'video_segmented')
+    if name == 'cobalt':
+        return lambda: bench.strategy('cobalt', f"https://www.instagram.com/reel/{code}/")
+    if name == 'tiktok_photo':
+        return lambda: dl.download_video(f"https://www.tiktok.com/@bench/photo/{_media_id(code)}")
+    if name == 'instagram_api':
+        return lambda: bench.strategy('instagram_api', f"https://www.instagram.com/p/{code}/")
+    if name == 'instagram_html':
+        return lambda: bench.strategy('instagram_html', f"https://www.instagram.com/p/{code}/")
+    if name == 'facebook_photo':
+        return lambda: bench.strategy('facebook', f"https://www.facebook.com/photo/?fbid={_media_id(code)}")
+    if name == 'facebook_video':
+        return lambda: bench.strategy('facebook', f"https://www.facebook.com/watch/?v={_media_id(code)}")
+    raise ValueError(f"scenario sconosciuto: {name}")
+
+
+async def run_scenario(bench: Bench, name: str, runs: int, n: int = 0) -> dict:
+    bench.standins.config['carousel'] = n or bench.standins.config['default_carousel']
+    rows = []
+    for _ in range(runs):
+        rows.append(await _measure(_scenario_calls(bench, name, n),
+                                   n if name == 'ytdlp_carousel' else 0))
+    return _summarize(name, rows, carousel=n or None)
+
+
+async def run_load(bench: Bench, concurrency: int, runs: int, n: int) -> dict:
+    """K download_video di caroselli diversi tutti insieme: latenza per richiesta
+    e throughput aggregato sul tempo totale."""
+    bench.standins.config['carousel'] = n
+    rows = []
+    for _ in range(runs):
+        calls = [_scenario_calls(bench, 'ytdlp_carousel', n) for _ in range(concurrency)]
+        with RssSampler() as rss:
+            t0 = time.perf_counter()
+            per_call = await asyncio.gather(*(_measure(c, n) for c in calls))
+            wall = time.perf_counter() - t0
+        nbytes = sum(r['bytes'] for r in per_call)
+        lat = [r['latency_s'] for r in per_call]
+        rows.append({'ok': all(r['ok'] for r in per_call), 'wall_s': round(wall, 4),
+                     'ok_requests': sum(1 for r in per_call if r['ok']),
+                     'latency_p50_s': round(statistics.median(lat), 4),
+                     'latency_p95_s': round(_p95(lat), 4),
+                     'bytes': nbytes,
+                     'throughput_mb_s': round(nbytes / MB / wall, 2) if wall > 0 else None,
+                     'requests_s': round(concurrency / wall, 2) if wall > 0 else None,
+                     'peak_rss_mb': round(rss.peak_kb / 1024, 1),
+                     'rss_delta_mb': round((rss.peak_kb - rss.start_kb) / 1024, 1)})
+    walls = [r['wall_s'] for r in rows]
+    return {'scenario': 'load', 'concurrency': concurrency, 'carousel': n, 'runs': len(rows),
+            'ok': sum(1 for r in rows if r['ok']),
+            'wall_median_s': round(statistics.median(walls), 4),
+            'throughput_median_mb_s': statistics.median([r['throughput_mb_s'] or 0 for r in rows]),
+            'requests_s_median': statistics.median([r['requests_s'] or 0 for r in rows]),
+            'latency_p95_max_s': max(r['latency_p95_s'] for r in rows),
+            'peak_rss_mb': max(r['peak_rss_mb'] for r in rows),
+            'results': rows}
+
+
+def _summarize(name: str, rows: list, **extra) -> dict:
+    lat = [r['latency_s'] for r in rows if r['ok']]
+    out = {'scenario': name, **{k: v for k, v in extra.items() if v is not None},
+           'runs': len(rows), 'ok': len(lat),
+           'latency_median_s': round(statistics.median(lat), 4) if lat else None,
+           'latency_p95_s': round(_p95(lat), 4) if lat else None,
+           'bytes_median': statistics.median([r['bytes'] for r in rows]) if rows else 0,
+           'throughput_median_mb_s': statistics.median(
+               [r['throughput_mb_s'] for r in rows if r['ok']]) if lat else None,
+           'peak_rss_mb': max(r['peak_rss_mb'] for r in rows) if rows else None,
+           'results': rows}
+    errors = [r['error'] for r in rows if r.get('error')]
+    if errors:
+        out['errors'] = errors[:3]
+    return out
+
+
+SCENARIOS = ('ytdlp_video', 'video_single', 'video_segmented', 'carousel', 'cobalt', 'tiktok_photo', 'instagram_api',
+             'instagram_html', 'facebook_photo', 'facebook_video', 'load')
+
+
+async def main_async(args) -> dict:
+    config = {'image_bytes': int(args.image_kb * 1024), 'video_bytes': int(args.video_mb * MB),
+              'default_carousel': 3, 'carousel': 3,
+              'cdn_latency_ms': args.cdn_latency_ms, 'api_latency_ms': args.api_latency_ms,
+              'cdn_conn_mbps': args.cdn_conn_mbps, 'cdn_ranges': not args.cdn_no_ranges}
+    standins = StandIns(_free_port(), config)
+    standins.start()
+    bench = Bench(standins)
+
+    wanted = [s.strip() for s in args.scenarios.split(',') if s.strip()]
+    sizes = [int(x) for x in args.carousel.split(',') if x.strip()]
+    results = []
+    # Un giro a vuoto: import pigri, pool di thread e connessioni non pesano sul primo scenario
+    await run_scenario(bench, 'ytdlp_carousel', 1, 3)
+    for name in wanted:
+        if name not in SCENARIOS:
+            raise SystemExit(f"scenario sconosciuto: {name} (validi: {', '.join(SCENARIOS)})")
+        if name == 'carousel':
+            for n in sizes:
+                results.append(await run_scenario(bench, 'ytdlp_carousel', args.runs, n))
+        elif name == 'load':
+            for k in [int(x) for x in args.concurrency.split(',') if x.strip()]:
+                results.append(await run_load(bench, k, args.runs, args.load_carousel))
+        else:
+            results.append(await run_scenario(bench, name, args.runs))
+        r = results[-1]
+        print(f"{r['scenario']:16s} {r.get('carousel') or r.get('concurrency') or '':>4} "
+              f"ok {r['ok']}/{r['runs']}  "
+              f"{r.get('latency_median_s') or r.get('wall_median_s')}s  "
+              f"{r.get('throughput_median_mb_s')} MB/s  rss {r.get('peak_rss_mb')} MB",
+              file=sys.stderr)
+
+    return {'benchmark': 'e2e', 'python': sys.version.split()[0], 'time': int(time.time()),
+            'config': {k: v for k, v in config.items() if k != 'carousel'},
+            'results': results, 'served': standins.served,
+            'segmented': segmented.stats(),
+            'http_pool': {k: v for k, v in bench.dl.http.stats().items() if k != 'pools'}}
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    ap.add_argument('--scenarios', default=','.join(SCENARIOS))
+    ap.add_argument('--runs', type=int, default=5)
+    ap.add_argument('--carousel', default='1,3,10', help='dimensioni dei caroselli yt-dlp')
+    ap.add_argument('--concurrency', default='1,4,16', help='download contemporanei per lo scenario load')
+    ap.add_argument('--load-carousel', type=int, default=3, help='slide per download nello scenario load')
+    ap.add_argument('--image-kb', type=float, default=300)
+    ap.add_argument('--video-mb', type=float, default=8)
+    ap.add_argument('--cdn-latency-ms', type=float, default=0, help='attesa prima della risposta CDN')
+    ap.add_argument('--cdn-conn-mbps', type=float, default=0,
+                    help='banda massima della CDN per connessione (0 = senza limite)')
+    ap.add_argument('--cdn-no-ranges', action='store_true', help='CDN senza supporto Range (risponde 200)')
+    ap.add_argument('--api-latency-ms', type=float, default=0, help='attesa delle API/pagine finte')
+    ap.add_argument('--out', help='file JSON di output (default: stdout)')
+    args = ap.parse_args()
+
+    report = asyncio.run(main_async(args))
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""Benchmark degli estrattori di immagini dall'HTML (fallback TikTok/Instagram).
+
+Confronta gli estrattori del working tree (html_islands: una passata sugli
+script, parse solo delle isole utili, dedupe O(n)) con quelli di una revisione
+git di riferimento (--baseline; default: la revisione prima di html_islands),
+sulle stesse pagine:
+
+  - corpus di pagine salvate (--corpus DIR: *.html; la piattaforma si capisce
+    dal nome del file o dal contenuto). Le pagine si ottengono col downloader in
+    debug (tiktok_dump.html in smd_debug/) o salvandole dal browser;
+  - senza corpus, pagine sintetiche con la struttura di quelle vere (isola
+    UNIVERSAL_DATA di TikTok, decine di script application/json su Instagram)
+    e dimensioni di qualche centinaio di KB.
+
+Per ogni pagina: tempo mediano (--repeat giri) di baseline e nuovo estrattore,
+speedup e controllo che gli URL estratti siano gli stessi. Output JSON (stdout
+o --out).
+
+Uso:
+    python bench_extract.py
+    python bench_extract.py --corpus pagine/ --repeat 50 --out extract.json
+    python bench_extract.py --baseline v1.2 --slides 35
+"""
+
+import os
+import sys
+import json
+import time
+import types
+import random
+import logging
+import importlib
+import argparse
+import statistics
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+logging.disable(logging.WARNING)   # i log INFO degli estrattori falserebbero i tempi
+
+_EXTRACTORS = {
+    'tiktok': ('smd_tiktok', 'TikTokMixin', '_extract_tiktok_photo_urls_from_html'),
+    'instagram': ('smd_instagram', 'InstagramMixin', '_extract_instagram_image_urls_from_html'),
+}
+
+
+class _Self:
+    """Il minimo di `self` che gli estrattori usano."""
+    debug = False
+
+
+def _git(*args) -> str:
+    return subprocess.run(['git', *args], cwd=HERE, check=True,
+                          capture_output=True, text=True).stdout.strip()
+
+
+def default_baseline() -> str:
+    added = _git('log', '--diff-filter=A', '--format=%H', '--', 'html_islands.py').splitlines()
+    return f"{added[-1]}~1" if added else 'HEAD'
+
+
+def load_baseline(rev: str) -> dict:
+    """Estrattori della revisione `rev` (moduli caricati dal sorgente in git)."""
+    out = {}
+    for platform, (module, cls, meth) in _EXTRACTORS.items():
+        source = _git('show', f"{rev}:{module}.py")
+        mod = types.ModuleType(f"baseline_{module}")
+        mod.__file__ = f"{rev}:{module}.py"
+        exec(compile(source, mod.__file__, 'exec'), mod.__dict__)
+        out[platform] = getattr(getattr(mod, cls), meth)
+    return out
+
+
+def current() -> dict:
+    return {platform: getattr(getattr(importlib.import_module(module), cls), meth)
+            for platform, (module, cls, meth) in _EXTRACTORS.items()}
+
+
+# --------------------------
+# Pagine sintetiche
+# --------------------------
+
+def _noise(rng: random.Random, n: int) -> dict:
+    return {f"k{i}": {'id': str(rng.getrandbits(48)), 'text': 'x' * rng.randint(20, 200),
+                      'flags': [rng.random() > 0.5 for _ in range(8)]} for i in range(n)}
+
+
+def _js_bundle(rng: random.Random, kb: int) -> str:
+    line = 'function f{0}(a,b){{return a+b*{0}}};'
+    out, size, i = [], 0, 0
+    while size < kb * 1024:
+        s = line.format(i)
+        out.append(s)
+        size += len(s)
+        i += 1
+    return ''.join(out)
+
+
+def tiktok_page(rng: random.Random, slides: int) -> str:
+    images = [{'imageURL': {'urlList': [
+        f"https://p16-sign-va.tiktokcdn.com/obj/tos-maliva-p-0068/{rng.getrandbits(64):x}~tplv-photomode-image.jpeg?x={i}",
+        f"https://p19-sign.tiktokcdn-us.com/obj/{rng.getrandbits(64):x}.jpeg"]},
+        'imageWidth': 1080, 'imageHeight': 1920} for i in range(slides)]
+    data = {'__DEFAULT_SCOPE__': {
+        'webapp.app-context': _noise(rng, 200),
+        'webapp.video-detail': {'itemInfo': {'itemStruct': {
+            'id': str(rng.getrandbits(63)), 'desc': 'Post sintetico #bench',
+            'imagePost': {'images': images, 'cover': images[0]},
+            'author': {'avatarThumb': 'https://p16.tiktokcdn.com/avatar.jpeg'},
+            'stats': _noise(rng, 20)}}},
+        'seo.abtest': _noise(rng, 300)}}
+    return ('<!DOCTYPE html><html><head><title>Post | TikTok</title>'
+            '<script>' + _js_bundle(rng, 120) + '</script>'
+            '<script id="__UNIVERSAL_DATA_FOR_REHYDRATION__" type="application/json">'
+            + json.dumps(data) + '</script>'
+            '<script type="application/json" id="api-domains">' + json.dumps(_noise(rng, 30)) + '</script>'
+            '</head><body><div id="app"></div>'
+            '<script>' + _js_bundle(rng, 80) + '</script></body></html>')
+
+
+def instagram_page(rng: random.Random, slides: int) -> str:
+    media = [{'pk': str(rng.getrandbits(60)), 'id': f"{rng.getrandbits(60)}_1",
+              'image_versions2': {'candidates': [
+                  {'url': f"https://scontent.cdninstagram.com/v/t51.29350-15/{rng.getrandbits(64):x}_n.jpg?stp=dst-jpg_e35&_nc_ht=x{i}",
+                   'width': 1080, 'height': 1350},
+                  {'url': f"https://scontent.cdninstagram.com/v/t51.29350-15/{rng.getrandbits(64):x}_s640.jpg",
+                   'width': 640, 'height': 800}]}} for i in range(slides)]
+    post = {'require': [['ScheduledServerJS', 'handle', None, [{'__bbox': {'require': [[
+        'RelayPrefetchedStreamCache', 'next', [], ['adp_PolarisPostRootQuery', {'__bbox': {'result': {
+            'data': {'xdt_api__v1__media__shortcode__web_info': {'items': [{
+                'code': 'Cbench', 'carousel_media': media,
+                'caption': {'text': 'Carosello sintetico'}, 'user': _noise(rng, 5)}]}}}}}]]]}}]]]}
+    scripts = ['<script type="application/json" data-sjs>' + json.dumps({'require': [_noise(rng, 25)]}) + '</script>'
+               for _ in range(60)]
+    scripts.insert(40, '<script type="application/json" data-sjs>' + json.dumps(post) + '</script>')
+    return ('<!DOCTYPE html><html><head><title>Instagram</title>'
+            '<meta property="og:image" content="https://scontent.cdninstagram.com/og.jpg" />'
+            '</head><body><script>' + _js_bundle(rng, 60) + '</script>'
+            + ''.join(scripts) + '</body></html>')
+
+
+def synthetic_corpus(seed: int, slides: int) -> list:
+    rng = random.Random(seed)
+    return [(f"synthetic_tiktok_{slides}", 'tiktok', tiktok_page(rng, slides)),
+            ("synthetic_tiktok_1", 'tiktok', tiktok_page(rng, 1)),
+            (f"synthetic_instagram_{slides}", 'instagram', instagram_page(rng, slides)),
+            ("synthetic_instagram_1", 'instagram', instagram_page(rng, 1))]
+
+
+def load_corpus(path: str) -> list:
+    pages = []
+    for name in sorted(os.listdir(path)):
+        if not name.lower().endswith(('.html', '.htm')):
+            continue
+        with open(os.path.join(path, name), 'r', encoding='utf-8', errors='replace') as f:
+            text = f.read()
+        low = name.lower()
+        if 'tiktok' in low or ('instagram' not in low and 'tiktok' in text[:20000].lower()):
+            platform = 'tiktok'
+        else:
+            platform = 'instagram'
+        pages.append((name, platform, text))
+    return pages
+
+
+# --------------------------
+# Misure
+# --------------------------
+
+def _time(fn, html: str, repeat: int):
+    times, out = [], None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn(_Self(), html)
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times), out
+
+
+def run(pages: list, baseline: dict, new: dict, repeat: int) -> list:
+    results = []
+    for name, platform, html in pages:
+        old_s, old_urls = _time(baseline[platform], html, repeat)
+        new_s, new_urls = _time(new[platform], html, repeat)
+        results.append({
+            'page': name, 'platform': platform, 'kb': round(len(html) / 1024, 1),
+            'urls': len(new_urls), 'same_urls': old_urls == new_urls,
+            'baseline_ms': round(old_s * 1000, 3), 'new_ms': round(new_s * 1000, 3),
+            'speedup': round(old_s / new_s, 2) if new_s > 0 else None,
+        })
+        r = results[-1]
+        print(f"{name:32s} {r['kb']:8.1f} KB  {r['baseline_ms']:9.3f} -> {r['new_ms']:9.3f} ms  "
+              f"x{r['speedup']}  {'ok' if r['same_urls'] else 'URL DIVERSI'}", file=sys.stderr)
+    return results
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    ap.add_argument('--corpus', help='cartella con pagine .html salvate (default: pagine sintetiche)')
+    ap.add_argument('--baseline', help='revisione git di riferimento (default: prima di html_islands)')
+    ap.add_argument('--repeat', type=int, default=20)
+    ap.add_argument('--slides', type=int, default=10, help='slide delle pagine sintetiche')
+    ap.add_argument('--seed', type=int, default=1)
+    ap.add_argument('--out', help='file JSON di output (default: stdout)')
+    args = ap.parse_args()
+
+    rev = args.baseline or default_baseline()
+    pages = load_corpus(args.corpus) if args.corpus else synthetic_corpus(args.seed, args.slides)
+    results = run(pages, load_baseline(rev), current(), max(1, args.repeat))
+    speedups = [r['speedup'] for r in results if r['speedup']]
+    report = {'benchmark': 'extract', 'python': sys.version.split()[0], 'time': int(time.time()),
+              'baseline': rev, 'repeat': args.repeat, 'results': results,
+              'summary': {'pages': len(results),
+                          'same_urls': sum(1 for r in results if r['same_urls']),
+                          'speedup_median': statistics.median(speedups) if speedups else None,
+                          'speedup_min': min(speedups) if speedups else None}}
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
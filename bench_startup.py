@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""Benchmark dell'avvio del bot: tempo fino alla prima risposta a un update.
+
+Avvia bot.py in un sottoprocesso puntato (TELEGRAM_BASE_URL) a uno stand-in
+locale della Bot API, manda un /start e misura:
+
+  - api_s:   primo contatto con la Bot API (getMe) dopo il lancio del processo;
+  - ready_s: bot pronto a ricevere (primo getUpdates in polling, setWebhook in
+             webhook);
+  - first_update_s: risposta al primo update (sendMessage) = time-to-first-update.
+
+Per ogni modalità (polling / webhook) e ogni valore di FAST_STARTUP (1 / 0).
+L'output è JSON (stdout o --out) per confrontare le esecuzioni nel tempo.
+
+Uso:
+    python bench_startup.py                         # polling+webhook, FAST_STARTUP 1 e 0, 3 giri
+    python bench_startup.py --modes polling --runs 5 --out startup.json
+
+Il webhook di python-telegram-bot richiede l'extra [webhooks] (tornado): se manca
+la modalità webhook risulta in errore, le altre misure restano valide.
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import threading
+import statistics
+import subprocess
+import urllib.request
+
+from aiohttp import web
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TOKEN = '123456:BENCH'
+CHAT_ID = 4242
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _start_update(update_id: int = 1) -> dict:
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': 1, 'date': int(time.time()),
+            'chat': {'id': CHAT_ID, 'type': 'private', 'first_name': 'Bench'},
+            'from': {'id': CHAT_ID, 'is_bot': False, 'first_name': 'Bench'},
+            'text': '/start',
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': 6}],
+        },
+    }
+
+
+class FakeBotApi:
+    """Bot API minima: getMe, getUpdates (un /start al primo giro), sendMessage,
+    setWebhook/deleteWebhook e "ok" per tutto il resto. Registra gli istanti."""
+
+    def __init__(self, port: int):
+        self.port = port
+        self.events = {}
+        self._delivered = False
+        self._loop = None
+        self._runner = None
+
+    def mark(self, name: str):
+        self.events.setdefault(name, time.monotonic())
+
+    def reset(self):
+        self.events = {}
+        self._delivered = False
+
+    async def _handle(self, request: web.Request):
+        method = request.match_info['method']
+        if method == 'getMe':
+            self.mark('api')
+            return web.json_response({'ok': True, 'result': {
+                'id': 1, 'is_bot': True, 'first_name': 'Nello', 'username': 'nello_bench_bot',
+                'can_join_groups': True, 'can_read_all_group_messages': True,
+                'supports_inline_queries': False}})
+        if method == 'getUpdates':
+            self.mark('ready')
+            if not self._delivered:
+                self._delivered = True
+                return web.json_response({'ok': True, 'result': [_start_update()]})
+            await asyncio.sleep(0.5)
+            return web.json_response({'ok': True, 'result': []})
+        if method == 'setWebhook':
+            self.mark('ready')
+        if method == 'sendMessage':
+            self.mark('first_update')
+            return web.json_response({'ok': True, 'result': {
+                'message_id': 2, 'date': int(time.time()),
+                'chat': {'id': CHAT_ID, 'type': 'private'}, 'text': 'ok'}})
+        return web.json_response({'ok': True, 'result': True})
+
+    def start(self):
+        ready = threading.Event()
+
+        def _serve():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            app = web.Application()
+            app.router.add_route('*', '/bot{token}/{method}', self._handle)
+            self._runner = web.AppRunner(app)
+            self._loop.run_until_complete(self._runner.setup())
+            self._loop.run_until_complete(web.TCPSite(self._runner, '127.0.0.1', self.port).start())
+            ready.set()
+            self._loop.run_forever()
+
+        threading.Thread(target=_serve, daemon=True).start()
+        ready.wait(10)
+
+
+def _post_webhook_update(port: int, deadline: float) -> bool:
+    """Manda il /start al webhook del bot appena il server accetta connessioni."""
+    body = json.dumps(_start_update()).encode()
+    while time.monotonic() < deadline:
+        try:
+            req = urllib.request.Request(f"http://127.0.0.1:{port}/hook", data=body,
+                                         headers={'Content-Type': 'application/json'})
+            with urllib.request.urlopen(req, timeout=2) as r:
+                if r.status == 200:
+                    return True
+        except Exception:
+            time.sleep(0.05)
+    return False
+
+
+def run_once(api: FakeBotApi, mode: str, fast: bool, timeout: float) -> dict:
+    api.reset()
+    port = _free_port()
+    env = dict(os.environ)
+    for k in ('DISCORD_TOKEN', 'WHATSAPP_ENABLED', 'RENDER_API_KEY', 'RENDER_SERVICE_ID', 'POT_SELFTEST'):
+        env.pop(k, None)
+    env.update({
+        'TELEGRAM_BOT_TOKEN': TOKEN,
+        'TELEGRAM_BASE_URL': f"http://127.0.0.1:{api.port}",
+        'PORT': str(port),
+        'FAST_STARTUP': '1' if fast else '0',
+        'USE_WEBHOOK': '1' if mode == 'webhook' else '0',
+        'WEBHOOK_URL': f"http://127.0.0.1:{port}/hook",
+        'WEBHOOK_PATH': 'hook',
+    })
+    t0 = time.monotonic()
+    proc = subprocess.Popen([sys.executable, os.path.join(HERE, 'bot.py')], cwd=HERE, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    deadline = t0 + timeout
+    error = None
+    try:
+        if mode == 'webhook':
+            while 'ready' not in api.events and time.monotonic() < deadline and proc.poll() is None:
+                time.sleep(0.02)
+            if 'ready' in api.events and not _post_webhook_update(port, deadline):
+                error = 'webhook non raggiungibile'
+        while 'first_update' not in api.events and time.monotonic() < deadline:
+            if proc.poll() is not None:
+                error = f"bot uscito (codice {proc.returncode})"
+                break
+            time.sleep(0.02)
+        if 'first_update' not in api.events and not error:
+            error = 'timeout'
+    finally:
+        proc.terminate()
+        try:
+            _, err = proc.communicate(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            _, err = proc.communicate()
+    result = {'mode': mode, 'fast_startup': fast}
+    for name in ('api', 'ready', 'first_update'):
+        result[f"{name}_s"] = round(api.events[name] - t0, 3) if name in api.events else None
+    if error:
+        result['error'] = error
+        result['stderr_tail'] = (err or b'').decode('utf-8', 'replace')[-600:]
+    return result
+
+
+def summarize(results: list) -> list:
+    out = []
+    groups = {}
+    for r in results:
+        groups.setdefault((r['mode'], r['fast_startup']), []).append(r)
+    for (mode, fast), rows in groups.items():
+        ok = [r['first_update_s'] for r in rows if r.get('first_update_s') is not None]
+        out.append({
+            'mode': mode, 'fast_startup': fast, 'runs': len(rows), 'ok': len(ok),
+            'first_update_median_s': round(statistics.median(ok), 3) if ok else None,
+            'first_update_min_s': min(ok) if ok else None,
+            'first_update_max_s': max(ok) if ok else None,
+        })
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    ap.add_argument('--modes', default='polling,webhook')
+    ap.add_argument('--fast', default='1,0', help='valori di FAST_STARTUP da provare')
+    ap.add_argument('--runs', type=int, default=3)
+    ap.add_argument('--timeout', type=float, default=90.0)
+    ap.add_argument('--out', help='file JSON di output (default: stdout)')
+    args = ap.parse_args()
+
+    api = FakeBotApi(_free_port())
+    api.start()
+    results = []
+    for mode in [m.strip() for m in args.modes.split(',') if m.strip()]:
+        for fast in [f.strip() == '1' for f in args.fast.split(',') if f.strip()]:
+            for i in range(args.runs):
+                r = run_once(api, mode, fast, args.timeout)
+                r['run'] = i + 1
+                results.append(r)
+                print(f"{mode:8s} FAST_STARTUP={int(fast)} #{i + 1}: "
+                      f"{r.get('first_update_s')}s {r.get('error', '')}", file=sys.stderr)
+
+    report = {'benchmark': 'startup', 'python': sys.version.split()[0],
+              'time': int(time.time()), 'results': results, 'summary': summarize(results)}
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
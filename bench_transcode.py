@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""Benchmark della ricompressione per i limiti dei frontend (transcode.fit).
+
+Confronta transcode del working tree (un ffprobe, plan() sceglie risoluzione e
+tetto di bitrate, un encode CRF+VBV; remux dei webm/mkv H.264 che ci stanno)
+con quello di una revisione git di riferimento (--baseline; default: la
+revisione che ha introdotto transcode.py, con l'encoder a tentativi 0.92/0.72
+a 480/540p), sugli stessi clip:
+
+  - clip veri (--clips DIR: *.mp4 *.mkv *.webm *.mov), tutti col profilo
+    --profile;
+  - senza --clips, clip sintetici generati con ffmpeg (testsrc2 + rumore, che
+    non si comprime "gratis", e un tono AAC): appena sopra i 10MB di Discord,
+    verticale 1080x1920, lungo a 480p, 1080p60 per WhatsApp, un mkv che ci sta
+    già (solo contenitore da sistemare).
+
+Per ogni clip e versione: esito (sotto il limite del profilo?), encode
+lanciati, secondi, dimensione e risoluzione del risultato. In fondo, per
+versione: successi, encode per successo e tempo totale. Output JSON (stdout o
+--out). Serve ffmpeg/ffprobe nel PATH (come nell'immagine Docker).
+
+Uso:
+    python bench_transcode.py
+    python bench_transcode.py --only over_10_720p,long_480 --out transcode.json
+    python bench_transcode.py --clips video/ --profile whatsapp
+"""
+
+import os
+import sys
+import json
+import time
+import types
+import shutil
+import asyncio
+import logging
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+import transcode  # noqa: E402
+import media_probe  # noqa: E402
+
+logging.disable(logging.WARNING)
+
+# nome, larghezza, altezza, fps, secondi, kbps video, profilo, contenitore
+SYNTHETIC = [
+    ('over_10_720p', 1280, 720, 30, 30, 3200, 'discord', 'mp4'),
+    ('over_10_vertical', 1080, 1920, 30, 40, 4000, 'discord', 'mp4'),
+    ('long_480', 854, 480, 30, 150, 1200, 'discord', 'mp4'),
+    ('over_16_1080p60', 1920, 1080, 60, 45, 6000, 'whatsapp', 'mp4'),
+    ('fits_mkv', 1280, 720, 30, 10, 2000, 'discord', 'mkv'),
+]
+
+
+def _git(*args) -> str:
+    return subprocess.run(['git', *args], cwd=HERE, check=True,
+                          capture_output=True, text=True).stdout.strip()
+
+
+def default_baseline() -> str:
+    added = _git('log', '--diff-filter=A', '--format=%H', '--', 'transcode.py').splitlines()
+    return added[-1] if added else 'HEAD'
+
+
+def load_baseline(rev: str) -> types.ModuleType:
+    """transcode.py della revisione `rev` (caricato dal sorgente in git)."""
+    source = _git('show', f"{rev}:transcode.py")
+    mod = types.ModuleType('baseline_transcode')
+    mod.__file__ = f"{rev}:transcode.py"
+    exec(compile(source, mod.__file__, 'exec'), mod.__dict__)
+    return mod
+
+
+def make_clip(path: str, w: int, h: int, fps: int, dur: int, kbps: int) -> None:
+    """Clip sintetico: testsrc2 con rumore (bitrate vero, non banale) + tono AAC."""
+    subprocess.run([
+        'ffmpeg', '-y', '-v', 'error',
+        '-f', 'lavfi', '-i', f'testsrc2=size={w}x{h}:rate={fps},noise=alls=14:allf=t+u',
+        '-f', 'lavfi', '-i', 'sine=frequency=440:sample_rate=48000',
+        '-t', str(dur), '-map', '0:v', '-map', '1:a',
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-b:v', f'{kbps}k',
+        '-maxrate', f'{kbps}k', '-bufsize', f'{kbps * 2}k', '-pix_fmt', 'yuv420p',
+        '-c:a', 'aac', '-b:a', '128k', path,
+    ], check=True)
+
+
+def synthetic_clips(root: str, only) -> list:
+    clips = []
+    for name, w, h, fps, dur, kbps, profile, ext in SYNTHETIC:
+        if only and name not in only:
+            continue
+        path = os.path.join(root, f"{name}.{ext}")
+        print(f"genero {name} ({w}x{h}@{fps}, {dur}s)...", file=sys.stderr)
+        make_clip(path, w, h, fps, dur, kbps)
+        clips.append((name, path, profile))
+    return clips
+
+
+def load_clips(folder: str, profile: str, only) -> list:
+    exts = ('.mp4', '.mkv', '.webm', '.mov')
+    return [(os.path.splitext(n)[0], os.path.join(folder, n), profile)
+            for n in sorted(os.listdir(folder))
+            if n.lower().endswith(exts) and (not only or os.path.splitext(n)[0] in only)]
+
+
+def _run_one(mod: types.ModuleType, src: str, profile: str) -> dict:
+    """Una fit() su una copia del clip in una temp_dir vuota (niente cache)."""
+    work = tempfile.mkdtemp(prefix='bench_tc_')
+    try:
+        path = os.path.join(work, os.path.basename(src))
+        shutil.copyfile(src, path)
+        mod._failed.clear()
+        before = dict(mod._stats)
+        t0 = time.perf_counter()
+        out = asyncio.run(mod.fit(path, profile, 'bench'))
+        wall = time.perf_counter() - t0
+        limit = mod.PROFILES[profile].limit
+        size = os.path.getsize(out) if out and os.path.exists(out) else None
+        probe = asyncio.run(media_probe.probe(out)) if size else None
+        return {
+            'ok': bool(size and size <= limit),
+            'encodes': mod._stats.get('encodes', 0) - before.get('encodes', 0),
+            'remuxes': mod._stats.get('remuxes', 0) - before.get('remuxes', 0),
+            'seconds': round(wall, 2),
+            'out_mb': round(size / (1024 * 1024), 2) if size else None,
+            'resolution': f"{probe.width}x{probe.height}" if probe else None,
+            'container': os.path.splitext(out)[1] if out else None,
+        }
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+def run(clips: list, versions: dict) -> list:
+    results = []
+    for name, path, profile in clips:
+        src = asyncio.run(media_probe.probe(path)) or media_probe.MediaInfo()
+        row = {'clip': name, 'profile': profile,
+               'src_mb': round(os.path.getsize(path) / (1024 * 1024), 2),
+               'src': f"{src.width}x{src.height}@{src.fps:.0f} {src.duration:.0f}s "
+                      f"{src.vcodec}/{src.acodec}"}
+        for label, mod in versions.items():
+            row[label] = _run_one(mod, path, profile)
+        results.append(row)
+        b, n = row['baseline'], row['new']
+        print(f"{name:20s} {row['src_mb']:7.1f} MB  baseline {b['encodes']} enc {b['seconds']:7.1f}s "
+              f"{'ok' if b['ok'] else 'NO'}  ->  nuovo {n['encodes']} enc {n['seconds']:7.1f}s "
+              f"{'ok' if n['ok'] else 'NO'} {n['resolution']}", file=sys.stderr)
+    return results
+
+
+def summary(results: list, label: str) -> dict:
+    rows = [r[label] for r in results]
+    ok = sum(1 for r in rows if r['ok'])
+    encodes = sum(r['encodes'] for r in rows)
+    times = [r['seconds'] for r in rows]
+    return {'successes': ok, 'clips': len(rows), 'encodes': encodes,
+            'encodes_per_success': round(encodes / ok, 2) if ok else None,
+            'seconds_total': round(sum(times), 1),
+            'seconds_median': statistics.median(times) if times else None}
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    ap.add_argument('--clips', help='cartella con video veri (default: clip sintetici)')
+    ap.add_argument('--profile', default='discord', choices=sorted(transcode.PROFILES),
+                    help='profilo per i clip di --clips')
+    ap.add_argument('--only', help='solo questi clip (nomi separati da virgola)')
+    ap.add_argument('--baseline', help='revisione git di riferimento (default: prima versione di transcode.py)')
+    ap.add_argument('--out', help='file JSON di output (default: stdout)')
+    args = ap.parse_args()
+
+    if not (shutil.which('ffmpeg') and shutil.which('ffprobe')):
+        sys.exit('servono ffmpeg e ffprobe nel PATH')
+    only = set(args.only.split(',')) if args.only else None
+    rev = args.baseline or default_baseline()
+    tmp = tempfile.mkdtemp(prefix='bench_clips_')
+    try:
+        clips = load_clips(args.clips, args.profile, only) if args.clips else synthetic_clips(tmp, only)
+        results = run(clips, {'baseline': load_baseline(rev), 'new': transcode})
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    report = {'benchmark': 'transcode', 'python': sys.version.split()[0], 'time': int(time.time()),
+              'baseline': rev, 'cpu_count': os.cpu_count(), 'threads': transcode.THREADS,
+              'results': results,
+              'summary': {'baseline': summary(results, 'baseline'), 'new': summary(results, 'new')}}
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -15,6 +15,7 @@ import random
 import pytz
 from datetime import time, datetime, timedelta
 from collections import defaultdict
+from typing import Dict, Optional
 
 from aiohttp import web
 from telegram import Update
@@ -75,6 +76,9 @@ COOKIE_TARGETS = {
 
 # Limite di upload della Bot API di Telegram (50MB per i bot standard)
 TELEGRAM_MAX_BYTES = 50 * 1024 * 1024
+# Dimensione massima scaricata: i video oltre i 50MB si ricomprimono (transcode.py,
+# profilo 'telegram'), oltre questa soglia non si scaricano nemmeno.
+TELEGRAM_SOURCE_MAX_BYTES = int(max(float(os.getenv('TELEGRAM_SOURCE_MAX_MB', '100')), 50) * 1024 * 1024)
 
 # Timeout complessivo per un singolo download (oltre, si molla e si avvisa l'utente)
 DOWNLOAD_TIMEOUT = int(os.getenv('DOWNLOAD_TIMEOUT', '150'))
@@ -96,7 +100,11 @@ logger = logging.getLogger(__name__)
 # Storage del ranking: Firebase Firestore se configurato, altrimenti file JSON locale.
 # Il path JSON e' usato solo come fallback (vedi ranking_store.py).
 _RANKING_JSON_FALLBACK = os.getenv('RANKING_FILE', os.path.join(os.path.dirname(__file__), 'ranking_data.json'))
-ranking_store = get_ranking_store(_RANKING_JSON_FALLBACK)
+# Avvio rapido (default): firebase-admin, health-check Firestore, downloader (yt-dlp
+# + cookie) e frontend Discord/WhatsApp si inizializzano in background e il polling
+# parte subito. FAST_STARTUP=0 torna all'inizializzazione in sequenza.
+FAST_STARTUP = os.getenv('FAST_STARTUP', '1') == '1'
+ranking_store = get_ranking_store(_RANKING_JSON_FALLBACK, background=FAST_STARTUP)
 
 BADGES = ["🥇", "🥈", "🥉"]
 
@@ -147,15 +155,27 @@ NELLO_ERRORS = [
 # Downloader condiviso (istanziato una sola volta: evita di ricreare l'oggetto
 # e di rilanciare il log della versione yt-dlp ad ogni messaggio)
 _downloader = None
+_downloader_lock = threading.Lock()
 
 
 def get_downloader() -> SocialMediaDownloader:
     global _downloader
     if _downloader is None:
-        _downloader = SocialMediaDownloader(debug=os.getenv('SMD_DEBUG', '0') == '1')
+        # Lock: con FAST_STARTUP il primo a costruirlo può essere il thread di warm-up
+        with _downloader_lock:
+            if _downloader is None:
+                _downloader = SocialMediaDownloader(debug=os.getenv('SMD_DEBUG', '0') == '1')
     return _downloader
 
 
+async def get_audio(url: str, owner: str) -> Dict:
+    """Audio (mp3 o m4a) del link: dalla cache audio o con un download_audio, uno solo
+    per i click contemporanei. Il file resta in cache: chi lo riceve non lo cancella."""
+    dl = get_downloader()
+    return await audio_cache.get_cache(dl.temp_dir).fetch(
+        url, lambda: scheduler.run(lambda: dl.download_audio(url), dl.detect_platform(url), owner))
+
+
 def is_supported_link(url: str) -> bool:
     is_supported = any(d in url for d in [
         "tiktok.com", "instagram.com", "facebook.com", "fb.watch",
@@ -174,6 +194,22 @@ def is_supported_link(url: str) -> bool:
 # (condivisi con i frontend Discord/WhatsApp). Qui restano gli alias + il wrapper
 # di build_caption con la "salsa" Telegram (menzione cliccabile, icone casuali, HTML).
 import core
+import inflight
+import media_cache
+import shortlinks
+import scheduler
+import hedge
+import cookie_registry
+import janitor
+import cobalt_health
+import size_guard
+import segmented
+import partials
+import audio_cache
+import audio_derive
+import transcode
+import media_probe
+import ydl_pool
 from core import (detect_platform, media_label, VIDEO_EXTS,
                   ICONS_VIDEO, ICONS_FOTO, ICONS_USER, ICONS_LINK, ICONS_META)
 _clean_title = core.clean_title
@@ -202,6 +238,63 @@ def build_caption(info: dict, url: str, sender_name: str, raw_title: str, sender
     return core.build_caption(info, url, sender, raw_title,
                               dialect='html', icons=icons, invite=False)
 
+
+def _too_big_text(size, url: str) -> str:
+    """Messaggio per un media oltre il limite di Telegram (`size` in byte, None
+    se lo scarto è avvenuto a metà download e la dimensione vera non si sa)."""
+    what = f"Il file ({size / (1024 * 1024):.0f}MB)" if size else "Il file"
+    return (
+        f"🐘 <b>Troppo pesante per Nello!</b>\n\n"
+        f"{what} supera il limite di 50MB di Telegram "
+        f"per i bot, non posso inviarlo.\n(Link: {escape(url)})"
+    )
+
+
+async def _fit_for_telegram(info: dict, owner: str) -> None:
+    """Ricomprime (in place nel risultato) i video oltre il limite di Telegram;
+    quelli che ci stanno al massimo passano a mp4 senza ricodificare. Quelli che
+    non rientrano restano com'erano: li scarta il controllo dopo. Per un video
+    singolo l'originale resta in info["source_path"] (per audio_derive: la copia
+    ricompressa ha l'audio ricodificato); lo cancella chi invia."""
+    if info.get("type", "video") == "video":
+        paths = [info.get("file_path")]
+    else:
+        paths = list(info.get("files", []) or [])
+    changed = False
+    for i, p in enumerate(paths):
+        if not (p and os.path.splitext(p)[1].lower() in VIDEO_EXTS and os.path.exists(p)):
+            continue
+        newp = await transcode.fit(p, 'telegram', owner, info.get("duration"))
+        if newp and newp != p:
+            if info.get("type", "video") == "video":
+                info["source_path"] = p
+            else:
+                try:
+                    os.remove(p)
+                except Exception:
+                    pass
+            paths[i] = newp
+            changed = True
+    if changed:
+        if info.get("type", "video") == "video":
+            info["file_path"] = paths[0]
+        else:
+            info["files"] = paths
+
+
+async def _video_meta(path: str) -> dict:
+    """Dimensioni e durata per send_video/InputMediaVideo, dal probe condiviso
+    (di solito già fatto da transcode.fit sullo stesso file): senza, Telegram
+    mostra il video quadrato/senza durata finché non lo apri. Vuoto se non si sa."""
+    info = await media_probe.probe(path)
+    if info is None or not info.has_video:
+        return {}
+    meta = {'width': info.width or None, 'height': info.height or None,
+            'duration': int(round(info.duration)) or None}
+    if info.moov_first:
+        meta['supports_streaming'] = True   # moov in testa: parte prima del download completo
+    return {k: v for k, v in meta.items() if v}
+
 # =========================
 # CACHE file_id (rinvio istantaneo)
 # =========================
@@ -458,8 +551,9 @@ async def on_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await q.answer("🎵 Estraggo l'audio, un attimo...")
         loading = await context.bot.send_message(q.message.chat_id, "🎵 Estraggo l'audio...")
         try:
-            info = await get_downloader().download_audio(url)
+            info = await get_audio(url, f"tg:{q.message.chat_id}:{q.from_user.id}")
             if info and info.get("success"):
+                # Il file sta nella cache audio: si manda senza cancellarlo
                 path = info["file_path"]
                 if os.path.getsize(path) > TELEGRAM_MAX_BYTES:
                     await context.bot.send_message(q.message.chat_id, "🐘 Audio troppo grande per Telegram (>50MB).")
@@ -469,10 +563,6 @@ async def on_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                             chat_id=q.message.chat_id, audio=f,
                             title=info.get("title"), performer=info.get("uploader"),
                         )
-                try:
-                    os.remove(path)
-                except Exception:
-                    pass
             else:
                 await context.bot.send_message(q.message.chat_id, "⚠️ Non riesco a estrarre l'audio da questo link.")
         except Exception as e:
@@ -489,11 +579,9 @@ async def on_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # DEDUP / RATE LIMIT / ACHIEVEMENT
 # =========================
 
-def link_key(url: str) -> str:
-    """Chiave normalizzata di un link (per 'gia' postato'): host+path senza query."""
-    u = url.strip().lower().split('?')[0].split('#')[0]
-    u = u.replace('https://', '').replace('http://', '').replace('www.', '')
-    return u.rstrip('/')
+# La chiave normalizzata dei link vive in core.py: la usa anche il downloader per
+# unire i download identici in corso tra Telegram, Discord e WhatsApp.
+link_key = core.link_key
 
 
 # Rate limit anti-spam: max N download/ora per utente (in memoria, si azzera ai restart)
@@ -885,13 +973,16 @@ async def on_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("⚠️ Non sembra un file cookie Netscape valido (righe con 7 campi separati da TAB).")
         return
 
-    # 1) Effetto immediato: sovrascrive il file cookie usato dal downloader
+    # 1) Effetto immediato: sovrascrive il file cookie usato dal downloader. Il path
+    #    viene dal registro condiviso, quindi vale anche per Discord e WhatsApp; il
+    #    cambio di mtime fa riparsare il file al prossimo uso.
     immediate = False
     try:
         path = getattr(get_downloader(), attr, None)
         if path:
             with open(path, 'w', encoding='utf-8', newline='\n') as fh:
                 fh.write(content)
+            get_downloader().cookies.view(path)
             immediate = True
     except Exception as e:
         logger.warning(f"Scrittura cookie live fallita: {e}")
@@ -936,6 +1027,112 @@ async def chats_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(text, parse_mode=ParseMode.HTML)
 
 
+async def stato_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin: statistiche di prestazione del motore di download."""
+    if update.effective_user.id != ADMIN_USER_ID:
+        await update.message.reply_text("🔒 Solo l'admin può usare questo comando.")
+        return
+    mb = 1024 * 1024
+    cs = get_downloader().media_cache.stats()
+    fs = inflight.stats()
+    ds = media_cache.digest_stats()
+    lines = [
+        "📊 <b>Stato del motore di download</b>",
+        "",
+        f"💾 <b>Cache media:</b> {cs['entries']} voci, {cs['bytes'] / mb:.0f}/{cs['max_bytes'] / mb:.0f} MB\n"
+        f"   hit {cs['hits']} · miss {cs['misses']} ({cs['hit_rate']:.0%}) · sfratti {cs['evictions']}\n"
+        f"   digest: {ds['streamed']} calcolati in download, {ds['rehashed']} riletti da disco",
+        f"🔗 <b>Download condivisi:</b> {fs['followers']} risparmiati su "
+        f"{fs['leaders'] + fs['followers']} richieste ({fs['in_flight']} in corso)",
+    ]
+    ss = shortlinks.stats()
+    lines.append(f"🔀 <b>Short link:</b> {ss['resolved']} risolti, {ss['failed']} falliti, "
+                 f"{ss['hits']} dalla cache ({ss['entries']} in memoria) · "
+                 f"media {ss['avg_ms']:.0f} ms, max {ss['max_ms']:.0f} ms")
+    sc = scheduler.stats()
+    active = ", ".join(f"{k} {v}" for k, v in sc['active'].items()) or "nessuno"
+    lines.append(f"🚦 <b>Scheduler:</b> attivi: {escape(active)} · in coda {sc['queue_depth']} "
+                 f"({sc['depth']['leggeri']}/{sc['depth']['normali']}/{sc['depth']['pesanti']} "
+                 f"leggeri/normali/pesanti)\n"
+                 f"   attesa media {sc['wait_avg']:.1f}s, max {sc['wait_max']:.1f}s su {sc['granted']} lavori · "
+                 f"in coda da {sc['wait_oldest']:.0f}s · timeout {sc['queue_timeouts']} in coda, "
+                 f"{sc['timeouts']} al lavoro")
+    hg = hedge.stats()
+    if hg['delay'] > 0:
+        lines.append(f"🏁 <b>Fallback in gara</b> (ritardo {hg['delay']:.0f}s): {hg['races']} gare, "
+                     f"{hg['hedged']} partenze in parallelo, {hg['hedge_wins']} vinte dalla strategia di riserva")
+    else:
+        lines.append(f"🏁 <b>Fallback:</b> sequenziali ({hg['races']} fasi di emergenza)")
+    st = get_downloader().strategy_stats.stats()
+    if st:
+        lines.append("🧭 <b>Strategie yt-dlp</b> (ultima finestra):")
+        for key, v in st.items():
+            flag = " ⛔ saltata" if v['dead'] else ""
+            lines.append(f"   • {escape(key)}: {v['ok']}/{v['n']} ok ({v['rate']:.0%}), "
+                         f"{v['latency']:.1f}s{flag}")
+    hs = get_downloader().http.stats()
+    lines.append(f"🌐 <b>Pool HTTP:</b> {hs['hosts']} host, {hs['connections']} connessioni "
+                 f"per {hs['requests']} richieste")
+    busiest = sorted(hs['pools'].items(), key=lambda kv: kv[1]['requests'], reverse=True)[:5]
+    for host, p in busiest:
+        lines.append(f"   • {escape(host)}: {p['requests']} rich. / {p['connections']} conn. "
+                     f"({p['idle']} libere)")
+    jn = janitor.stats()
+    lines.append(f"🧹 <b>Temp:</b> {jn['usage'] / mb:.0f}/{jn['max_bytes'] / mb:.0f} MB, {jn['tracked']} file tracciati · "
+                 f"recuperati {jn['bytes_reclaimed'] / mb:.1f} MB in {jn['deleted']} file "
+                 f"({jn['sweeps']} giri, orfani dopo {jn['orphan_min']} min)")
+    cb = cobalt_health.stats()
+    lines.append(f"🛰 <b>Istanze Cobalt</b> ({cb['skipped']} tentativi evitati"
+                 + (f", {cb['probes']} probe" if cb['probing'] else "") + "):")
+    for url, v in cb['instances'].items():
+        lat = f"{v['ewma_ms']:.0f} ms" if v['ewma_ms'] is not None else "n/d"
+        extra = f", riprova tra {v['cooldown_s']:.0f}s" if v['state'] == 'aperto' else ""
+        lines.append(f"   • {escape(url)}: {v['state']}, {lat}, {v['ok']} ok / {v['failed']} ko{extra}")
+    yp = ydl_pool.stats()
+    lines.append(f"♻️ <b>Istanze yt-dlp:</b> {yp['hits']} riusate, {yp['misses']} create "
+                 f"({yp['hit_rate']:.0%} hit, {yp['build_avg_ms']:.0f} ms a costruzione) · "
+                 f"{yp['idle']}/{yp['size']} pronte")
+    ck = get_downloader().cookies.stats()
+    files = ", ".join(f"{k} {v}" for k, v in ck['files'].items()) or "nessuno"
+    lines.append(f"🍪 <b>Cookie:</b> {ck['parses']} parse, {ck['reuses']} riusi · {escape(files)}")
+    sg = size_guard.stats()
+    lines.append(f"🐘 <b>Scarti per dimensione:</b> {sg['rejected']} (header {sg['header']}, "
+                 f"a metà {sg['stream']}, info {sg['info']}, cache {sg['cached']}) · "
+                 f"{sg['bytes_avoided'] / mb:.0f} MB non scaricati")
+    sm = segmented.stats()
+    seg_speed = f"{sm['seg_mbps']:.1f} MB/s" if sm['seg_mbps'] else "n/d"
+    single_speed = f"{sm['single_mbps']:.1f} MB/s" if sm['single_mbps'] else "n/d"
+    lines.append(f"⚡ <b>Download a segmenti:</b> {sm['segmented']} ({sm['parts']} parti, "
+                 f"{sm['retries']} riprese, {seg_speed}) · flusso unico {sm['single']} "
+                 f"({single_speed}), {sm['no_range']} senza Range"
+                 + (f" · guadagno x{sm['gain']:.1f}" if sm['gain'] else ""))
+    pr = partials.stats()
+    lines.append(f"⏯ <b>Riprese:</b> {pr['resumed']} ({pr['bytes_saved'] / mb:.1f} MB non riscaricati) · "
+                 f"{pr['kept']} parziali tenuti, {pr['invalidated']} cambiati sul server, "
+                 f"{pr['pending']} in attesa")
+    ac = audio_cache.get_cache(get_downloader().temp_dir).stats()
+    lines.append(f"🎧 <b>Cache audio:</b> {ac['entries']} file, {ac['bytes'] / mb:.1f}/"
+                 f"{ac['max_bytes'] / mb:.0f} MB · hit {ac['hits']} ({ac['hit_rate']:.0%}), "
+                 f"click uniti {ac['joined']}, sfratti {ac['evictions']}")
+    ad = audio_derive.stats()
+    lines.append(f"🎼 <b>Audio dal video:</b> {ad['derived']} ({ad['copied']} copiati, "
+                 f"{ad['encoded']} ricodificati) · serviti {ac['from_video']} · "
+                 f"{ad['no_audio']} senza audio, {ad['busy']} saltati, {ad['failed']} falliti"
+                 + ("" if ad['enabled'] else " · spento"))
+    tc = transcode.stats(get_downloader().temp_dir)
+    tc_avg = f"{tc['encode_seconds'] / tc['encoded']:.0f}s" if tc['encoded'] else "n/d"
+    lines.append(f"🗜️ <b>Ricompressioni:</b> {tc['encoded']} ({tc['encodes']} encode, media {tc_avg}), "
+                 f"{tc['remuxed']} solo contenitore, {tc['unplannable']} senza speranza · "
+                 f"cache {tc['cache_hits']} hit, {tc['entries']} file ({tc['bytes'] / mb:.0f} MB) · "
+                 f"uniti {tc['joined']}, non rientrati {tc['failed']} (di cui {tc['errors']} errori ffmpeg, "
+                 f"+{tc['known_failed']} già noti) · "
+                 f"{tc['workers']} in parallelo, {tc['mem_waits']} attese RAM")
+    mp = media_probe.stats()
+    lines.append(f"🔬 <b>Analisi media:</b> {mp['probes']} ffprobe, {mp['hits']} dalla cache, "
+                 f"{mp['failed']} falliti · {mp['entries']} file noti")
+    await update.message.reply_text("\n".join(lines), parse_mode=ParseMode.HTML)
+
+
 async def sfida_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Admin: lancia una sfida a tema per la settimana."""
     if update.effective_user.id != ADMIN_USER_ID:
@@ -1031,9 +1228,13 @@ async def download_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         try:
             # Timeout complessivo: evita che un download impallato (es. YouTube via
             # Deno/bgutil che si blocca) lasci il bot appeso su "Download in corso".
+            # Passa dallo scheduler globale (limiti per piattaforma, coda equa).
             try:
-                info = await asyncio.wait_for(
-                    dl.download_video(url, on_download_ready=show_loading if is_youtube else None),
+                queue, prio = dl.schedule_class(url)
+                info = await scheduler.run(
+                    lambda: dl.download_video(url, on_download_ready=show_loading if is_youtube else None,
+                                              max_bytes=TELEGRAM_SOURCE_MAX_BYTES),
+                    queue, f"tg:{msg.chat_id}:{msg.from_user.id}", prio,
                     timeout=DOWNLOAD_TIMEOUT,
                 )
             except asyncio.TimeoutError:
@@ -1061,6 +1262,22 @@ async def download_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     pass
                 continue
 
+            # 🐘 oltre i 50MB di Telegram: scartato dal downloader prima di finire di
+            # scaricarlo. Non è un fallimento (niente conteggio per l'avviso admin).
+            if info and info.get("too_big"):
+                try:
+                    await context.bot.send_message(
+                        chat_id=msg.chat_id, text=_too_big_text(info.get("size"), url),
+                        parse_mode=ParseMode.HTML,
+                    )
+                except Exception:
+                    pass
+                try:
+                    await loading.delete()
+                except Exception:
+                    pass
+                continue
+
             # ❌ fallimento → informa l'utente e passa al prossimo
             if not info or not info.get("success"):
                 nello_joke = random.choice(NELLO_ERRORS)
@@ -1084,7 +1301,9 @@ async def download_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 continue
 
             # Controllo dimensione: la Bot API di Telegram rifiuta gli upload > 50MB.
-            # Meglio un messaggio chiaro che un errore criptico durante l'invio.
+            # I video oltre il limite si ricomprimono (transcode, profilo 'telegram');
+            # se non rientrano, meglio un messaggio chiaro che un errore criptico.
+            await _fit_for_telegram(info, f"tg:{msg.chat_id}:{msg.from_user.id}")
             if info.get("type", "video") == "video":
                 candidate_paths = [info.get("file_path")]
             else:
@@ -1096,20 +1315,14 @@ async def download_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 None
             )
             if oversized:
-                size_mb = os.path.getsize(oversized) / (1024 * 1024)
                 try:
                     await context.bot.send_message(
-                        chat_id=msg.chat_id,
-                        text=(
-                            f"🐘 <b>Troppo pesante per Nello!</b>\n\n"
-                            f"Il file ({size_mb:.0f}MB) supera il limite di 50MB di Telegram "
-                            f"per i bot, non posso inviarlo.\n(Link: {escape(url)})"
-                        ),
+                        chat_id=msg.chat_id, text=_too_big_text(os.path.getsize(oversized), url),
                         parse_mode=ParseMode.HTML,
                     )
                 except Exception:
                     pass
-                for p in candidate_paths:
+                for p in list(candidate_paths) + [info.get("source_path")]:
                     try:
                         if p and os.path.exists(p):
                             os.remove(p)
@@ -1145,12 +1358,14 @@ async def download_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             # === VIDEO ===
             if info.get("type", "video") == "video":
                 video_caption = caption
+                meta = await _video_meta(info["file_path"])
                 with open(info["file_path"], "rb") as f:
                     _m = await context.bot.send_video(
                         chat_id=msg.chat_id,
                         video=f,
                         caption=video_caption,
                         parse_mode=ParseMode.HTML,
+                        **meta,
                     )
                 sent_ok = True
                 _fc = _fid_from_msg(_m)
@@ -1164,10 +1379,19 @@ async def download_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                         fid=(_fc[1] if _fc and _fc[0] == 'video' else None))
                 except Exception as e:
                     logger.warning(f"create_vote fallito: {e}")
-                try:
-                    os.remove(info["file_path"])
-                except Exception:
-                    pass
+                # L'audio per '/a/', '/p/' e 'a:' si ricava in background dal
+                # download originale, non dalla copia ricompressa (poi lo cancella
+                # audio_derive); il resto via subito.
+                source = info.get("source_path") or info["file_path"]
+                derived = audio_derive.schedule(url, source, info, dl.temp_dir,
+                                                f"tg:{msg.chat_id}:{msg.from_user.id}")
+                for p in {source, info["file_path"]}:
+                    if derived and p == source:
+                        continue
+                    try:
+                        os.remove(p)
+                    except Exception:
+                        pass
 
             # === CAROSELLO FOTO (ALBUM UNICO) ===
             elif info.get("type") == "carousel":
@@ -1184,6 +1408,7 @@ async def download_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     photo_path = files[0]
                     ext = os.path.splitext(photo_path)[1].lower()
                     is_video = ext in ('.mp4', '.mov', '.webm', '.mkv', '.avi', '.flv', '.ts')
+                    meta = await _video_meta(photo_path) if is_video else {}
 
                     try:
                         with open(photo_path, "rb") as f:
@@ -1192,7 +1417,8 @@ async def download_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                                     chat_id=msg.chat_id,
                                     video=f,
                                     caption=carousel_caption,
-                                    parse_mode=ParseMode.HTML
+                                    parse_mode=ParseMode.HTML,
+                                    **meta
                                 )
                             else:
                                 _m = await context.bot.send_photo(
@@ -1214,7 +1440,7 @@ async def download_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                              try:
                                  with open(photo_path, "rb") as f:
                                     if is_video:
-                                        _m = await context.bot.send_video(chat_id=msg.chat_id, video=f, caption=short_caption, parse_mode=ParseMode.HTML)
+                                        _m = await context.bot.send_video(chat_id=msg.chat_id, video=f, caption=short_caption, parse_mode=ParseMode.HTML, **meta)
                                     else:
                                         _m = await context.bot.send_photo(chat_id=msg.chat_id, photo=f, caption=short_caption, parse_mode=ParseMode.HTML)
                                  sent_ok = True
@@ -1252,12 +1478,15 @@ async def download_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                                 ext = os.path.splitext(photo_path)[1].lower()
                                 is_video = ext in ('.mp4', '.mov', '.webm', '.mkv', '.avi', '.flv', '.ts')
 
+                                meta = await _video_meta(photo_path) if is_video else {}
+
                                 if chunk_index == 0 and c_i == 0:
                                     if is_video:
                                         media.append(InputMediaVideo(
                                             media=f,
                                             caption=carousel_caption,
-                                            parse_mode=ParseMode.HTML
+                                            parse_mode=ParseMode.HTML,
+                                            **meta
                                         ))
                                     else:
                                         media.append(InputMediaPhoto(
@@ -1267,7 +1496,7 @@ async def download_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                                         ))
                                 else:
                                     if is_video:
-                                        media.append(InputMediaVideo(media=f))
+                                        media.append(InputMediaVideo(media=f, **meta))
                                     else:
                                         media.append(InputMediaPhoto(media=f))
 
@@ -1411,8 +1640,9 @@ async def hourly_funny_routine(context: ContextTypes.DEFAULT_TYPE):
             if not video_url:
                 continue
 
-            # Download
-            info = await dl.download_video(video_url)
+            # Download (priorità bassa: è un job automatico, non un utente che aspetta)
+            info = await scheduler.run(lambda: dl.download_video(video_url, max_bytes=TELEGRAM_MAX_BYTES),
+                                       dl.detect_platform(video_url), "tg:job", scheduler.HEAVY)
 
             if info.get("success") and info.get("type") == "video":
                 # Send video ONLY (no poll)
@@ -1421,12 +1651,14 @@ async def hourly_funny_routine(context: ContextTypes.DEFAULT_TYPE):
                     f"👤 <b>Fonte:</b> <a href='{source}'>TikTok</a>\n"
                 )
 
+                meta = await _video_meta(info['file_path'])
                 with open(info['file_path'], 'rb') as f:
                     await context.bot.send_video(
                         chat_id=GROUP_CHAT_ID,
                         video=f,
                         caption=caption,
-                        parse_mode=ParseMode.HTML
+                        parse_mode=ParseMode.HTML,
+                        **meta
                     )
 
                 try:
@@ -1619,57 +1851,52 @@ async def serve_link(request):
     raise web.HTTPFound(url)
 
 
+async def _web_audio(url: str, request, where: str) -> Optional[str]:
+    """Path dell'audio in cache (mp3, o m4a se ricavato dal video consegnato) per
+    un link '/p/' o '/a/' (None se non c'è)."""
+    try:
+        info = await get_audio(url, f"web:{request.remote}")
+    except Exception as e:
+        logger.warning(f"{where}: download fallito ({url}): {e}")
+        return None
+    path = (info or {}).get('file_path')
+    if info and info.get('success') and path and os.path.exists(path):
+        return path
+    return None
+
+
+def _audio_mime(path: str) -> str:
+    return audio_cache.MIME.get(os.path.splitext(path)[1][1:].lower(), 'audio/mpeg')
+
+
 async def serve_play(request):
-    """Serve un'anteprima ascoltabile (audio/mpeg inline) per il link '/p/<token>'."""
+    """Serve un'anteprima ascoltabile (audio/mpeg inline) per il link '/p/<token>'.
+    Streaming dal file in cache con Range: il player parte subito e può saltare."""
     tok = request.match_info.get('tok', '')
     url = core.play_url_by_token(tok)
     if not url:
         return web.Response(status=404, text="Link audio scaduto o non valido.")
-    try:
-        info = await get_downloader().download_audio(url)
-    except Exception as e:
-        logger.warning(f"serve_play: download fallito ({url}): {e}")
-        info = None
-    path = (info or {}).get('file_path')
-    if not (info and info.get('success') and path and os.path.exists(path)):
+    path = await _web_audio(url, request, 'serve_play')
+    if not path:
         return web.Response(status=502, text="Audio non disponibile per questo contenuto.")
-    try:
-        with open(path, 'rb') as fh:
-            data = fh.read()
-    finally:
-        try:
-            os.remove(path)
-        except Exception:
-            pass
-    return web.Response(body=data, headers={'Content-Type': 'audio/mpeg'})
+    return web.FileResponse(path, headers={'Content-Type': _audio_mime(path),
+                                           'Cache-Control': 'private, max-age=3600'})
 
 
 async def serve_audio(request):
-    """Serve l'audio del contenuto per il link '/a/<token>' della card. Scarica
-    l'audio on-demand e lo restituisce come file mp3 (poi cancella il temporaneo)."""
+    """Serve l'audio del contenuto per il link '/a/<token>' della card, come file
+    da scaricare (dalla cache audio, in streaming e con Range)."""
     tok = request.match_info.get('tok', '')
     url = core.audio_url_by_token(tok)
     if not url:
         return web.Response(status=404, text="Link audio scaduto o non valido.")
-    try:
-        info = await get_downloader().download_audio(url)
-    except Exception as e:
-        logger.warning(f"serve_audio: download fallito ({url}): {e}")
-        info = None
-    path = (info or {}).get('file_path')
-    if not (info and info.get('success') and path and os.path.exists(path)):
+    path = await _web_audio(url, request, 'serve_audio')
+    if not path:
         return web.Response(status=502, text="Audio non disponibile per questo contenuto.")
-    try:
-        with open(path, 'rb') as fh:
-            data = fh.read()
-    finally:
-        try:
-            os.remove(path)
-        except Exception:
-            pass
-    return web.Response(body=data, headers={
-        'Content-Type': 'audio/mpeg',
-        'Content-Disposition': 'attachment; filename="audio.mp3"',
+    return web.FileResponse(path, headers={
+        'Content-Type': _audio_mime(path),
+        'Content-Disposition': f'attachment; filename="audio{os.path.splitext(path)[1]}"',
+        'Cache-Control': 'private, max-age=3600',
     })
 
 
@@ -1723,7 +1950,7 @@ def potoken_selftest():
     # 3) Estrazione di prova verbose: cattura le righe relative a plugin / po_token
     captured = []
     try:
-        import shutil
+        import tempfile
         import yt_dlp
 
         class _L:
@@ -1732,14 +1959,14 @@ def potoken_selftest():
             def warning(self, m): captured.append(str(m))
             def error(self, m): captured.append(str(m))
 
-        # Copia i cookie in posizione scrivibile (/etc/secrets e' read-only)
+        # Stesso file cookie (già copiato in posizione scrivibile) del downloader
         cookie_copy = None
         try:
-            if os.path.exists('/etc/secrets/YOUTUBE_COOKIES'):
-                cookie_copy = '/tmp/yt_selftest_cookies.txt'
-                shutil.copyfile('/etc/secrets/YOUTUBE_COOKIES', cookie_copy)
+            path = cookie_registry.get_registry(tempfile.gettempdir()).resolve('youtube')
+            if os.path.exists(path):
+                cookie_copy = path
         except Exception as e:
-            logger.warning(f"[POT] copia cookie fallita: {e}")
+            logger.warning(f"[POT] cookie non disponibili: {e}")
             cookie_copy = None
 
         ydl_opts = {
@@ -1789,14 +2016,29 @@ async def error_handler(update, context):
 # MAIN
 # =========================
 
+def _in_background(name: str, fn):
+    """Esegue fn in un thread daemon (FAST_STARTUP) o subito (avvio classico)."""
+    def _run():
+        try:
+            fn()
+        except Exception as e:
+            logger.error(f"Avvio: {name} fallito: {e}")
+    if FAST_STARTUP:
+        threading.Thread(target=_run, name=f"startup-{name}", daemon=True).start()
+    else:
+        _run()
+
+
 def main():
     # Diagnostica po_token disattivata di default (aggiunge ~20s allo startup).
     # Riattivabile impostando POT_SELFTEST=1 su Render quando serve indagare.
     if os.getenv('POT_SELFTEST', '0') == '1':
-        try:
-            potoken_selftest()
-        except Exception as e:
-            logger.warning(f"potoken_selftest error: {e}")
+        _in_background('potoken_selftest', potoken_selftest)
+
+    # Warm-up del downloader (import yt-dlp, risoluzione cookie, cache, janitor)
+    # mentre il bot inizia già a ricevere update: il primo link non paga l'avvio.
+    if FAST_STARTUP:
+        _in_background('downloader', get_downloader)
 
     # Webhook mode (useful on Render) controlled by USE_WEBHOOK and WEBHOOK_URL
     USE_WEBHOOK = os.getenv('USE_WEBHOOK', '0') == '1'
@@ -1812,7 +2054,12 @@ def main():
         connect_timeout=60.0,
         pool_timeout=60.0
     )
-    application = Application.builder().token(TOKEN).request(request_settings).build()
+    builder = Application.builder().token(TOKEN).request(request_settings)
+    # Bot API alternativa (server locale, o lo stand-in di bench_startup.py)
+    if os.getenv('TELEGRAM_BASE_URL'):
+        base = os.getenv('TELEGRAM_BASE_URL').rstrip('/')
+        builder = builder.base_url(f"{base}/bot").base_file_url(f"{base}/file/bot")
+    application = builder.build()
     print("Application built.")
 
     application.add_handler(CommandHandler("start", start_cmd))
@@ -1825,6 +2072,7 @@ def main():
     application.add_handler(CommandHandler("admin", admin_cmd))
     application.add_handler(CommandHandler("setcookies", setcookies_cmd))
     application.add_handler(CommandHandler("chats", chats_cmd))
+    application.add_handler(CommandHandler("stato", stato_cmd))
     application.add_handler(CommandHandler("sfida", sfida_cmd))
     application.add_handler(CallbackQueryHandler(on_callback))
     application.add_handler(MessageReactionHandler(on_reaction))
@@ -1856,20 +2104,18 @@ def main():
     # se DISCORD_TOKEN è impostato.
     DISCORD_TOKEN = os.getenv('DISCORD_TOKEN')
     if DISCORD_TOKEN:
-        try:
-            import discord_bot
+        def _start_discord():
+            import discord_bot   # importa discord.py: con FAST_STARTUP fuori dal thread principale
             discord_bot.start_in_thread(DISCORD_TOKEN, ns)
-        except Exception as e:
-            logger.error(f"Avvio frontend Discord fallito: {e}")
+        _in_background('discord', _start_discord)
 
     # Bridge WhatsApp (opzionale): server interno per il worker Node/Baileys.
     # Si attiva solo se WHATSAPP_ENABLED=1 (il worker Node viene avviato da start.sh).
     if os.getenv('WHATSAPP_ENABLED', '0') == '1':
-        try:
+        def _start_whatsapp():
             import wa_bridge
             wa_bridge.start_in_thread(ns)
-        except Exception as e:
-            logger.error(f"Avvio bridge WhatsApp fallito: {e}")
+        _in_background('whatsapp', _start_whatsapp)
 
     application.job_queue.run_daily(
         weekly_ranking,
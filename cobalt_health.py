@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""Stato di salute delle istanze Cobalt (circuit breaker + latenza EWMA).
+
+download_with_cobalt provava COBALT_INSTANCES sempre nello stesso ordine, con
+15 s di timeout ciascuna: un'istanza morta (DNS sparito) o dietro Turnstile
+costava il timeout pieno a OGNI fallback. Qui, per ogni istanza:
+
+  - fallimenti consecutivi: dopo COBALT_FAIL_THRESHOLD il circuito si APRE e
+    l'istanza non si prova per un cooldown (COBALT_COOLDOWN_S, raddoppia a ogni
+    riapertura fino a un'ora); finito il cooldown torna in prova ("half-open"),
+    in fondo alla lista: se risponde il circuito si richiude, se fallisce si
+    riapre subito;
+  - latenza EWMA delle risposte: le istanze sane si provano dalla più veloce;
+    quelle mai misurate dopo, nell'ordine configurato;
+  - probing opzionale in background (COBALT_PROBE_MIN minuti, 0 = spento): una
+    GET sulla root di ogni istanza (Cobalt v10 risponde con le sue info), tutte
+    in parallelo, tiene la tabella aggiornata anche senza traffico;
+  - stats() per /stato.
+
+Un errore sul CONTENUTO (post privato, link non supportato) non è colpa
+dell'istanza: conta come risposta sana. Lo stato è del processo (condiviso dai
+downloader di tutti i frontend), non persistito.
+"""
+
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Nota: api.cobalt.tools richiede Turnstile/Key ora, quindi, usiamo mirror community
+# Lista ridotta: molte istanze pubbliche muoiono in fretta (DNS inesistente).
+# Sovrascrivibile via env COBALT_INSTANCES (separate da virgola).
+DEFAULT_INSTANCES = [
+    "https://cobalt.stream",
+    "https://cobalt.tools",
+    "https://cobalt.q11.app",
+    "https://cobalt.154.be",
+]
+
+FAIL_THRESHOLD = max(1, int(os.getenv('COBALT_FAIL_THRESHOLD', '2')))
+COOLDOWN = max(5.0, float(os.getenv('COBALT_COOLDOWN_S', '300')))
+COOLDOWN_MAX = 3600.0
+PROBE_INTERVAL = max(0.0, float(os.getenv('COBALT_PROBE_MIN', '0')) * 60)
+EWMA_ALPHA = 0.3
+PROBE_WORKERS = 8
+
+# Codici di errore Cobalt v10 che dicono "questa istanza non ci serve" (auth,
+# Turnstile, rate limit) invece di "questo contenuto non si scarica"
+_INSTANCE_ERRORS = ('error.api.auth', 'error.api.rate_exceeded', 'error.api.capacity',
+                    'error.api.unreachable', 'error.api.timed_out')
+
+
+def instances() -> List[str]:
+    env = os.getenv("COBALT_INSTANCES")
+    if env:
+        return [u.strip().rstrip('/') for u in env.split(",") if u.strip()]
+    return list(DEFAULT_INSTANCES)
+
+
+def is_instance_error(data: Dict) -> bool:
+    """Risposta 200 con status=error: True se è colpa dell'istanza."""
+    if not isinstance(data, dict) or data.get('status') != 'error':
+        return False
+    code = str((data.get('error') or {}).get('code') or data.get('text') or '')
+    return code.startswith(_INSTANCE_ERRORS) or 'turnstile' in code.lower() or 'jwt' in code.lower()
+
+
+class _Instance:
+    __slots__ = ('url', 'fails', 'opens', 'open_until', 'ewma',
+                 'ok', 'failed', 'last_error', 'last_ok')
+
+    def __init__(self, url: str):
+        self.url = url
+        self.fails = 0          # fallimenti consecutivi
+        self.opens = 0          # quante volte il circuito si è aperto di fila
+        self.open_until = 0.0
+        self.ewma: Optional[float] = None
+        self.ok = 0
+        self.failed = 0
+        self.last_error = ''
+        self.last_ok = 0.0
+
+
+_lock = threading.Lock()
+_table: Dict[str, _Instance] = {}
+_probe_thread: Optional[threading.Thread] = None
+_stats = {'skipped': 0, 'probes': 0}
+
+
+def _get_locked(url: str) -> _Instance:
+    inst = _table.get(url)
+    if inst is None:
+        inst = _table[url] = _Instance(url)
+    return inst
+
+
+def order(urls: List[str]) -> List[str]:
+    """Istanze da provare, nell'ordine: sane più veloci, sane mai misurate
+    (ordine configurato), istanze col cooldown scaduto (una prova). Quelle col
+    circuito aperto si saltano; se lo fossero tutte, si tiene quella che si
+    riapre prima (mai zero tentativi)."""
+    now = time.time()
+    measured, unknown, retry, closed = [], [], [], []
+    with _lock:
+        for pos, url in enumerate(urls):
+            inst = _get_locked(url)
+            if inst.open_until > now:
+                closed.append((inst.open_until, url))
+            elif inst.opens:
+                retry.append(url)   # cooldown finito: di nuovo in prova (half-open)
+            elif inst.ewma is None:
+                unknown.append((pos, url))
+            else:
+                measured.append((inst.ewma, pos, url))
+        _stats['skipped'] += len(closed)
+    plan = [u for _, _, u in sorted(measured)] + [u for _, u in unknown] + retry
+    if not plan and closed:
+        plan = [min(closed)[1]]
+    if closed:
+        logger.info(f"Cobalt: saltate {len(closed)} istanze col circuito aperto")
+    return plan
+
+
+def record(url: str, ok: bool, latency: Optional[float] = None, error: str = '') -> None:
+    """Esito di una chiamata (o di un probe) verso l'istanza `url`."""
+    now = time.time()
+    with _lock:
+        inst = _get_locked(url)
+        if latency is not None and ok:
+            inst.ewma = latency if inst.ewma is None else (
+                EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * inst.ewma)
+        if ok:
+            inst.ok += 1
+            inst.fails = 0
+            inst.opens = 0
+            inst.open_until = 0.0
+            inst.last_ok = now
+            return
+        inst.failed += 1
+        inst.fails += 1
+        inst.last_error = (error or '')[:120]
+        if inst.fails >= FAIL_THRESHOLD or inst.opens:
+            # Soglia superata, o fallita la prova half-open: cooldown (crescente)
+            inst.opens += 1
+            cooldown = min(COOLDOWN * (2 ** (inst.opens - 1)), COOLDOWN_MAX)
+            inst.open_until = now + cooldown
+            inst.fails = 0
+            logger.warning(f"Cobalt: circuito APERTO per {url} ({cooldown:.0f}s): {inst.last_error}")
+
+
+def _probe_one(probe: Callable[[str], bool], url: str):
+    t0 = time.monotonic()
+    try:
+        ok = bool(probe(url))
+        err = '' if ok else 'probe fallito'
+    except Exception as e:
+        ok, err = False, f"probe: {e}"
+    record(url, ok, time.monotonic() - t0, err)
+    with _lock:
+        _stats['probes'] += 1
+
+
+def _probe_loop(probe: Callable[[str], bool]):
+    with ThreadPoolExecutor(max_workers=PROBE_WORKERS, thread_name_prefix='cobalt-probe') as pool:
+        while True:
+            time.sleep(PROBE_INTERVAL)
+            now = time.time()
+            with _lock:
+                # I circuiti aperti si lasciano in pace fino alla fine del cooldown
+                due = [u for u in instances() if _get_locked(u).open_until <= now]
+            # Tutte insieme: un'istanza lenta costa al giro un timeout, non uno a testa
+            list(pool.map(lambda u: _probe_one(probe, u), due))
+
+
+def start_probing(probe: Callable[[str], bool]) -> None:
+    """Avvia (una volta per processo, se COBALT_PROBE_MIN > 0) il probing in
+    background. `probe(url)` è bloccante e ritorna True se l'istanza risponde."""
+    global _probe_thread
+    if PROBE_INTERVAL <= 0:
+        return
+    with _lock:
+        if _probe_thread is not None:
+            return
+        _probe_thread = threading.Thread(target=_probe_loop, args=(probe,),
+                                         name='cobalt-probe', daemon=True)
+        _probe_thread.start()
+
+
+def stats() -> Dict:
+    now = time.time()
+    with _lock:
+        table = {}
+        for url in instances():
+            inst = _get_locked(url)
+            if inst.open_until > now:
+                state = 'aperto'
+            elif inst.opens:
+                state = 'in prova'
+            else:
+                state = 'ok'
+            table[url] = {
+                'state': state,
+                'ewma_ms': inst.ewma * 1000 if inst.ewma is not None else None,
+                'ok': inst.ok,
+                'failed': inst.failed,
+                'cooldown_s': max(0.0, inst.open_until - now),
+                'last_error': inst.last_error,
+            }
+        return dict(_stats, instances=table, probing=PROBE_INTERVAL > 0)
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""Registro dei cookie condiviso dal processo.
+
+Prima ogni SocialMediaDownloader (Telegram, Discord, WhatsApp) rifaceva le copie
+dei secret in resolve_cookie_path, e _load_netscape_cookies rileggeva e
+riparsava il file a ogni chiamata di fallback, appiattendo tutti i cookie in un
+dict nome -> valore (perdendo dominio, path e i cookie #HttpOnly_).
+
+Qui:
+  - resolve(platform) trova il file una volta sola per processo (stesso ordine
+    di prima: file nel repo, variabile d'ambiente, /etc/secrets copiato in temp);
+  - view(path) ritorna una vista SOLA LETTURA del file, parsato una volta in
+    cookie con dominio; si riparsa solo quando cambiano mtime/dimensione (es.
+    dopo /setcookies, o quando yt-dlp riscrive il cookiefile);
+  - i fallback requests passano view.jar() (copia con i domini: ogni host riceve
+    solo i suoi cookie), yt-dlp continua a ricevere il path come cookiefile.
+"""
+
+import os
+import logging
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import requests
+
+import janitor
+
+logger = logging.getLogger(__name__)
+
+# piattaforma -> (nome file, variabili d'ambiente / nomi dei secret)
+COOKIE_SOURCES: Dict[str, Tuple[str, Sequence[str]]] = {
+    'instagram': ('instagram_cookies.txt', ('INSTAGRAM_COOKIES', 'COOKIES_TXT')),
+    'youtube': ('youtube_cookies.txt', ('YOUTUBE_COOKIES',)),
+    'tiktok': ('tiktok_cookies.txt', ('TIKTOK_COOKIES',)),
+    'facebook': ('facebook_cookies.txt', ('FACEBOOK_COOKIES',)),
+}
+
+_HTTPONLY = '#HttpOnly_'
+
+
+def parse_netscape(text: str) -> List:
+    """Righe Netscape (7 campi separati da TAB) -> lista di http.cookiejar.Cookie."""
+    out = []
+    for raw in text.splitlines():
+        line = raw.strip()
+        if line.startswith(_HTTPONLY):
+            line = line[len(_HTTPONLY):]
+        elif not line or line.startswith('#'):
+            continue
+        parts = line.split('\t')
+        if len(parts) < 7:
+            continue
+        domain, _sub, path, secure, expires, name, value = parts[:7]
+        try:
+            exp = int(float(expires)) or None
+        except ValueError:
+            exp = None
+        out.append(requests.cookies.create_cookie(
+            name, value, domain=domain, path=path or '/',
+            secure=secure.upper() == 'TRUE', expires=exp))
+    return out
+
+
+class CookieView:
+    """Vista in sola lettura di un file cookie (snapshot dell'ultimo parse)."""
+
+    def __init__(self, path: str, cookies: Tuple = ()):
+        self.path = path
+        self._cookies = tuple(cookies)
+
+    def __len__(self) -> int:
+        return len(self._cookies)
+
+    def __bool__(self) -> bool:
+        return bool(self._cookies)
+
+    def get(self, name: str, default: Optional[str] = None, domain: Optional[str] = None) -> Optional[str]:
+        """Valore del cookie `name` (opzionalmente solo per un dominio)."""
+        for c in self._cookies:
+            if c.name == name and (domain is None or c.domain.lstrip('.').endswith(domain.lstrip('.'))):
+                return c.value
+        return default
+
+    def names(self) -> List[str]:
+        return [c.name for c in self._cookies]
+
+    def jar(self) -> requests.cookies.RequestsCookieJar:
+        """Copia del jar da passare a requests (cookies=...): chi la riceve può
+        modificarla senza toccare il registro."""
+        j = requests.cookies.RequestsCookieJar()
+        for c in self._cookies:
+            j.set_cookie(c)
+        return j
+
+
+class _Entry:
+    __slots__ = ('sig', 'view')
+
+    def __init__(self, sig, view):
+        self.sig = sig
+        self.view = view
+
+
+class CookieRegistry:
+    def __init__(self, temp_dir: str):
+        self.temp_dir = temp_dir
+        self._lock = threading.Lock()
+        self._paths: Dict[str, str] = {}
+        self._entries: Dict[str, _Entry] = {}
+        self._stats = {'parses': 0, 'reuses': 0}
+
+    # ---------------- risoluzione dei file (una volta per processo) ----------------
+
+    def resolve(self, platform: str) -> str:
+        """Path del file cookie della piattaforma (Supporto Render Secret Files & Env Vars)."""
+        with self._lock:
+            if platform not in self._paths:
+                filename, env_names = COOKIE_SOURCES[platform]
+                self._paths[platform] = self._resolve_path(filename, env_names)
+                janitor.protect(self._paths[platform])   # le copie in temp sono in uso
+            return self._paths[platform]
+
+    def path(self, platform: str) -> str:
+        return self.resolve(platform)
+
+    def _resolve_path(self, filename: str, env_var_names: Sequence[str]) -> str:
+        # 1. Cerca PRIMA nella directory corrente (git repo) per permettere l'override
+        # Questo permette di fixare i cookie semplicemente pushando un nuovo file, ignorando i secret vecchi
+        local_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
+        if os.path.exists(local_path) and os.path.getsize(local_path) > 10:
+            logger.info(f"Uso cookie locale (repository) prioritario: {local_path}")
+            return local_path
+
+        # 2. Cerca nelle variabili d'ambiente (PRIORITÀ ALTA per Render)
+        for env_var in env_var_names:
+            content = os.getenv(env_var)
+            if content and len(content.strip()) > 10:  # Check minimo validità
+                try:
+                    # Crea un file temporaneo con il contenuto
+                    temp_cookie_path = os.path.join(self.temp_dir, f"env_{filename}")
+                    with open(temp_cookie_path, 'w', encoding='utf-8') as f:
+                        f.write(content)
+                    logger.info(f"Cookie creato da variabile d'ambiente {env_var}: {temp_cookie_path}")
+                    return temp_cookie_path
+                except Exception as e:
+                    logger.error(f"Errore scrittura cookie da env {env_var}: {e}")
+
+        # 3. Cerca in /etc/secrets/ (standard Render Secret Files): prima col
+        #    filename originale, poi coi nomi delle variabili (es. INSTAGRAM_COOKIES)
+        found_secret_path = None
+        for name in (filename,) + tuple(env_var_names):
+            candidate = os.path.join('/etc/secrets', name)
+            if os.path.exists(candidate):
+                found_secret_path = candidate
+                break
+
+        # Se abbiamo trovato un secret, lo copiamo in TEMP perché /etc/secrets è Read-Only
+        # (yt-dlp riscrive il cookiefile alla chiusura)
+        if found_secret_path:
+            try:
+                logger.info(f"Cookie trovato in secrets: {found_secret_path}")
+                safe_name = f"copy_{os.path.basename(found_secret_path)}_{filename}"
+                temp_copy_path = os.path.join(self.temp_dir, safe_name)
+                with open(found_secret_path, 'rb') as f_src:
+                    content = f_src.read()
+                with open(temp_copy_path, 'wb') as f_dst:
+                    f_dst.write(content)
+                logger.info(f"Copiato cookie secret in scrivibile: {temp_copy_path}")
+                return temp_copy_path
+            except Exception as e:
+                logger.error(f"Errore durante la copia del secret file {found_secret_path}: {e}")
+                # Se fallisce la copia, ritorniamo l'originale sperando che yt-dlp non debba scriverci
+                return found_secret_path
+
+        logger.warning(f"Cookie {filename} non trovato da nessuna parte.")
+        return local_path  # Ritorna il percorso locale come default per evitare crash immediati su path null
+
+    # ---------------- viste parsate (cache per path, invalidata da mtime) ----------------
+
+    def view(self, path: Optional[str]) -> CookieView:
+        """Vista sola lettura del file `path` (vuota se manca)."""
+        if not path:
+            return CookieView(path or '')
+        try:
+            st = os.stat(path)
+            sig = (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return CookieView(path)
+        with self._lock:
+            e = self._entries.get(path)
+            if e is not None and e.sig == sig:
+                self._stats['reuses'] += 1
+                return e.view
+        # Parse fuori dal lock (file piccolo, ma niente attese inutili per gli altri)
+        try:
+            with open(path, 'r', encoding='utf-8', errors='replace') as fh:
+                cookies = parse_netscape(fh.read())
+        except Exception as ex:
+            logger.warning(f"Cookie {os.path.basename(path)} illeggibili: {ex}")
+            cookies = []
+        view = CookieView(path, cookies)
+        with self._lock:
+            self._entries[path] = _Entry(sig, view)
+            self._stats['parses'] += 1
+        logger.info(f"Cookie {os.path.basename(path)}: {len(view)} cookie (ri)caricati")
+        return view
+
+    def platform_view(self, platform: str) -> CookieView:
+        return self.view(self.resolve(platform))
+
+    def stats(self) -> Dict:
+        with self._lock:
+            files = {os.path.basename(p): len(e.view) for p, e in self._entries.items()}
+            return dict(self._stats, files=files)
+
+
+_registry: Optional[CookieRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_registry(temp_dir: str) -> CookieRegistry:
+    """Registro unico del processo (i tre frontend condividono file e parse)."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = CookieRegistry(temp_dir)
+        return _registry
@@ -11,7 +11,7 @@ parti che li distinguono (mittente già renderizzato, icone, se mostrare l'invit
 """
 
 import os
-from urllib.parse import urlparse
+from urllib.parse import urlparse, urlsplit, parse_qsl, urlencode
 from html import escape as _html_escape
 
 VIDEO_EXTS = ('.mp4', '.mov', '.webm', '.mkv', '.avi', '.flv', '.ts')
@@ -86,6 +86,32 @@ def short_link_for(url: str):
 def link_url_by_token(tok: str):
     return _short_links.get(tok)
 
+def link_key(url: str) -> str:
+    """Chiave normalizzata di un link (per 'gia' postato'): host+path senza query."""
+    u = url.strip().lower().split('?')[0].split('#')[0]
+    u = u.replace('https://', '').replace('http://', '').replace('www.', '')
+    return u.rstrip('/')
+
+# Parametri di query che SONO il media (youtube.com/watch?v=, facebook.com/watch/?v=,
+# permalink.php?story_fbid=&id=, photo.php?fbid=): senza, link_key li fonde tutti
+_MEDIA_PARAMS = ('v', 'story_fbid', 'fbid', 'id', 'video_id', 'item_id')
+
+def media_key(url: str) -> str:
+    """Chiave di un link per download condivisi e cache dei media: come link_key
+    (host senza www, niente schema/frammento/parametri di tracciamento) ma tiene i
+    parametri che identificano il media e non abbassa path e query (gli id YouTube
+    e gli shortcode Instagram distinguono maiuscole e minuscole)."""
+    u = url.strip()
+    if '://' not in u:
+        u = 'https://' + u
+    parts = urlsplit(u)
+    host = parts.netloc.lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    key = host + parts.path.rstrip('/')
+    ids = sorted((k, v) for k, v in parse_qsl(parts.query) if k in _MEDIA_PARAMS)
+    return f"{key}?{urlencode(ids)}" if ids else key
+
 # Pool di icone "vivaci" pescate a caso (usate da Telegram per variare la didascalia).
 ICONS_VIDEO = ["🎬", "📹", "🎥", "🍿", "📺", "🎞️", "🕹️", "📀", "🎦"]
 ICONS_FOTO = ["📸", "🖼️", "📷", "🌄", "🏞️", "🎨", "🪄", "🖌️", "🌟"]
@@ -21,23 +21,28 @@ import threading
 from collections import defaultdict
 
 import core
+import scheduler
+import audio_derive
+import transcode
+import media_probe
 
 logger = logging.getLogger(__name__)
 
 # Limite upload Discord: per un server SENZA boost è 10MB (Discord l'ha riabbassato
-# nel 2024). Oltre questa soglia il video viene ricompresso (vedi _compress_video);
-# se hai un server boostato puoi alzarlo con la env DISCORD_MAX_MB (es. 50/100).
+# nel 2024). Oltre questa soglia il video viene ricompresso (transcode.py, profilo
+# 'discord'); se hai un server boostato puoi alzarlo con la env DISCORD_MAX_MB (es. 50/100).
 DISCORD_MAX_MB = float(os.getenv('DISCORD_MAX_MB', '10'))
 DISCORD_MAX_BYTES = int(DISCORD_MAX_MB * 1024 * 1024)
+# Dimensione massima scaricata per Discord: i video oltre DISCORD_MAX_MB si
+# ricomprimono, ma oltre questa soglia non vale la pena nemmeno scaricarli
+# (il downloader li scarta appena ne conosce la dimensione, vedi size_guard).
+DISCORD_SOURCE_MAX_MB = max(float(os.getenv('DISCORD_SOURCE_MAX_MB', '50')), DISCORD_MAX_MB)
+DISCORD_SOURCE_MAX_BYTES = int(DISCORD_SOURCE_MAX_MB * 1024 * 1024)
 
 # Reazioni pre-caricate sotto ogni post (un click = un voto). Stesse di Telegram.
 REACTIONS = ['👍', '😂', '🔥', '😍', '😭', '🤮']
 VIDEO_EXTS = core.VIDEO_EXTS
 VOTER_ACH_AT = 25  # reazioni date per sbloccare "Votante attivo" (come Telegram)
-COMPRESS_TIMEOUT = int(os.getenv('DISCORD_COMPRESS_TIMEOUT', '420'))
-# Thread ffmpeg: compromesso memoria/velocità. 1 era troppo lento (timeout sui video
-# lunghi), il default (tutti i core) usava troppa RAM (OOM sul free tier da 512MB).
-COMPRESS_THREADS = os.getenv('DISCORD_COMPRESS_THREADS', '2')
 
 # Rate limit anti-spam per utente Discord (in memoria, si azzera ai restart)
 RATE_MAX_PER_HOUR = int(os.getenv('DISCORD_RATE_MAX_PER_HOUR', os.getenv('RATE_MAX_PER_HOUR', '20')))
@@ -66,98 +71,6 @@ def _clean_files(paths):
             pass
 
 
-async def _probe_duration(path):
-    """Durata del video in secondi via ffprobe (0 se non determinabile)."""
-    try:
-        proc = await asyncio.create_subprocess_exec(
-            'ffprobe', '-v', 'error', '-show_entries', 'format=duration',
-            '-of', 'default=noprint_wrappers=1:nokey=1', path,
-            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL)
-        out, _ = await proc.communicate()
-        return float(out.decode().strip())
-    except Exception:
-        return 0.0
-
-
-async def _probe_has_audio(path):
-    """True se il file ha almeno una traccia audio."""
-    try:
-        proc = await asyncio.create_subprocess_exec(
-            'ffprobe', '-v', 'error', '-select_streams', 'a',
-            '-show_entries', 'stream=codec_type', '-of', 'csv=p=0', path,
-            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL)
-        out, _ = await proc.communicate()
-        return b'audio' in out
-    except Exception:
-        return False
-
-
-async def _compress_video(path, target_bytes, duration=None):
-    """Ricomprime un video (H.264, max 720p) per farlo stare sotto target_bytes.
-    Usato SOLO su Discord per i video troppo pesanti. Ritorna il path del nuovo
-    file se rientra nel limite, altrimenti None. ffmpeg è già nell'immagine Docker."""
-    try:
-        dur = float(duration) if duration else 0.0
-    except (TypeError, ValueError):
-        dur = 0.0
-    if dur <= 0:
-        dur = await _probe_duration(path)
-    if dur <= 0:
-        return None
-    src_size = os.path.getsize(path) if os.path.exists(path) else 0
-    has_audio = await _probe_has_audio(path)
-    out = os.path.splitext(path)[0] + '_disc.mp4'
-    # Per i video lunghi abbassa la risoluzione e usa un preset più veloce: encode
-    # molto più rapido (evita il timeout sulla CPU lenta del free tier) e file più
-    # piccolo a parità di bitrate.
-    # preset 'superfast' (veloce e con poca RAM); risoluzione più bassa per i video
-    # lunghi (encode più rapido, file più piccolo).
-    cap = 480 if dur > 120 else 540
-    preset = 'superfast'
-    # Due tentativi: il secondo con bitrate più aggressivo se il primo sfora.
-    for factor in (0.92, 0.72):
-        total_bps = (target_bytes * 8) / dur * factor
-        video_k = int(max(total_bps - 128000, 150000) / 1000)
-        cmd = [
-            'ffmpeg', '-y', '-threads', COMPRESS_THREADS, '-i', path,
-            # mappatura esplicita: primo video + primo audio (opzionale, '?'),
-            # così l'audio è SEMPRE incluso se presente nel sorgente.
-            '-map', '0:v:0', '-map', '0:a:0?',
-            # -threads 1 limita la memoria di x264 (niente lookahead parallelo): serve
-            # a NON sforare i 512MB del piano free durante la compressione.
-            '-c:v', 'libx264', '-b:v', f'{video_k}k',
-            '-maxrate', f'{int(video_k * 1.15)}k', '-bufsize', f'{video_k * 2}k',
-            '-preset', preset, '-vf', f'scale=-2:min({cap}\\,ih)',
-            '-c:a', 'aac', '-b:a', '128k', '-ar', '48000', '-ac', '2',
-            '-movflags', '+faststart', out,
-        ]
-        proc = None
-        try:
-            proc = await asyncio.create_subprocess_exec(
-                *cmd, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
-            await asyncio.wait_for(proc.wait(), timeout=COMPRESS_TIMEOUT)
-        except asyncio.TimeoutError:
-            try:
-                proc.kill()
-            except Exception:
-                pass
-            _clean_files([out])
-            logger.warning(f"Discord compress: TIMEOUT dopo {COMPRESS_TIMEOUT}s "
-                           f"(dur={int(dur)}s, cap={cap}p, src={src_size}B)")
-            return None
-        except Exception as e:
-            logger.warning(f"Discord compress error: {e}")
-            _clean_files([out])
-            return None
-        if os.path.exists(out) and 0 < os.path.getsize(out) <= target_bytes:
-            logger.info(f"Discord compress OK: {src_size} -> {os.path.getsize(out)} bytes, "
-                        f"src_audio={has_audio}, dur={int(dur)}s")
-            return out
-        _clean_files([out])
-    logger.warning(f"Discord compress: non rientrato nel target ({src_size} bytes, dur={int(dur)}s)")
-    return None
-
-
 def build_client(ns):
     import discord
 
@@ -223,21 +136,32 @@ def build_client(ns):
         # solo il link). Le immagini non si comprimono qui. Uso una soglia un po'
         # sotto il cap reale di Discord per evitare 413 sui file al limite.
         limit = int(DISCORD_MAX_BYTES * 0.95)
+        # Video singolo: l'originale resta fino alla fine per audio_derive (la
+        # copia ricompressa ha l'audio ricodificato)
+        single = info.get('type', 'video') == 'video' and len(items) == 1
         compressed_any = False
         notice = None
         for it in items:
-            if it['video'] and it['size'] > limit:
-                if notice is None:
-                    try:
-                        notice = await channel.send("🗜️ Il video è pesante, lo comprimo per Discord… un attimo")
-                    except Exception:
-                        notice = None
-                newp = await _compress_video(it['path'], limit, info.get('duration'))
-                if newp:
+            if not it['video']:
+                continue
+            heavy = it['size'] > limit
+            if heavy and notice is None:
+                try:
+                    notice = await channel.send("🗜️ Il video è pesante, lo comprimo per Discord… un attimo")
+                except Exception:
+                    notice = None
+            # Servizio condiviso: coda ffmpeg su CPU/RAM e risultato in cache. Sui
+            # video che ci stanno già al massimo sistema il contenitore (remux).
+            newp = await transcode.fit(it['path'], 'discord', f"dc:{channel.id}:{author.id}",
+                                       info.get('duration'))
+            if newp and newp != it['path']:
+                if single:
+                    it['orig'] = it['path']
+                else:
                     _clean_files([it['path']])
-                    it['path'] = newp
-                    it['size'] = os.path.getsize(newp)
-                    compressed_any = True
+                it['path'] = newp
+                it['size'] = os.path.getsize(newp)
+                compressed_any = compressed_any or heavy
         if notice:
             try:
                 await notice.delete()
@@ -249,17 +173,19 @@ def build_client(ns):
             await channel.send(
                 f"🐘 Troppo pesante per Discord anche dopo la compressione (>{DISCORD_MAX_MB:.0f}MB).\n{caption}"
             )
-            _clean_files([it['path'] for it in items])
+            _clean_files([p for it in items for p in (it['path'], it.get('orig'))])
             return None
 
         if compressed_any:
             caption += "\n🗜️ _video compresso per rientrare nei limiti di Discord_"
 
         # diagnostica: se il video da inviare non ha audio, loggalo (per capire se
-        # l'audio manca già dal download o dopo la compressione)
+        # l'audio manca già dal download o dopo la compressione). Solo se il file
+        # è già stato analizzato (media_probe): niente ffprobe a ogni invio per un log
         try:
             first_vid = next((p for p in small if os.path.splitext(p)[1].lower() in VIDEO_EXTS), None)
-            if first_vid and not await _probe_has_audio(first_vid):
+            probed = media_probe.cached(first_vid) if first_vid else None
+            if probed is not None and not probed.has_audio:
                 logger.warning(f"Discord: il video da inviare NON ha audio (compresso={compressed_any}) {os.path.basename(first_vid)}")
         except Exception:
             pass
@@ -277,9 +203,16 @@ def build_client(ns):
                     first = False
         except Exception as e:
             logger.warning(f"Discord invio media fallito ({url}): {e}")
-            _clean_files([it['path'] for it in items])
+            _clean_files([p for it in items for p in (it['path'], it.get('orig'))])
             return None
-        _clean_files([it['path'] for it in items])
+        # Video singolo: l'audio per '/a/' e '/p/' si ricava dal download originale
+        # (audio_derive lo cancella quando ha finito)
+        if single:
+            source = items[0].get('orig') or items[0]['path']
+            if audio_derive.schedule(url, source, info, dl.temp_dir, f"dc:{channel.id}:{author.id}"):
+                _clean_files([p for p in (items[0]['path'],) if p != source])
+                return vote_msg
+        _clean_files([p for it in items for p in (it['path'], it.get('orig'))])
         return vote_msg
 
     async def _handle_links(message, urls):
@@ -301,7 +234,10 @@ def build_client(ns):
                 pass
             try:
                 try:
-                    info = await asyncio.wait_for(dl.download_video(url), timeout=download_timeout)
+                    queue, prio = dl.schedule_class(url)
+                    info = await scheduler.run(lambda: dl.download_video(url, max_bytes=DISCORD_SOURCE_MAX_BYTES), queue,
+                                               f"dc:{channel.id}:{author.id}", prio,
+                                               timeout=download_timeout)
                 except asyncio.TimeoutError:
                     if loading:
                         await loading.edit(content=f"⏳ Ci ho messo troppo su questo link, ho mollato.\n🔗 <{url}>")
@@ -316,6 +252,12 @@ def build_client(ns):
                             pass
                     continue
 
+                if info and info.get('too_big'):
+                    if loading:
+                        await loading.edit(content=f"🐘 Troppo pesante per Discord (>{DISCORD_SOURCE_MAX_MB:.0f}MB "
+                                                   f"anche per la compressione).\n🔗 <{url}>")
+                    continue
+
                 if not info or not info.get('success'):
                     err = (info or {}).get('error', 'Errore sconosciuto')
                     if loading:
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""Gara "hedged" tra le strategie di fallback di download_video.
+
+Quando yt-dlp incappa nel bot-detection, la fase di emergenza provava Cobalt
+(istanza dopo istanza, 15 s l'una) e poi gli scraper di piattaforma, sempre uno
+dopo l'altro: nel caso peggiore passava ben più di un minuto prima del primo
+byte. Con SMD_HEDGE_DELAY > 0, se la strategia in corso non ha finito dopo quei
+secondi parte in parallelo anche la successiva; vince il primo risultato valido,
+le altre vengono cancellate e i loro file eliminati. Una strategia che fallisce
+fa partire SUBITO la successiva (senza aspettare il ritardo).
+
+Con SMD_HEDGE_DELAY=0 (default) il comportamento è quello sequenziale di sempre:
+il carico raddoppia solo sulle code lente, non su ogni richiesta.
+"""
+
+import os
+import asyncio
+import logging
+import threading
+import contextvars
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+import inflight
+
+logger = logging.getLogger(__name__)
+
+HEDGE_DELAY = max(0.0, float(os.getenv('SMD_HEDGE_DELAY', '0')))
+
+_lock = threading.Lock()
+_stats = {'races': 0, 'hedged': 0, 'hedge_wins': 0, 'losers_cancelled': 0}
+
+Strategy = Tuple[str, Callable[[], Awaitable[Optional[dict]]]]
+
+
+def _valid(result) -> bool:
+    return isinstance(result, dict) and bool(result.get('success'))
+
+
+def _cleanup_when_done(task: asyncio.Future):
+    """Per un perdente: se finisce lo stesso con dei file, li elimina."""
+    def _cb(t):
+        if t.cancelled() or t.exception() is not None:
+            return
+        inflight.drop_result_files(t.result())
+    task.add_done_callback(_cb)
+
+
+async def in_thread(fn: Callable[..., Any], *args, cleanup: Callable[[Any], None] = None):
+    """Come asyncio.to_thread, ma se il chiamante viene cancellato (strategia
+    perdente) il risultato che il thread produrrà comunque passa a `cleanup`
+    invece di restare su disco. Come to_thread, il thread vede il contesto del
+    chiamante (es. il limite di dimensione di size_guard)."""
+    ctx = contextvars.copy_context()
+    fut = asyncio.get_running_loop().run_in_executor(None, ctx.run, fn, *args)
+    try:
+        return await asyncio.shield(fut)
+    except asyncio.CancelledError:
+        if cleanup is not None:
+            fut.add_done_callback(
+                lambda f: cleanup(f.result()) if not f.cancelled() and f.exception() is None else None)
+        raise
+
+
+async def race(strategies: List[Strategy], delay: Optional[float] = None) -> Optional[dict]:
+    """Esegue le strategie (nome, factory) in ordine; ritorna il primo risultato
+    valido (dict con success=True) o None. delay=None usa SMD_HEDGE_DELAY; 0 =
+    sequenziale."""
+    delay = HEDGE_DELAY if delay is None else delay
+    if not strategies:
+        return None
+    with _lock:
+        _stats['races'] += 1
+
+    queue = list(strategies)
+    running = {}   # task -> (nome, partita come hedge?)
+    winner = None
+
+    def _launch():
+        name, factory = queue.pop(0)
+        hedged = bool(running)
+        if hedged:
+            with _lock:
+                _stats['hedged'] += 1
+            logger.info(f"Hedge: {name} parte in parallelo (le altre ci mettono più di {delay:.0f}s)")
+        running[asyncio.ensure_future(factory())] = (name, hedged)
+
+    try:
+        _launch()
+        while running:
+            timeout = delay if (delay > 0 and queue) else None
+            done, _ = await asyncio.wait(list(running), timeout=timeout,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                _launch()   # la più lenta sta tardando: hedge
+                continue
+            failed = False
+            for t in done:
+                name, hedged = running.pop(t)
+                if t.cancelled():
+                    failed = True
+                    continue
+                if t.exception() is not None:
+                    logger.warning(f"Strategia {name} fallita: {t.exception()}")
+                    failed = True
+                    continue
+                if not _valid(t.result()):
+                    failed = True
+                elif winner is None:
+                    winner = t.result()
+                    logger.info(f"Strategia vincente: {name}")
+                    if hedged:
+                        with _lock:
+                            _stats['hedge_wins'] += 1
+                else:
+                    inflight.drop_result_files(t.result())   # pari merito: tieni il primo
+            if winner is not None:
+                return winner
+            if queue and (failed or not running):
+                _launch()   # una strategia ha fallito: la prossima parte subito
+        return None
+    finally:
+        # Perdenti (o chiamante cancellato): stop e niente file orfani
+        for t in list(running):
+            t.cancel()
+            _cleanup_when_done(t)
+        if running:
+            with _lock:
+                _stats['losers_cancelled'] += len(running)
+
+
+def stats() -> dict:
+    with _lock:
+        return dict(_stats, delay=HEDGE_DELAY)
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""Estrazione delle "isole" JSON dalle pagine HTML di TikTok e Instagram.
+
+I fallback foto cercavano i dati con più regex re.DOTALL sull'intera pagina
+(SIGI_STATE in tre varianti, __UNIVERSAL_DATA_FOR_REHYDRATION__ in due, ogni
+<script type="application/json">, _sharedData, __additionalDataLoaded), poi
+facevano json.loads + visita ricorsiva di TUTTI i blob trovati. Le pagine pesano
+centinaia di KB e Instagram ha decine di script JSON che non c'entrano nulla.
+
+Qui:
+  - islands() scorre i tag <script> una volta sola, dall'inizio alla fine;
+  - riconosce l'isola dall'id / type del tag o da un'assegnazione nota nel corpo
+    (window.__SIGI_STATE__ = {...}, window._sharedData = {...}, ...);
+  - fa json.loads SOLO delle isole che contengono almeno una delle chiavi
+    cercate (controllo sul testo grezzo, prima del parse);
+  - il JSON assegnato si legge con raw_decode dal primo '{': niente regex non
+    greedy che si fermano al primo "};</script>" sbagliato.
+
+unique() è il dedupe che preserva l'ordine (dict.fromkeys, O(n)).
+"""
+
+import re
+import json
+import logging
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# id del tag <script> -> nome dell'isola
+_SCRIPT_IDS = {
+    'SIGI_STATE': 'SIGI_STATE',
+    '__UNIVERSAL_DATA_FOR_REHYDRATION__': 'UNIVERSAL_DATA',
+}
+
+# Assegnazioni nel corpo di uno script (nome isola, marcatore): il JSON parte dal
+# primo '{' dopo il marcatore
+_ASSIGNMENTS = (
+    ('SIGI_STATE', 'window.__SIGI_STATE__'),
+    ('SIGI_STATE', '"SIGI_STATE"'),
+    ('UNIVERSAL_DATA', '__UNIVERSAL_DATA_FOR_REHYDRATION__'),
+    ('sharedData', 'window._sharedData'),
+    ('additionalData', '__additionalDataLoaded('),
+)
+
+_SCRIPT_OPEN = re.compile(r'<script\b([^>]*)>', re.IGNORECASE)
+_ATTR_ID = re.compile(r'\bid\s*=\s*["\']([^"\']+)["\']', re.IGNORECASE)
+_ATTR_JSON = re.compile(r'\btype\s*=\s*["\']application/json["\']', re.IGNORECASE)
+_SPACES = re.compile(r'\s*')
+_decoder = json.JSONDecoder()
+
+
+def unique(items: Iterable) -> List:
+    """Dedupe che mantiene l'ordine di prima apparizione."""
+    return list(dict.fromkeys(items))
+
+
+def _scripts(html: str) -> Iterator[Tuple[str, str]]:
+    """(attributi, corpo) di ogni <script>, in ordine di documento."""
+    pos = 0
+    while True:
+        m = _SCRIPT_OPEN.search(html, pos)
+        if not m:
+            return
+        start = m.end()
+        end = html.find('</script>', start)
+        if end < 0:
+            return
+        yield m.group(1), html[start:end]
+        pos = end + 9
+
+
+def _classify(attrs: str, body: str) -> Optional[Tuple[str, int]]:
+    """(nome isola, offset del JSON nel corpo) o None se lo script non interessa."""
+    m = _ATTR_ID.search(attrs)
+    if m and m.group(1) in _SCRIPT_IDS:
+        return _SCRIPT_IDS[m.group(1)], 0
+    if _ATTR_JSON.search(attrs):
+        return 'json', 0
+    for name, marker in _ASSIGNMENTS:
+        i = body.find(marker)
+        if i >= 0:
+            brace = body.find('{', i + len(marker))
+            if brace >= 0:
+                return name, brace
+    return None
+
+
+def islands(html: str, keys: Sequence[str] = (),
+            names: Optional[Sequence[str]] = None) -> Iterator[Tuple[str, object]]:
+    """(nome, dati) delle isole JSON della pagina, in ordine di documento.
+
+    `keys`: si parsano solo le isole il cui testo contiene almeno una di queste
+    stringhe (vuoto = tutte). `names`: solo questi tipi di isola ('SIGI_STATE',
+    'UNIVERSAL_DATA', 'json', 'sharedData', 'additionalData')."""
+    if not html:
+        return
+    for attrs, body in _scripts(html):
+        kind = _classify(attrs, body)
+        if kind is None:
+            continue
+        name, offset = kind
+        if names is not None and name not in names:
+            continue
+        if keys and not any(k in body for k in keys):
+            continue
+        try:
+            data, _ = _decoder.raw_decode(body, _SPACES.match(body, offset).end())
+        except ValueError as e:
+            logger.debug(f"Isola {name} non parsabile: {e}")
+            continue
+        yield name, data
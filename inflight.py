@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""Coalescing ("singleflight") dei lavori identici in corso.
+
+Quando lo stesso link arriva quasi insieme da più frontend (due gruppi Telegram,
+Discord, WhatsApp) ognuno partirebbe col suo download_video completo: doppio
+traffico CDN, cookie bruciati, CPU. Con coalesce() il primo chiamante (il
+"leader") esegue il lavoro, chi arriva con la stessa chiave mentre è in corso si
+accoda e riceve lo stesso risultato.
+
+I frontend girano in thread diversi, ognuno col suo event loop: per questo
+l'attesa passa da concurrent.futures.Future (thread-safe) + asyncio.wrap_future
+invece che da un asyncio.Future legato a un solo loop.
+
+Ogni follower riceve una COPIA del risultato con file propri (hard link se il
+filesystem lo permette, altrimenti copia): i frontend cancellano i file dopo
+l'invio e non devono pestarsi i piedi.
+"""
+
+import os
+import shutil
+import asyncio
+import logging
+import threading
+import concurrent.futures
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+import janitor
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_flights: Dict[str, list] = {}   # chiave -> lista dei Future dei follower in attesa
+_stats = {'leaders': 0, 'followers': 0}
+
+
+class _LeaderGone(Exception):
+    """Il leader è stato cancellato (es. timeout del suo frontend) prima di finire:
+    i follower ripartono da soli invece di ereditare la cancellazione."""
+
+
+def clone_file(path: str, tag: str = 'sf') -> Optional[str]:
+    """Hard link (o copia) di `path` con un nome libero accanto all'originale."""
+    if not path or not os.path.exists(path):
+        return None
+    root, ext = os.path.splitext(path)
+    for n in range(1, 10000):
+        dst = f"{root}_{tag}{n}{ext}"
+        try:
+            os.link(path, dst)
+            return janitor.track(dst)
+        except FileExistsError:
+            continue
+        except OSError:
+            # filesystem senza hard link (o device diverso): copia vera
+            if os.path.exists(dst):
+                continue
+            shutil.copyfile(path, dst)
+            return janitor.track(dst)
+    return None
+
+
+def clone_result(result):
+    """Copia di un risultato di download_video con file propri per il chiamante."""
+    if not isinstance(result, dict):
+        return result
+    out = dict(result)
+    if not out.get('success'):
+        return out
+    if out.get('file_path'):
+        out['file_path'] = clone_file(out['file_path'])
+    if out.get('files'):
+        out['files'] = [c for c in (clone_file(p) for p in out['files']) if c]
+    return out
+
+
+def drop_result_files(result):
+    """Cancella i file di un risultato che nessuno ritirerà (es. follower già
+    andato via, strategia perdente di una gara di fallback)."""
+    if not isinstance(result, dict):
+        return
+    for p in [result.get('file_path')] + list(result.get('files') or []):
+        janitor.discard(p)
+
+
+async def coalesce(key: str, factory: Callable[[], Awaitable[Any]],
+                   clone: Callable[[Any], Any] = clone_result) -> Tuple[Any, bool]:
+    """Esegue factory() una sola volta per chiave tra tutti i chiamanti concorrenti.
+
+    Ritorna (risultato, joined): joined=True se il chiamante si è accodato a un
+    lavoro già in corso. I follower ricevono clone(risultato); il leader
+    l'originale. `clone` di default duplica i file di un risultato download_video;
+    per valori senza file passare `lambda r: r`."""
+    while True:
+        with _lock:
+            waiters = _flights.get(key)
+            if waiters is None:
+                _flights[key] = []
+                _stats['leaders'] += 1
+                leader = True
+            else:
+                fut = concurrent.futures.Future()
+                waiters.append(fut)
+                _stats['followers'] += 1
+                leader = False
+
+        if not leader:
+            logger.info(f"Inflight: {key} già in corso, mi accodo al download esistente")
+            try:
+                return await asyncio.wrap_future(fut), True
+            except _LeaderGone:
+                continue  # il leader è sparito: riprova (probabilmente come leader)
+
+        result = None
+        error: Optional[BaseException] = None
+        try:
+            result = await factory()
+            return result, False
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            with _lock:
+                waiters = _flights.pop(key, [])
+            for fut in waiters:
+                if fut.cancelled():
+                    continue
+                try:
+                    if isinstance(error, asyncio.CancelledError):
+                        fut.set_exception(_LeaderGone())
+                    elif error is not None:
+                        fut.set_exception(error)
+                    else:
+                        copy = clone(result)
+                        try:
+                            fut.set_result(copy)
+                        except concurrent.futures.InvalidStateError:
+                            drop_result_files(copy)  # il follower ha rinunciato nel frattempo
+                except concurrent.futures.InvalidStateError:
+                    pass
+                except Exception as e:
+                    # clone fallito (es. disco pieno): meglio un errore che un'attesa infinita
+                    try:
+                        fut.set_exception(e)
+                    except concurrent.futures.InvalidStateError:
+                        pass
+
+
+def stats() -> Dict[str, int]:
+    """Contatori: lavori eseguiti (leader) e richieste risparmiate (follower)."""
+    with _lock:
+        return dict(_stats, in_flight=len(_flights))
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""Pulizia dello spazio temporaneo (temp_dir) con budget su disco.
+
+I tentativi falliti lasciavano file in tempfile.gettempdir(): carousel_*,
+*_audio.*, *_disc.mp4, cobalt_*, fb_*_fallback.*, .part di yt-dlp a metà, copie
+env_*/copy_* dei cookie di processi precedenti. La pulizia era sparsa in tanti
+try: os.remove, e su Render un disco pieno fa fallire OGNI download.
+
+Qui:
+  - track(path) registra ogni artefatto creato dal downloader (anche i file di
+    yt-dlp, che hanno nomi arbitrari, tramite ydl_hook); l'elenco è salvato in
+    temp_dir così un riavvio ritrova gli orfani del processo precedente;
+  - sweep() cancella gli artefatti (tracciati o riconosciuti dal nome) non
+    toccati da più di JANITOR_ORPHAN_MIN minuti e, se il totale supera
+    JANITOR_MAX_MB, i più vecchi fino a rientrare nel budget (mai file modificati
+    nell'ultimo minuto: sono download in corso o file in invio);
+  - gira all'avvio e poi ogni JANITOR_INTERVAL_MIN minuti in un thread;
+  - protect(path) esclude i file ancora in uso (es. i cookie del registro);
+  - stats(): spazio occupato, file e byte recuperati.
+
+Solo file al primo livello di temp_dir: la cache media (nello_media_cache/) ha
+già il suo budget.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+MAX_BYTES = int(float(os.getenv('JANITOR_MAX_MB', '1024')) * 1024 * 1024)
+ORPHAN_AGE = int(float(os.getenv('JANITOR_ORPHAN_MIN', '30')) * 60)
+INTERVAL = max(30, int(float(os.getenv('JANITOR_INTERVAL_MIN', '10')) * 60))
+BUSY_AGE = 60        # secondi: file modificati più di recente sono in uso
+STATE_FILE = 'nello_janitor.json'
+
+# Nomi dei file che crea il downloader (e i frontend) in temp_dir
+_PREFIXES = ('carousel_', 'cobalt_', 'fb_', 'insta_api_', 'instagram_photo_',
+             'tiktok_photo_', 'audio_', 'cache_', 'env_', 'copy_')
+_SUFFIXES = ('.part', '.ytdl', '_disc.mp4', '_enc.mp4', '_tc.mp4')
+
+_lock = threading.Lock()
+_tracked: Dict[str, float] = {}     # path -> quando è stato registrato
+_protected = set()
+_root: Optional[str] = None
+_thread: Optional[threading.Thread] = None
+_stats = {'sweeps': 0, 'deleted': 0, 'bytes_reclaimed': 0, 'discarded': 0,
+          'last_sweep': 0.0, 'last_reclaimed': 0, 'usage': 0}
+
+
+def _state_path() -> Optional[str]:
+    return os.path.join(_root, STATE_FILE) if _root else None
+
+
+def _load_locked():
+    path = _state_path()
+    try:
+        if path and os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                _tracked.update(json.load(f) or {})
+    except Exception as e:
+        logger.warning(f"Janitor: stato illeggibile, riparto da zero: {e}")
+
+
+def _save_locked():
+    path = _state_path()
+    if not path:
+        return
+    try:
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(_tracked, f)
+        os.replace(tmp, path)
+    except Exception as e:
+        logger.warning(f"Janitor: salvataggio stato fallito: {e}")
+
+
+def track(path: Optional[str]) -> Optional[str]:
+    """Registra un artefatto creato dal downloader. Ritorna il path."""
+    if path:
+        with _lock:
+            _tracked.setdefault(os.path.abspath(path), time.time())
+    return path
+
+
+def protect(path: Optional[str]) -> None:
+    """Il file non va mai cancellato (es. cookie in uso)."""
+    if path:
+        with _lock:
+            _protected.add(os.path.abspath(path))
+
+
+def discard(path: Optional[str]) -> int:
+    """Cancella un artefatto che non serve più. Ritorna i byte liberati."""
+    if not path:
+        return 0
+    path = os.path.abspath(path)
+    freed = 0
+    try:
+        if os.path.isfile(path):
+            freed = os.path.getsize(path)
+            os.remove(path)
+    except Exception:
+        freed = 0
+    with _lock:
+        _tracked.pop(path, None)
+        if freed:
+            _stats['discarded'] += 1
+    return freed
+
+
+def ydl_hook(d: Dict) -> None:
+    """progress_hooks / postprocessor_hooks di yt-dlp: traccia i file (anche i
+    .part e gli intermedi prima del merge) che hanno nomi non prevedibili."""
+    for key in ('tmpfilename', 'filename'):
+        track(d.get(key))
+    info = d.get('info_dict') or {}
+    track(info.get('filepath'))
+
+
+def _is_artifact(name: str) -> bool:
+    return name.startswith(_PREFIXES) or name.endswith(_SUFFIXES) or '.part-Frag' in name
+
+
+def sweep() -> int:
+    """Un giro di pulizia. Ritorna i byte recuperati."""
+    root = _root
+    if not root or not os.path.isdir(root):
+        return 0
+    now = time.time()
+    with _lock:
+        tracked = set(_tracked)
+        protected = set(_protected)
+
+    candidates = []   # (mtime, path, size)
+    try:
+        with os.scandir(root) as it:
+            for e in it:
+                try:
+                    if not e.is_file(follow_symlinks=False):
+                        continue
+                    path = os.path.abspath(e.path)
+                    if path in protected or not (path in tracked or _is_artifact(e.name)):
+                        continue
+                    st = e.stat(follow_symlinks=False)
+                    candidates.append((st.st_mtime, path, st.st_size))
+                except OSError:
+                    continue
+    except OSError as e:
+        logger.warning(f"Janitor: scansione di {root} fallita: {e}")
+        return 0
+
+    candidates.sort()
+    usage = sum(c[2] for c in candidates)
+    reclaimed = deleted = 0
+    for mtime, path, size in candidates:
+        age = now - mtime
+        orphan = age > ORPHAN_AGE
+        over_budget = usage > MAX_BYTES and age > BUSY_AGE
+        if not (orphan or over_budget):
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        usage -= size
+        reclaimed += size
+        deleted += 1
+
+    with _lock:
+        # Dimentica i file tracciati che non esistono più (inviati e cancellati
+        # dai frontend, o appena rimossi)
+        for path in list(_tracked):
+            if not os.path.exists(path):
+                _tracked.pop(path, None)
+        _stats['sweeps'] += 1
+        _stats['deleted'] += deleted
+        _stats['bytes_reclaimed'] += reclaimed
+        _stats['last_sweep'] = now
+        _stats['last_reclaimed'] = reclaimed
+        _stats['usage'] = usage
+        _save_locked()
+    if deleted:
+        logger.info(f"Janitor: eliminati {deleted} file temporanei, recuperati "
+                     f"{reclaimed / (1024 * 1024):.1f} MB (in uso {usage / (1024 * 1024):.1f} MB)")
+    if usage > MAX_BYTES:
+        logger.warning(f"Janitor: temp oltre il budget anche dopo la pulizia "
+                       f"({usage / (1024 * 1024):.0f}/{MAX_BYTES / (1024 * 1024):.0f} MB)")
+    return reclaimed
+
+
+def _loop():
+    while True:
+        try:
+            sweep()
+        except Exception as e:
+            logger.warning(f"Janitor: giro di pulizia fallito: {e}")
+        time.sleep(INTERVAL)
+
+
+def start(temp_dir: str) -> None:
+    """Avvia (una volta per processo) il thread di pulizia: primo giro subito,
+    così gli orfani di un processo precedente spariscono all'avvio."""
+    global _root, _thread
+    with _lock:
+        if _thread is not None:
+            return
+        _root = os.path.abspath(temp_dir)
+        _load_locked()
+        _thread = threading.Thread(target=_loop, name='smd-janitor', daemon=True)
+        _thread.start()
+
+
+def stats() -> Dict:
+    with _lock:
+        return dict(_stats, tracked=len(_tracked), max_bytes=MAX_BYTES,
+                    orphan_min=ORPHAN_AGE // 60)
@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+"""Cache locale dei media scaricati (su disco, content-addressed, LRU con budget).
+
+La sola cache che c'era è quella dei file_id Telegram (ranking_store): Discord e
+WhatsApp riscaricavano sempre, e Telegram riscarica quando il file_id esce dai
+CACHE_MAX. Qui teniamo i file veri sotto temp_dir/nello_media_cache:
+
+  - blobs/<md5><ext>: un file per CONTENUTO (due link che portano allo stesso media
+    condividono il blob);
+  - index.json: chiave media -> lista dei blob + metadati del risultato
+    (titolo, uploader, durata...), con orario di creazione e di ultimo accesso.
+
+Chiavi: core.media_key del link (sia quello postato sia quello pulito, con i
+parametri che identificano il media: watch?v= compreso) e, quando yt-dlp lo
+fornisce, l'id canonico '<piattaforma>:<id>'. Una lookup non fa rete.
+
+Budget in byte (MEDIA_CACHE_MAX_MB, 0 = disattivata) e TTL (MEDIA_CACHE_TTL_HOURS):
+oltre il budget si sfrattano le voci usate meno di recente. Al chiamante non si
+danno MAI i blob: si danno hard link nuovi in temp_dir, che i frontend possono
+cancellare dopo l'invio come hanno sempre fatto.
+"""
+
+import os
+import json
+import time
+import atexit
+import shutil
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+MAX_BYTES = int(float(os.getenv('MEDIA_CACHE_MAX_MB', '256')) * 1024 * 1024)
+TTL = int(float(os.getenv('MEDIA_CACHE_TTL_HOURS', '24')) * 3600)
+CACHE_DIRNAME = 'nello_media_cache'
+SAVE_EVERY = 30  # secondi minimi tra due salvataggi dell'indice per i soli accessi
+
+# Campi del risultato che riguardano i file: non vanno nei metadati dell'indice
+_FILE_FIELDS = ('file_path', 'files', 'success', 'digests')
+
+
+def file_digest(path: str, chunk: int = 1024 * 1024) -> str:
+    """MD5 del contenuto letto a blocchi (mai il file intero in memoria)."""
+    h = hashlib.md5()
+    with open(path, 'rb') as fh:
+        for block in iter(lambda: fh.read(chunk), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+# Digest calcolati MENTRE si scrive il file (vedi new_hasher/remember_digest):
+# path -> (dimensione, mtime_ns, md5). Il dedupe dei caroselli e put() li
+# trovano senza rileggere i file; se il file è cambiato la voce non vale più.
+_KNOWN_MAX = 512
+_known: 'OrderedDict[str, tuple]' = OrderedDict()
+_known_lock = threading.Lock()
+_digest_stats = {'streamed': 0, 'rehashed': 0}
+
+
+def new_hasher(data: bytes = b''):
+    """Hash incrementale da aggiornare blocco per blocco durante il download."""
+    return hashlib.md5(data)
+
+
+def _sig(path: str):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+def remember_digest(path: str, digest: str, _kind: str = 'streamed') -> None:
+    """Registra il digest di un file appena scritto (a file chiuso)."""
+    try:
+        sig = _sig(path)
+    except OSError:
+        return
+    with _known_lock:
+        _known[path] = (sig, digest)
+        _known.move_to_end(path)
+        _digest_stats[_kind] += 1
+        while len(_known) > _KNOWN_MAX:
+            _known.popitem(last=False)
+
+
+def known_digest(path: str) -> Optional[str]:
+    with _known_lock:
+        hit = _known.get(path)
+    if not hit:
+        return None
+    try:
+        return hit[1] if _sig(path) == hit[0] else None
+    except OSError:
+        return None
+
+
+def digest_of(path: str) -> str:
+    """Digest del file: dal download se noto, altrimenti letto a blocchi (es. file
+    scritti da yt-dlp o ffmpeg) e memorizzato."""
+    d = known_digest(path)
+    if d:
+        return d
+    d = file_digest(path)
+    remember_digest(path, d, 'rehashed')
+    return d
+
+
+def digest_stats() -> Dict:
+    with _known_lock:
+        return dict(_digest_stats)
+
+
+def _link_or_copy(src: str, dst: str) -> None:
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+class MediaCache:
+    def __init__(self, root: str, max_bytes: int = MAX_BYTES, ttl: int = TTL):
+        self.root = root
+        self.blob_dir = os.path.join(root, 'blobs')
+        self.index_path = os.path.join(root, 'index.json')
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+        self._entries: Dict[str, dict] = {}
+        self._aliases: Dict[str, str] = {}
+        self._dirty = False
+        self._last_save = 0.0
+        if self.enabled:
+            try:
+                os.makedirs(self.blob_dir, exist_ok=True)
+            except Exception as e:
+                logger.warning(f"Media cache: impossibile creare {self.blob_dir}: {e}")
+                self.max_bytes = 0
+                return
+            self._load()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    # ---------------- persistenza indice ----------------
+
+    def _load(self):
+        try:
+            if os.path.exists(self.index_path):
+                with open(self.index_path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                self._entries = data.get('entries', {}) or {}
+                self._aliases = data.get('aliases', {}) or {}
+        except Exception as e:
+            logger.warning(f"Media cache: indice illeggibile, riparto vuota: {e}")
+            self._entries, self._aliases = {}, {}
+        # Voci con blob spariti (es. /tmp ripulita a metà) e blob orfani
+        for mk in [k for k, e in self._entries.items()
+                   if not all(os.path.exists(self._blob(b)) for b in e.get('blobs', []))]:
+            self._drop_entry(mk)
+        self._gc_blobs()
+        self._save()
+        logger.info(f"Media cache: {len(self._entries)} voci, {self._total_bytes() // 1024} KB "
+                    f"(budget {self.max_bytes // (1024 * 1024)} MB)")
+
+    def _save(self, force: bool = True):
+        """Scrive l'indice. Le modifiche vere (put, voci scartate) lo scrivono
+        subito; gli hit segnano solo l'ultimo accesso (LRU) e si salvano al più
+        ogni SAVE_EVERY secondi (force=False) o con flush() all'uscita."""
+        self._dirty = True
+        now = time.time()
+        if not force and now - self._last_save < SAVE_EVERY:
+            return
+        try:
+            tmp = self.index_path + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump({'entries': self._entries, 'aliases': self._aliases}, f)
+            os.replace(tmp, self.index_path)
+            self._dirty = False
+            self._last_save = now
+        except Exception as e:
+            logger.warning(f"Media cache: save indice fallito: {e}")
+
+    def flush(self):
+        """Salva gli ultimi accessi non ancora scritti."""
+        with self._lock:
+            if self._dirty and self.enabled:
+                self._save()
+
+    # ---------------- helpers (chiamati col lock preso) ----------------
+
+    def _blob(self, name: str) -> str:
+        return os.path.join(self.blob_dir, name)
+
+    def _drop_entry(self, media_key: str):
+        self._entries.pop(media_key, None)
+        for a in [a for a, mk in self._aliases.items() if mk == media_key]:
+            self._aliases.pop(a, None)
+
+    def _gc_blobs(self):
+        """Cancella i blob non più referenziati da nessuna voce."""
+        used = {b for e in self._entries.values() for b in e.get('blobs', [])}
+        try:
+            names = os.listdir(self.blob_dir)
+        except Exception:
+            return
+        for name in names:
+            if name not in used:
+                try:
+                    os.remove(self._blob(name))
+                except Exception:
+                    pass
+
+    def _total_bytes(self) -> int:
+        used = {b for e in self._entries.values() for b in e.get('blobs', [])}
+        total = 0
+        for b in used:
+            try:
+                total += os.path.getsize(self._blob(b))
+            except OSError:
+                pass
+        return total
+
+    def _expire(self, now: float):
+        for mk in [k for k, e in self._entries.items() if now - float(e.get('t', 0)) > self.ttl]:
+            self._drop_entry(mk)
+
+    def _enforce_budget(self):
+        """LRU: sfratta le voci con l'ultimo accesso più vecchio finché si sta nel budget."""
+        total = self._total_bytes()
+        if total <= self.max_bytes:
+            return
+        for mk in sorted(self._entries, key=lambda k: float(self._entries[k].get('a', 0))):
+            if total <= self.max_bytes:
+                break
+            blobs = set(self._entries[mk].get('blobs', []))
+            self._drop_entry(mk)
+            still_used = {b for e in self._entries.values() for b in e.get('blobs', [])}
+            for b in blobs - still_used:
+                try:
+                    total -= os.path.getsize(self._blob(b))
+                    os.remove(self._blob(b))
+                except OSError:
+                    pass
+            self._stats['evictions'] += 1
+
+    def _usable(self, mk: Optional[str], now: float) -> Optional[dict]:
+        e = self._entries.get(mk) if mk else None
+        if not e or now - float(e.get('t', 0)) > self.ttl:
+            return None
+        if not all(os.path.exists(self._blob(b)) for b in e.get('blobs', [])):
+            self._drop_entry(mk)   # blob sparito da fuori: la voce non serve più
+            self._dirty = True
+            return None
+        return e
+
+    def _resolve(self, key: str) -> Optional[str]:
+        """Voce per `key`: la sua o quella a cui punta come alias. Se ci sono
+        entrambe vince la più recente (un ri-download sotto l'id canonico non
+        resta nascosto da una voce vecchia che ha il link come chiave); voci
+        scadute o coi blob spariti non contano."""
+        now = time.time()
+        best, best_t = None, -1.0
+        for mk in (key, self._aliases.get(key)):
+            e = self._usable(mk, now)
+            if e is not None and float(e.get('t', 0)) > best_t:
+                best, best_t = mk, float(e.get('t', 0))
+        return best
+
+    # ---------------- API ----------------
+
+    def get(self, key: str, dest_dir: str, count_miss: bool = True) -> Optional[Dict]:
+        """Risultato in stile download_video con file NUOVI (hard link) in dest_dir,
+        oppure None. Nessun accesso di rete. count_miss=False per le lookup
+        secondarie (es. id canonico dopo un miss sul link), per non contare
+        due volte lo stesso download nelle statistiche."""
+        if not self.enabled or not key:
+            return None
+        with self._lock:
+            now = time.time()
+            self._expire(now)
+            mk = self._resolve(key)
+            entry = self._entries.get(mk) if mk else None
+            if not entry:
+                if count_miss:
+                    self._stats['misses'] += 1
+                return None
+            files = []
+            try:
+                for i, b in enumerate(entry.get('blobs', []), start=1):
+                    root, ext = os.path.splitext(b)
+                    dst = os.path.join(dest_dir, f"cache_{root[:12]}_{int(now * 1000) % 10**9}_{i}{ext}")
+                    _link_or_copy(self._blob(b), dst)
+                    files.append(dst)
+            except Exception as e:
+                logger.warning(f"Media cache: blob illeggibile per {key}, scarto la voce: {e}")
+                for p in files:
+                    try:
+                        os.remove(p)
+                    except Exception:
+                        pass
+                self._drop_entry(mk)
+                self._save()
+                self._stats['misses'] += 1
+                return None
+            entry['a'] = now
+            self._stats['hits'] += 1
+            self._save(force=False)
+        result = dict(entry.get('meta', {}))
+        result['success'] = True
+        result['from_cache'] = True
+        result['digests'] = [os.path.splitext(b)[0] for b in entry.get('blobs', [])]
+        if result.get('type', 'video') == 'video' and len(files) == 1:
+            result['file_path'] = files[0]
+        else:
+            result['type'] = 'carousel'
+            result['files'] = files
+        logger.info(f"Media cache HIT {key} ({len(files)} file)")
+        return result
+
+    def contains(self, key: str) -> bool:
+        """True se la chiave è in cache (non conta come hit/miss)."""
+        if not self.enabled or not key:
+            return False
+        with self._lock:
+            return self._resolve(key) is not None
+
+    def put(self, keys: Iterable[str], result: Dict, digests: Optional[List[str]] = None) -> bool:
+        """Mette in cache un risultato riuscito di download_video sotto tutte le
+        `keys` (la prima è la chiave principale, le altre alias). `digests`
+        (opzionale, stesso ordine dei file) evita di rileggere i file."""
+        keys = [k for k in keys if k]
+        if not self.enabled or not keys or not isinstance(result, dict) or not result.get('success'):
+            return False
+        if result.get('type', 'video') == 'video':
+            paths = [result.get('file_path')]
+        else:
+            paths = list(result.get('files') or [])
+        paths = [p for p in paths if p and os.path.exists(p)]
+        if not paths:
+            return False
+        try:
+            if sum(os.path.getsize(p) for p in paths) > self.max_bytes:
+                return False  # più grande dell'intero budget: inutile
+            # Hash fuori dal lock (lettura a blocchi)
+            if not digests or len(digests) != len(paths):
+                digests = [digest_of(p) for p in paths]
+        except Exception as e:
+            logger.warning(f"Media cache: put fallito ({keys[0]}): {e}")
+            return False
+
+        blobs = []
+        with self._lock:
+            try:
+                for p, d in zip(paths, digests):
+                    name = d + os.path.splitext(p)[1].lower()
+                    if not os.path.exists(self._blob(name)):
+                        _link_or_copy(p, self._blob(name))
+                    blobs.append(name)
+            except Exception as e:
+                logger.warning(f"Media cache: scrittura blob fallita ({keys[0]}): {e}")
+                self._gc_blobs()
+                return False
+            now = time.time()
+            meta = {k: v for k, v in result.items() if k not in _FILE_FIELDS and k != 'from_cache'}
+            mk = keys[0]
+            self._entries[mk] = {'blobs': blobs, 'meta': meta, 't': now, 'a': now}
+            for a in keys[1:]:
+                if a != mk:
+                    self._aliases[a] = mk
+            self._stats['stores'] += 1
+            self._expire(now)
+            self._enforce_budget()
+            self._save()
+        return True
+
+    def stats(self) -> Dict:
+        with self._lock:
+            looked = self._stats['hits'] + self._stats['misses']
+            return dict(self._stats,
+                        entries=len(self._entries),
+                        bytes=self._total_bytes() if self.enabled else 0,
+                        max_bytes=self.max_bytes,
+                        hit_rate=(self._stats['hits'] / looked) if looked else 0.0)
+
+
+_caches: Dict[str, MediaCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(temp_dir: str) -> MediaCache:
+    """Cache condivisa del processo (una per temp_dir): tutti i downloader dei
+    vari frontend usano la stessa."""
+    root = os.path.join(temp_dir, CACHE_DIRNAME)
+    with _caches_lock:
+        if root not in _caches:
+            _caches[root] = MediaCache(root)
+            atexit.register(_caches[root].flush)   # gli ultimi accessi non salvati
+        return _caches[root]
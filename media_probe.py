@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""Un solo ffprobe per file, con il risultato in cache per digest.
+
+Ogni pezzo lanciava il suo ffprobe: discord_bot per la durata e poi per "ha
+l'audio?" (a ogni invio, solo per una riga di log), transcode per pianificare
+l'encode, audio_derive per il codec audio; il merge audio DASH dei caroselli
+non guardava nulla e univa alla cieca. Qui:
+
+  - probe(path) / probe_sync(path): UN ffprobe JSON -> MediaInfo compatto
+    (durata, bitrate, contenitore, primo video e primo audio con codec,
+    dimensioni, fps, e per gli mp4 se il moov sta prima dei dati);
+  - cache in memoria per digest del contenuto (media_cache.digest_of: per i
+    file scaricati è già noto dal download, per gli altri si calcola una volta
+    e serve anche alla cache media): lo stesso video visto dal downloader,
+    dalla ricompressione e da send_video di Telegram si analizza una volta;
+  - cached(path): solo se già analizzato (niente processi né letture), per i
+    log;
+  - moov_first(path): posizione del moov leggendo le intestazioni dei box, senza
+    ffprobe (serve per decidere se un mp4 va rimpacchettato in faststart).
+"""
+
+import os
+import json
+import struct
+import asyncio
+import logging
+import threading
+import subprocess
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import media_cache
+
+logger = logging.getLogger(__name__)
+
+CACHE_MAX = 512
+PROBE_TIMEOUT = 30
+_CMD = ['ffprobe', '-v', 'error', '-print_format', 'json', '-show_format', '-show_streams']
+
+_lock = threading.Lock()
+_cache: 'OrderedDict[str, MediaInfo]' = OrderedDict()
+_stats = {'probes': 0, 'hits': 0, 'failed': 0}
+
+
+class MediaInfo:
+    __slots__ = ('duration', 'bit_rate', 'format', 'size', 'vcodec', 'width', 'height', 'fps',
+                 'acodec', 'abit_rate', 'moov_first')
+
+    def __init__(self, duration: float = 0.0, bit_rate: float = 0.0, format: str = '',
+                 size: int = 0, vcodec: Optional[str] = None, width: int = 0, height: int = 0,
+                 fps: float = 0.0, acodec: Optional[str] = None, abit_rate: float = 0.0,
+                 moov_first: Optional[bool] = None):
+        self.duration = duration
+        self.bit_rate = bit_rate
+        self.format = format
+        self.size = size
+        self.vcodec = vcodec
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.acodec = acodec
+        self.abit_rate = abit_rate
+        self.moov_first = moov_first      # None: non è un mp4/mov
+
+    @property
+    def has_video(self) -> bool:
+        return bool(self.vcodec)
+
+    @property
+    def has_audio(self) -> bool:
+        return bool(self.acodec)
+
+    def __repr__(self):
+        return (f"MediaInfo({self.vcodec}/{self.acodec} {self.width}x{self.height}@{self.fps:.0f} "
+                f"{self.duration:.1f}s moov_first={self.moov_first})")
+
+
+def _num(v) -> float:
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _fps(rate: Optional[str]) -> float:
+    """'30000/1001' -> 29.97 (0 se non si sa)."""
+    try:
+        n, _, d = (rate or '').partition('/')
+        return float(n) / float(d or 1)
+    except (ValueError, ZeroDivisionError):
+        return 0.0
+
+
+def moov_first(path: str) -> Optional[bool]:
+    """mp4/mov: True se il moov viene prima di mdat (faststart), False se dopo,
+    None se non è un file a box ISO o non si capisce. Legge solo le intestazioni."""
+    try:
+        size = os.path.getsize(path)
+        with open(path, 'rb') as f:
+            pos = 0
+            while pos + 8 <= size:
+                f.seek(pos)
+                head = f.read(16)
+                box_len, kind = struct.unpack('>I4s', head[:8])
+                if box_len == 1:
+                    if len(head) < 16:
+                        return None
+                    box_len = struct.unpack('>Q', head[8:16])[0]
+                elif box_len == 0:
+                    box_len = size - pos
+                if kind == b'moov':
+                    return True
+                if kind == b'mdat':
+                    return False
+                if box_len < 8 or (pos == 0 and kind != b'ftyp'):
+                    return None
+                pos += box_len
+    except (OSError, struct.error):
+        pass
+    return None
+
+
+def _parse(raw: bytes, path: str) -> Optional[MediaInfo]:
+    try:
+        data = json.loads(raw.decode('utf-8', 'replace') or '{}')
+    except ValueError:
+        return None
+    streams = data.get('streams') or []
+    fmt = data.get('format') or {}
+    if not streams and not fmt:
+        return None
+    v = next((s for s in streams if s.get('codec_type') == 'video'
+              and not (s.get('disposition') or {}).get('attached_pic')), None)
+    a = next((s for s in streams if s.get('codec_type') == 'audio'), None)
+    info = MediaInfo(
+        duration=_num(fmt.get('duration')) or _num((v or a or {}).get('duration')),
+        bit_rate=_num(fmt.get('bit_rate')),
+        format=fmt.get('format_name') or '',
+        size=int(_num(fmt.get('size'))),
+        vcodec=v.get('codec_name') if v else None,
+        width=int(_num(v.get('width'))) if v else 0,
+        height=int(_num(v.get('height'))) if v else 0,
+        fps=_fps(v.get('avg_frame_rate') or v.get('r_frame_rate')) if v else 0.0,
+        acodec=a.get('codec_name') if a else None,
+        abit_rate=_num(a.get('bit_rate')) if a else 0.0,
+    )
+    if 'mp4' in info.format or 'mov' in info.format:
+        info.moov_first = moov_first(path)
+    # Rotazione 90/270 (video verticali girati col telefono): dimensioni come si vedono
+    rot = 0
+    if v:
+        rot = int(_num((v.get('tags') or {}).get('rotate')))
+        for sd in v.get('side_data_list') or []:
+            rot = rot or int(_num(sd.get('rotation')))
+    if abs(rot) in (90, 270):
+        info.width, info.height = info.height, info.width
+    return info
+
+
+def _key(path: str) -> Optional[str]:
+    try:
+        return media_cache.digest_of(path)
+    except OSError:
+        return None
+
+
+def _lookup(key: Optional[str]) -> Optional[MediaInfo]:
+    if not key:
+        return None
+    with _lock:
+        info = _cache.get(key)
+        if info is not None:
+            _cache.move_to_end(key)
+            _stats['hits'] += 1
+        return info
+
+
+def _store(key: Optional[str], info: Optional[MediaInfo]) -> Optional[MediaInfo]:
+    with _lock:
+        if info is None:
+            _stats['failed'] += 1
+            return None
+        if key:
+            _cache[key] = info
+            _cache.move_to_end(key)
+            while len(_cache) > CACHE_MAX:
+                _cache.popitem(last=False)
+    return info
+
+
+async def probe(path: str) -> Optional[MediaInfo]:
+    """MediaInfo di `path` (None se ffprobe non lo capisce)."""
+    if not path or not os.path.exists(path):
+        return None
+    key = await asyncio.to_thread(_key, path)
+    hit = _lookup(key)
+    if hit is not None:
+        return hit
+    with _lock:
+        _stats['probes'] += 1
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *_CMD, path, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL)
+        out, _ = await asyncio.wait_for(proc.communicate(), timeout=PROBE_TIMEOUT)
+    except Exception as e:
+        logger.debug(f"ffprobe fallito su {os.path.basename(path)}: {e}")
+        return _store(key, None)
+    return _store(key, _parse(out, path) if proc.returncode == 0 else None)
+
+
+def probe_sync(path: str) -> Optional[MediaInfo]:
+    """Come probe(), per il codice che gira nei thread (merge dei caroselli)."""
+    if not path or not os.path.exists(path):
+        return None
+    key = _key(path)
+    hit = _lookup(key)
+    if hit is not None:
+        return hit
+    with _lock:
+        _stats['probes'] += 1
+    try:
+        res = subprocess.run([*_CMD, path], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                             timeout=PROBE_TIMEOUT)
+    except Exception as e:
+        logger.debug(f"ffprobe fallito su {os.path.basename(path)}: {e}")
+        return _store(key, None)
+    return _store(key, _parse(res.stdout, path) if res.returncode == 0 else None)
+
+
+def cached(path: str) -> Optional[MediaInfo]:
+    """MediaInfo già noto (digest del download già calcolato e file già
+    analizzato), senza lanciare nulla né leggere il file."""
+    key = media_cache.known_digest(path) if path else None
+    with _lock:
+        return _cache.get(key) if key else None
+
+
+def stats() -> Dict:
+    with _lock:
+        return dict(_stats, entries=len(_cache))
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""Download a metà da riprendere al tentativo successivo (stesso URL).
+
+Quando un download cadeva a metà (timeout, 5xx, connessione chiusa) il file
+parziale si cancellava e il tentativo dopo ripartiva da zero, anche se puntava
+allo stesso identico URL della CDN. Qui segmented.fetch, invece di lasciare il
+parziale a chi lo cancella:
+
+  - lo sposta in temp_dir/resume_<hash url>.part e ricorda dimensione totale,
+    validatori (ETag, Last-Modified) e i tratti che mancano;
+  - al fetch successivo dello stesso URL chiede solo quei tratti (Range +
+    If-Range): se il server risponde 206 con stessa dimensione e stessi
+    validatori si riprende da lì, altrimenti (200, file cambiato) il parziale
+    si butta e si riparte pulito.
+
+Si tengono solo parziali con almeno RESUME_MIN_MB già scaricati e un
+validatore (senza, non si può sapere se il file è ancora lo stesso), per
+RESUME_TTL_MIN minuti. I file sono artefatti come gli altri (.part): se
+restano orfani li pulisce il janitor.
+"""
+
+import os
+import time
+import hashlib
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import janitor
+
+logger = logging.getLogger(__name__)
+
+RESUME_TTL = int(float(os.getenv('RESUME_TTL_MIN', '20')) * 60)
+RESUME_MIN_BYTES = int(float(os.getenv('RESUME_MIN_MB', '1')) * 1024 * 1024)
+RESUME_MAX_ENTRIES = 32
+
+_lock = threading.Lock()
+_partials: Dict[str, 'Partial'] = {}
+_stats = {'kept': 0, 'resumed': 0, 'invalidated': 0, 'expired': 0, 'bytes_saved': 0}
+
+
+class Partial:
+    def __init__(self, url: str, path: str, total: int, etag: Optional[str],
+                 last_modified: Optional[str], missing: List[Tuple[int, int]]):
+        self.url = url
+        self.path = path
+        self.total = total
+        self.etag = etag
+        self.last_modified = last_modified
+        self.missing = missing
+        self.created = time.time()
+
+    @property
+    def have(self) -> int:
+        return self.total - sum(end + 1 - pos for pos, end in self.missing)
+
+    @property
+    def validator(self) -> Optional[str]:
+        """Valore per If-Range: ETag forte, altrimenti Last-Modified."""
+        if self.etag and not self.etag.startswith('W/'):
+            return self.etag
+        return self.last_modified
+
+
+def _expire_locked(now: float) -> List['Partial']:
+    old = [p for p in _partials.values() if now - p.created > RESUME_TTL]
+    for p in old:
+        del _partials[p.url]
+    _stats['expired'] += len(old)
+    while len(_partials) > RESUME_MAX_ENTRIES:
+        oldest = min(_partials.values(), key=lambda p: p.created)
+        del _partials[oldest.url]
+        old.append(oldest)
+    return old
+
+
+def keep(url: str, path: str, total: Optional[int], headers,
+         missing: List[Tuple[int, int]]) -> bool:
+    """Mette da parte il parziale `path` di `url` (solo se riprendibile).
+    `missing`: tratti [inizio, fine] ancora da scaricare. True se tenuto (e
+    `path` non esiste più)."""
+    etag = headers.get('ETag') if headers is not None else None
+    last_modified = headers.get('Last-Modified') if headers is not None else None
+    if not total or not (etag or last_modified):
+        return False
+    part = Partial(url, '', total, etag, last_modified, [m for m in missing if m[0] <= m[1]])
+    if not part.missing or part.have < RESUME_MIN_BYTES:
+        return False
+    name = f"resume_{hashlib.md5(url.encode('utf-8')).hexdigest()[:16]}.part"
+    part.path = os.path.join(os.path.dirname(path) or '.', name)
+    try:
+        os.replace(path, part.path)
+    except OSError as e:
+        logger.debug(f"Ripresa: parziale non spostato: {e}")
+        return False
+    janitor.track(part.path)
+    with _lock:
+        replaced = _partials.pop(url, None)
+        _partials[url] = part
+        _stats['kept'] += 1
+        dropped = _expire_locked(time.time())
+    for p in dropped + ([replaced] if replaced and replaced.path != part.path else []):
+        janitor.discard(p.path)
+    logger.info(f"Ripresa: tenuti {part.have / (1024 * 1024):.1f}/{total / (1024 * 1024):.1f} MB "
+                f"di {url[:80]}")
+    return True
+
+
+def has(url: str) -> bool:
+    with _lock:
+        return url in _partials
+
+
+def claim(url: str) -> Optional[Partial]:
+    """Parziale di `url` da riprendere (tolto dal registro: uno solo lo usa)."""
+    with _lock:
+        part = _partials.pop(url, None)
+        dropped = _expire_locked(time.time())
+    for p in dropped:
+        janitor.discard(p.path)
+    if part is None:
+        return None
+    if time.time() - part.created > RESUME_TTL or not os.path.exists(part.path):
+        janitor.discard(part.path)
+        return None
+    return part
+
+
+def matches(part: Partial, status: int, start: Optional[int], total: Optional[int], headers) -> bool:
+    """La risposta alla richiesta di ripresa è il seguito dello stesso file?"""
+    if status != 206 or start != part.missing[0][0] or total != part.total:
+        return False
+    etag = headers.get('ETag')
+    last_modified = headers.get('Last-Modified')
+    if part.etag and etag and etag != part.etag:
+        return False
+    if part.last_modified and last_modified and last_modified != part.last_modified:
+        return False
+    return True
+
+
+def restore(part: Partial, path: str) -> List[Tuple[int, int]]:
+    """Riporta il parziale in `path`; ritorna i tratti ancora da scaricare."""
+    os.replace(part.path, path)
+    janitor.discard(part.path)
+    janitor.track(path)
+    with _lock:
+        _stats['resumed'] += 1
+        _stats['bytes_saved'] += part.have
+    logger.info(f"Ripresa: riparto da {part.have / (1024 * 1024):.1f} MB per {part.url[:80]}")
+    return list(part.missing)
+
+
+def invalidate(part: Partial) -> None:
+    """Il file sul server è cambiato (o non accetta più Range): via il parziale."""
+    janitor.discard(part.path)
+    with _lock:
+        _stats['invalidated'] += 1
+
+
+def stats() -> Dict:
+    with _lock:
+        return {**_stats, 'pending': len(_partials),
+                'pending_bytes': sum(p.have for p in _partials.values())}
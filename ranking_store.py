@@ -19,6 +19,8 @@ import json
 import time
 import asyncio
 import logging
+import threading
+import concurrent.futures
 from datetime import datetime
 from typing import Dict, List, Optional, Tuple
 
@@ -885,24 +887,74 @@ def _init_firestore_client():
         return None
 
 
-def get_ranking_store(json_fallback_path: str) -> RankingStore:
-    """Crea lo store: Firestore se possibile, altrimenti JSON locale."""
+def _firestore_health_check(client) -> None:
+    # Health-check: una lettura di prova. Se Firestore non e' abilitato nel
+    # progetto, qui esce un 403 ESPLICITO (invece di fallire in silenzio dopo).
+    try:
+        client.collection('bot_state').document('_healthcheck').get()
+        logger.info("Ranking: Firestore raggiungibile (health-check OK)")
+    except Exception as he:
+        logger.error(
+            "Ranking: FIRESTORE NON RAGGIUNGIBILE — i dati NON verranno salvati! "
+            "Abilita 'Firestore Database' nella console Firebase del progetto. "
+            f"Dettaglio: {str(he)[:200]}"
+        )
+
+
+def _build_store(json_fallback_path: str, background_health: bool = False) -> RankingStore:
     client = _init_firestore_client()
     if client is not None:
         try:
             store = FirestoreRankingStore(client)
-            # Health-check: una lettura di prova. Se Firestore non e' abilitato nel
-            # progetto, qui esce un 403 ESPLICITO (invece di fallire in silenzio dopo).
-            try:
-                client.collection('bot_state').document('_healthcheck').get()
-                logger.info("Ranking: Firestore raggiungibile (health-check OK)")
-            except Exception as he:
-                logger.error(
-                    "Ranking: FIRESTORE NON RAGGIUNGIBILE — i dati NON verranno salvati! "
-                    "Abilita 'Firestore Database' nella console Firebase del progetto. "
-                    f"Dettaglio: {str(he)[:200]}"
-                )
+            if background_health:
+                threading.Thread(target=_firestore_health_check, args=(client,),
+                                 name='firestore-health', daemon=True).start()
+            else:
+                _firestore_health_check(client)
             return store
         except Exception as e:
             logger.error(f"Ranking: Firestore non utilizzabile, fallback JSON: {e}")
     return JsonRankingStore(json_fallback_path)
+
+
+class DeferredRankingStore:
+    """Store che si inizializza in un thread (import di firebase-admin, credenziali,
+    client): l'avvio del bot non lo aspetta. Ogni metodo dello store è async: chi
+    lo chiama prima che sia pronto attende l'inizializzazione, da qualsiasi event
+    loop (Telegram, Discord, WhatsApp)."""
+
+    def __init__(self, json_fallback_path: str):
+        self._fut: concurrent.futures.Future = concurrent.futures.Future()
+        self._t0 = time.monotonic()
+        threading.Thread(target=self._init, args=(json_fallback_path,),
+                         name='ranking-init', daemon=True).start()
+
+    def _init(self, json_fallback_path: str):
+        try:
+            store = _build_store(json_fallback_path, background_health=True)
+            logger.info(f"Ranking: store pronto in {time.monotonic() - self._t0:.2f}s (in background)")
+            self._fut.set_result(store)
+        except BaseException as e:  # _build_store ripiega già su JSON: qui solo imprevisti
+            self._fut.set_exception(e)
+
+    def ready(self) -> bool:
+        return self._fut.done()
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if self._fut.done():
+            return getattr(self._fut.result(), name)
+
+        async def _deferred(*args, **kwargs):
+            store = await asyncio.wrap_future(self._fut)
+            return await getattr(store, name)(*args, **kwargs)
+        return _deferred
+
+
+def get_ranking_store(json_fallback_path: str, background: bool = False):
+    """Crea lo store: Firestore se possibile, altrimenti JSON locale. Con
+    background=True l'inizializzazione (e l'health-check) non blocca il chiamante."""
+    if background:
+        return DeferredRankingStore(json_fallback_path)
+    return _build_store(json_fallback_path)
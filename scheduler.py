@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""Scheduler globale dei download, davanti a SocialMediaDownloader.
+
+I tre frontend (Telegram, Discord, WhatsApp) chiamavano download_video senza
+alcun limite comune: una raffica di link faceva partire insieme tanti thread
+yt-dlp, chiamate Cobalt e ffmpeg su un'istanza da 512 MB. Qui ogni lavoro chiede
+uno slot e aspetta il suo turno:
+
+  - limite di lavori contemporanei PER PIATTAFORMA (SCHED_LIMITS, es.
+    "youtube=1,instagram=2,default=2") e un tetto globale (SCHED_MAX_ACTIVE)
+    per i lavori non "leggeri";
+  - coda equa: dentro la stessa priorità si serve a giro (round-robin) un
+    proprietario alla volta (proprietario = frontend:chat:utente), così chi
+    incolla 10 link non blocca gli altri;
+  - priorità: prima i lavori leggeri (hit di cache, foto), poi i normali, per
+    ultimi i pesanti (YouTube lunghi, compressioni ffmpeg). I leggeri non
+    contano nel tetto globale: non restano mai dietro a un YouTube da 10 minuti;
+  - timeout di run() dall'invio (attesa in coda + esecuzione): una coda satura
+    non tiene un lavoro appeso prima ancora che il suo timeout parta;
+  - statistiche: profondità della coda, tempo di attesa (anche di chi è ancora
+    in coda) e timeout scaduti in coda o durante il lavoro.
+
+Thread-safe: i frontend girano in thread con event loop diversi, quindi lo
+stato sta dietro a un threading.Lock e lo slot si consegna con un
+concurrent.futures.Future (come in inflight).
+"""
+
+import os
+import time
+import asyncio
+import logging
+import threading
+import concurrent.futures
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Priorità (più basso = prima)
+CHEAP, NORMAL, HEAVY = 0, 1, 2
+_PRIO_NAMES = ('leggeri', 'normali', 'pesanti')
+
+MAX_ACTIVE = max(1, int(os.getenv('SCHED_MAX_ACTIVE', '3')))
+
+
+def _parse_limits(raw: str) -> Dict[str, int]:
+    out = {}
+    for part in (raw or '').split(','):
+        if '=' in part:
+            k, v = part.split('=', 1)
+            try:
+                out[k.strip().lower()] = max(1, int(v))
+            except ValueError:
+                logger.warning(f"SCHED_LIMITS: valore non valido '{part}'")
+    return out
+
+
+# Default pensati per 512 MB: un solo yt-dlp YouTube e un solo ffmpeg alla volta.
+LIMITS = {'youtube': 1, 'ffmpeg': 1, 'cache': 4, 'default': 2}
+_EXPLICIT = _parse_limits(os.getenv('SCHED_LIMITS', ''))
+LIMITS.update(_EXPLICIT)
+
+
+class _Waiter:
+    __slots__ = ('platform', 'owner', 'priority', 'fut', 't0')
+
+    def __init__(self, platform: str, owner: str, priority: int):
+        self.platform = platform
+        self.owner = owner
+        self.priority = priority
+        self.fut = concurrent.futures.Future()
+        self.t0 = time.monotonic()
+
+
+_lock = threading.Lock()
+_active: Dict[str, int] = {}
+_heavy_active = [0]    # lavori attivi non leggeri (contano nel tetto globale)
+# Una coda per priorità: proprietario -> deque dei suoi lavori (ordine di arrivo)
+_queues = [OrderedDict() for _ in range(3)]
+_stats = {'granted': 0, 'cancelled': 0, 'wait_total': 0.0, 'wait_max': 0.0,
+          'timeouts': 0, 'queue_timeouts': 0}
+
+
+def _limit(platform: str) -> int:
+    return LIMITS.get(platform, LIMITS.get('default', 2))
+
+
+def _runnable(w: _Waiter) -> bool:
+    if _active.get(w.platform, 0) >= _limit(w.platform):
+        return False
+    return w.priority == CHEAP or _heavy_active[0] < MAX_ACTIVE
+
+
+def _pick_locked() -> Optional[_Waiter]:
+    for q in _queues:
+        for owner in list(q.keys()):
+            dq = q[owner]
+            for w in list(dq):
+                if w.fut.cancelled():
+                    dq.remove(w)
+                    continue
+                if _runnable(w):
+                    dq.remove(w)
+                    # RUNNING: da qui il Future non si può più cancellare (la
+                    # cancellazione del chiamante arriva da wrap_future, fuori dal lock)
+                    if not w.fut.set_running_or_notify_cancel():
+                        continue
+                    if dq:
+                        q.move_to_end(owner)   # round-robin: il prossimo giro tocca agli altri
+                    else:
+                        del q[owner]
+                    return w
+            if not dq:
+                q.pop(owner, None)
+    return None
+
+
+def _dispatch_locked():
+    while True:
+        w = _pick_locked()
+        if w is None:
+            return
+        _active[w.platform] = _active.get(w.platform, 0) + 1
+        if w.priority != CHEAP:
+            _heavy_active[0] += 1
+        waited = time.monotonic() - w.t0
+        _stats['granted'] += 1
+        _stats['wait_total'] += waited
+        _stats['wait_max'] = max(_stats['wait_max'], waited)
+        w.fut.set_result(waited)
+
+
+def _release(w: _Waiter):
+    with _lock:
+        _active[w.platform] = max(0, _active.get(w.platform, 0) - 1)
+        if w.priority != CHEAP:
+            _heavy_active[0] = max(0, _heavy_active[0] - 1)
+        _dispatch_locked()
+
+
+def set_default_limit(platform: str, limit: int) -> int:
+    """Cambia il limite di default di `platform` (es. 'ffmpeg' calcolato da
+    transcode su CPU e RAM). Vince SCHED_LIMITS se lo imposta. Ritorna il limite
+    in vigore."""
+    platform = platform.lower()
+    with _lock:
+        if platform not in _EXPLICIT:
+            LIMITS[platform] = max(1, int(limit))
+            _dispatch_locked()
+        return LIMITS[platform]
+
+
+@asynccontextmanager
+async def slot(platform: str, owner: str, priority: int = NORMAL):
+    """Attende il turno per un lavoro su `platform` e lo tiene per la durata del
+    blocco `async with`."""
+    w = _Waiter((platform or 'default').lower(), owner or '?', priority)
+    with _lock:
+        _queues[priority].setdefault(w.owner, deque()).append(w)
+        _dispatch_locked()
+    try:
+        waited = await asyncio.wrap_future(w.fut)
+    except asyncio.CancelledError:
+        with _lock:
+            granted = w.fut.done() and not w.fut.cancelled()
+            if not granted:
+                w.fut.cancel()
+                _stats['cancelled'] += 1
+        if granted:
+            _release(w)   # slot concesso proprio mentre il chiamante rinunciava
+        raise
+    if waited > 1:
+        logger.info(f"Scheduler: {w.owner} ha atteso {waited:.1f}s per uno slot {w.platform}")
+    try:
+        yield waited
+    finally:
+        _release(w)
+
+
+async def run(factory: Callable[[], Awaitable[Any]], platform: str, owner: str,
+              priority: int = NORMAL, timeout: Optional[float] = None) -> Any:
+    """Esegue factory() dentro uno slot. `timeout` conta dall'invio, attesa in
+    coda compresa (alza asyncio.TimeoutError come asyncio.wait_for; se scade in
+    coda il lavoro esce dalla coda senza partire)."""
+    if not timeout:
+        async with slot(platform, owner, priority):
+            return await factory()
+    started = [False]
+
+    async def _job():
+        async with slot(platform, owner, priority):
+            started[0] = True
+            return await factory()
+
+    try:
+        return await asyncio.wait_for(_job(), timeout=timeout)
+    except asyncio.TimeoutError:
+        with _lock:
+            _stats['timeouts' if started[0] else 'queue_timeouts'] += 1
+        raise
+
+
+def stats() -> Dict:
+    with _lock:
+        queued = {}
+        depth = [0, 0, 0]
+        now = time.monotonic()
+        oldest = 0.0
+        for prio, q in enumerate(_queues):
+            for dq in q.values():
+                for w in dq:
+                    if w.fut.cancelled():
+                        continue
+                    depth[prio] += 1
+                    queued[w.platform] = queued.get(w.platform, 0) + 1
+                    oldest = max(oldest, now - w.t0)
+        g = _stats['granted']
+        return {
+            'active': {k: v for k, v in _active.items() if v},
+            'queued': queued,
+            'depth': dict(zip(_PRIO_NAMES, depth)),
+            'queue_depth': sum(depth),
+            'granted': g,
+            'cancelled': _stats['cancelled'],
+            'wait_avg': (_stats['wait_total'] / g) if g else 0.0,
+            'wait_max': _stats['wait_max'],
+            'wait_oldest': oldest,          # chi è in coda da più tempo, adesso
+            'timeouts': _stats['timeouts'],
+            'queue_timeouts': _stats['queue_timeouts'],
+            'limits': dict(LIMITS, globale=MAX_ACTIVE),
+        }
@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+"""Download a segmenti: più richieste HTTP Range in parallelo sullo stesso file.
+
+I video grandi (mp4 progressivi di YouTube/Facebook, slide video e audio DASH di
+Instagram) arrivavano con UNA connessione a blocchi da 256 KB, e alcune CDN
+limitano la banda per connessione. Qui fetch():
+
+  - apre la prima richiesta con "Range: bytes=0-": se il server risponde 206 con
+    la dimensione totale, il file si divide in parti, le altre partono in
+    parallelo (pool di thread dedicato) e la prima connessione continua a
+    leggere la sua; se risponde 200 (niente Range) o il file è piccolo si
+    scarica tutto da lì, come prima;
+  - le connessioni in più verso uno stesso host sono al massimo SEGMENT_PER_HOST
+    in tutto il processo: se sono finite il file si divide in meno parti (non si
+    aspetta mai uno slot, quindi niente stalli col pool di smd_fetch);
+  - il file è preallocato e i tratti stanno in una coda: la prima connessione,
+    finito il suo, ne prende altri come i thread; un tratto caduto a metà si
+    riprende una volta dal byte a cui era arrivato;
+  - se il download fallisce comunque, quello che è già su disco resta per il
+    prossimo tentativo sullo stesso URL (partials.py: Range + If-Range);
+  - il limite di dimensione della richiesta (size_guard) vale sul totale
+    annunciato e sui byte scritti da tutte le parti insieme;
+  - stats(): download a segmenti e a flusso singolo (solo file grandi) con la
+    banda media di ciascuno, cioè il guadagno misurato sul campo.
+
+SEGMENT_PARTS è anche la concorrenza dei frammenti DASH/HLS di yt-dlp
+(concurrent_fragment_downloads, vedi fragment_concurrency()).
+"""
+
+import os
+import re
+import time
+import logging
+import threading
+import concurrent.futures
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import janitor
+import media_cache
+import partials
+import size_guard
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_PARTS = max(1, int(os.getenv('SEGMENT_PARTS', '4')))
+SEGMENT_MIN_BYTES = max(1, int(float(os.getenv('SEGMENT_MIN_MB', '4')) * 1024 * 1024))
+SEGMENT_PER_HOST = max(0, int(os.getenv('SEGMENT_PER_HOST', '6')))
+CHUNK = 1024 * 256
+
+_CONTENT_RANGE = re.compile(r'bytes\s+(\d+)-(\d+)/(\d+)')
+
+_pool = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, SEGMENT_PER_HOST * 2),
+                                              thread_name_prefix='smd-segment')
+_host_lock = threading.Lock()
+_host_extra: Dict[str, threading.BoundedSemaphore] = {}
+
+_lock = threading.Lock()
+_stats = {'segmented': 0, 'single': 0, 'no_range': 0, 'parts': 0, 'retries': 0,
+          'seg_bytes': 0, 'seg_seconds': 0.0, 'single_bytes': 0, 'single_seconds': 0.0}
+
+
+class _Stopped(Exception):
+    """Un'altra parte è fallita: inutile continuare questa."""
+
+
+class _Span:
+    """Tratto [pos, end] da scaricare; pos avanza man mano che si scrive."""
+    __slots__ = ('pos', 'end')
+
+    def __init__(self, pos: int, end: int):
+        self.pos = pos
+        self.end = end
+
+
+class _Download:
+    """Stato condiviso di un file a parti: coda dei tratti, byte scritti (col
+    limite della richiesta), stop al primo errore."""
+
+    def __init__(self, http, url: str, path: str, headers: Optional[Dict], timeout: int, cookies,
+                 budget: 'size_guard.Budget', total: int, spans: List[_Span]):
+        self.http = http
+        self.url = url
+        self.path = path
+        self.headers = headers
+        self.timeout = timeout
+        self.cookies = cookies
+        self.budget = budget
+        self.total = total
+        self.spans = spans
+        self.stop = False
+        self._queue = deque(spans)
+        self._n = 0
+        self._lock = threading.Lock()
+
+    def next_span(self) -> Optional[_Span]:
+        with self._lock:
+            return self._queue.popleft() if self._queue and not self.stop else None
+
+    def add(self, k: int) -> None:
+        if self.stop:
+            raise _Stopped()
+        with self._lock:
+            self._n += k
+            n = self._n
+        self.budget.check_stream(n, self.total)
+
+    def missing(self) -> List[Tuple[int, int]]:
+        """Tratti non ancora scritti (per riprendere il file più tardi)."""
+        return [(s.pos, s.end) for s in self.spans if s.pos <= s.end]
+
+
+def enabled() -> bool:
+    return SEGMENT_PARTS > 1 and SEGMENT_PER_HOST > 0
+
+
+def fragment_concurrency() -> int:
+    """Frammenti DASH/HLS scaricati insieme da yt-dlp."""
+    return SEGMENT_PARTS
+
+
+def _take_extra(url: str, wanted: int) -> Tuple[threading.BoundedSemaphore, int]:
+    """Prende fino a `wanted` connessioni in più verso l'host, senza aspettare."""
+    host = (urlparse(url).hostname or '').lower()
+    with _host_lock:
+        sem = _host_extra.get(host)
+        if sem is None:
+            sem = _host_extra[host] = threading.BoundedSemaphore(SEGMENT_PER_HOST)
+    got = 0
+    while got < wanted and sem.acquire(blocking=False):
+        got += 1
+    return sem, got
+
+
+def _split(total: int, n: int, offset: int = 0) -> List[Tuple[int, int]]:
+    """n intervalli [inizio, fine] (estremi inclusi) che coprono total byte da offset."""
+    size = -(-total // n)
+    return [(offset + i, offset + min(i + size, total) - 1) for i in range(0, total, size)]
+
+
+def _plan(missing: List[Tuple[int, int]], n: int) -> List[_Span]:
+    """Tratti mancanti di un parziale, divisi fino a n parti ciascuno."""
+    spans = []
+    for a, b in missing:
+        k = max(1, min(n, (b + 1 - a) // SEGMENT_MIN_BYTES))
+        spans.extend(_Span(x, y) for x, y in _split(b + 1 - a, k, a))
+    return spans
+
+
+def _record(kind: str, size: int, seconds: float) -> None:
+    with _lock:
+        _stats[kind] += 1
+        if size >= SEGMENT_MIN_BYTES:
+            prefix = 'seg' if kind == 'segmented' else 'single'
+            _stats[f'{prefix}_bytes'] += size
+            _stats[f'{prefix}_seconds'] += seconds
+
+
+def _content_range(resp) -> Tuple[Optional[int], Optional[int]]:
+    """(inizio, totale) di una risposta 206; (None, None) se manca o è ignoto."""
+    if resp.status_code != 206:
+        return None, None
+    m = _CONTENT_RANGE.match(resp.headers.get('Content-Range') or '')
+    return (int(m.group(1)), int(m.group(3))) if m else (None, None)
+
+
+def _accepts_ranges(resp) -> bool:
+    return resp.status_code == 206 or (resp.headers.get('Accept-Ranges') or '').lower() == 'bytes'
+
+
+def _write_span(resp, dl: _Download, span: _Span) -> None:
+    """Scrive la risposta nel file da span.pos fino a span.end compreso."""
+    with open(dl.path, 'r+b') as fh:
+        fh.seek(span.pos)
+        for chunk in resp.iter_content(chunk_size=CHUNK):
+            if not chunk:
+                continue
+            chunk = chunk[:span.end + 1 - span.pos]
+            fh.write(chunk)
+            span.pos += len(chunk)
+            dl.add(len(chunk))
+            if span.pos > span.end:
+                break
+
+
+def _get_span(dl: _Download, span: _Span) -> None:
+    """Un tratto con la sua richiesta Range; una ripresa se cade a metà."""
+    for attempt in range(2):
+        if dl.stop:
+            raise _Stopped()
+        h = dict(dl.headers or {})
+        h['Range'] = f'bytes={span.pos}-{span.end}'
+        try:
+            with dl.http.get(dl.url, headers=h, stream=True, timeout=dl.timeout, cookies=dl.cookies) as r:
+                if r.status_code != 206:
+                    raise IOError(f"HTTP {r.status_code} su una parte")
+                _write_span(r, dl, span)
+            if span.pos > span.end:
+                return
+            raise IOError(f"parte troncata a {span.pos}/{span.end + 1} byte")
+        except (size_guard.TooBig, _Stopped):
+            raise
+        except Exception as e:
+            if attempt:
+                raise
+            with _lock:
+                _stats['retries'] += 1
+            logger.info(f"Segmenti: riprendo la parte fino a {span.end} da {span.pos}: {str(e)[:100]}")
+
+
+def _worker(dl: _Download, sem=None) -> None:
+    """Prende tratti dalla coda finché ce ne sono (thread del pool o chiamante)."""
+    try:
+        span = dl.next_span()
+        while span is not None:
+            _get_span(dl, span)
+            span = dl.next_span()
+    except BaseException:
+        dl.stop = True      # ferma anche le altre parti (e la prima)
+        raise
+    finally:
+        if sem is not None:
+            sem.release()
+
+
+def _single(resp, url: str, path: str, budget: 'size_guard.Budget', t0: float) -> bool:
+    """Flusso unico (server senza Range o file piccolo), con digest al volo."""
+    budget.check_headers(resp.headers)
+    declared = resp.headers.get('Content-Length')
+    h = media_cache.new_hasher()
+    written = 0
+    try:
+        with open(path, 'wb') as fh:
+            for chunk in resp.iter_content(chunk_size=CHUNK):
+                if chunk:
+                    fh.write(chunk)
+                    h.update(chunk)
+                    written += len(chunk)
+                    budget.check_stream(written, declared)
+    except size_guard.TooBig:
+        raise
+    except Exception:
+        # Caduto a metà: se il server accetta Range, il prossimo tentativo riparte da qui
+        total = _content_range(resp)[1] or int(declared or 0)
+        if written and _accepts_ranges(resp):
+            partials.keep(url, path, total, resp.headers, [(written, total - 1)])
+        raise
+    if not written:
+        return False
+    media_cache.remember_digest(path, h.hexdigest())
+    _record('single', written, time.monotonic() - t0)
+    return True
+
+
+def _parallel(resp, dl: _Download, sem, extra: int) -> None:
+    """Il primo tratto dalla risposta già aperta, gli altri dalla coda: `extra`
+    thread del pool (con uno slot dell'host ciascuno) più il chiamante."""
+    first = dl.next_span()       # prima di avviare i thread: è il tratto della risposta aperta
+    futures = [_pool.submit(_worker, dl, sem) for _ in range(extra)]
+    try:
+        _write_span(resp, dl, first)
+        if first.pos <= first.end:
+            raise IOError(f"prima parte troncata ({dl.url[:80]})")
+        resp.close()
+        _worker(dl)        # anche il chiamante prende tratti dalla coda
+        for f in futures:
+            f.result()
+    except BaseException as e:
+        # Le altre parti si fermano al prossimo blocco: nessuno scrive più nel
+        # file quando chi chiama lo sposta o lo cancella
+        dl.stop = True
+        concurrent.futures.wait(futures)
+        if not isinstance(e, size_guard.TooBig):
+            partials.keep(dl.url, dl.path, dl.total, resp.headers, dl.missing())
+        if isinstance(e, _Stopped):
+            # fermata da una parte fallita: l'errore da riportare è il suo
+            for f in futures:
+                err = f.exception()
+                if err is not None and not isinstance(err, _Stopped):
+                    raise err
+        raise
+
+
+def fetch(http, url: str, path: str, headers: Optional[Dict] = None, timeout: int = 30,
+          cookies=None, parts: Optional[int] = None) -> bool:
+    """Scarica `url` in `path` (bloccante). True se il file è completo e non vuoto.
+
+    `http`: il registro HttpSessions del downloader (o qualsiasi oggetto con
+    get() alla requests). `parts`: parti massime (default SEGMENT_PARTS; 1 = un
+    flusso solo, senza Range). Se un tentativo precedente sullo stesso URL è
+    caduto a metà, riprende da lì (vedi partials.py). Solleva size_guard.TooBig
+    oltre il limite della richiesta e gli errori HTTP/rete: il parziale, se non
+    è stato messo da parte per la ripresa, lo pulisce chi chiama."""
+    budget = size_guard.current()
+    parts = SEGMENT_PARTS if parts is None else max(1, parts)
+    if not enabled():
+        parts = 1
+    part = partials.claim(url)
+    h = dict(headers or {})
+    if part is not None:
+        h['Range'] = f'bytes={part.missing[0][0]}-'
+        if part.validator:
+            h['If-Range'] = part.validator
+    elif parts > 1:
+        h['Range'] = 'bytes=0-'
+    t0 = time.monotonic()
+    janitor.track(path)
+    with http.get(url, headers=h, stream=True, timeout=timeout, cookies=cookies) as r:
+        r.raise_for_status()
+        start, total = _content_range(r)
+        missing = None
+        if part is not None:
+            if partials.matches(part, r.status_code, start, total, r.headers):
+                missing = partials.restore(part, path)
+            else:
+                partials.invalidate(part)
+                if r.status_code == 206:
+                    # Server che ignora If-Range su un file cambiato: la risposta
+                    # non è il seguito del parziale, si ricomincia da capo
+                    r.close()
+                    return fetch(http, url, path, headers, timeout, cookies, parts)
+                # 200: è già il file intero (nuovo), si scarica da qui
+        elif 'Range' in h and start is None:
+            with _lock:
+                _stats['no_range'] += 1
+
+        if missing is None:
+            n = min(parts, (total or 0) // SEGMENT_MIN_BYTES) if start == 0 else 0
+            if n < 2:
+                return _single(r, url, path, budget, t0)
+            budget.check_size(total, 'header')
+            sem, extra = _take_extra(url, n - 1)
+            if not extra:
+                return _single(r, url, path, budget, t0)
+            with open(path, 'wb') as fh:
+                fh.truncate(total)
+            spans = [_Span(a, b) for a, b in _split(total, extra + 1)]
+        else:
+            budget.check_size(total, 'header')
+            spans = _plan(missing, parts)
+            sem, extra = _take_extra(url, min(parts, len(spans)) - 1)
+        dl = _Download(http, url, path, headers, timeout, cookies, budget, total, spans)
+        _parallel(r, dl, sem, extra)
+
+    elapsed = time.monotonic() - t0
+    media_cache.digest_of(path)
+    if part is None:
+        _record('segmented', total, elapsed)
+    with _lock:
+        _stats['parts'] += len(spans)
+    logger.info(f"Segmenti: {total / (1024 * 1024):.1f} MB in {len(spans)} parti, "
+                f"{total / (1024 * 1024) / max(elapsed, 1e-6):.1f} MB/s")
+    return True
+
+
+def progressive_target(info: Optional[Dict], max_bytes: Optional[int] = None) -> Optional[Tuple[str, Dict]]:
+    """(url, header) del formato scelto da yt-dlp se vale la pena scaricarlo a
+    segmenti: un solo file http(s) (niente merge, niente frammenti) grande
+    almeno due parti e dentro `max_bytes`. None negli altri casi."""
+    if not enabled() or not isinstance(info, dict) or info.get('requested_formats'):
+        return None
+    if info.get('protocol') not in ('http', 'https') or not info.get('url'):
+        return None
+    size = info.get('filesize') or info.get('filesize_approx') or 0
+    if size < 2 * SEGMENT_MIN_BYTES or (max_bytes and size > max_bytes):
+        return None
+    return info['url'], dict(info.get('http_headers') or {})
+
+
+def stats() -> Dict:
+    mb = 1024 * 1024
+    with _lock:
+        s = dict(_stats)
+    s['seg_mbps'] = s['seg_bytes'] / mb / s['seg_seconds'] if s['seg_seconds'] else None
+    s['single_mbps'] = s['single_bytes'] / mb / s['single_seconds'] if s['single_seconds'] else None
+    s['gain'] = s['seg_mbps'] / s['single_mbps'] if s['seg_mbps'] and s['single_mbps'] else None
+    s['enabled'] = enabled()
+    return s
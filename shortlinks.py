@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""Risoluzione NON bloccante degli short link (vm/vt.tiktok.com, facebook.com/share/).
+
+clean_url faceva HEAD/GET bloccanti (fino a 10-15 s) direttamente sull'event
+loop di download_video: per tutta la durata il bot Telegram, il client Discord o
+il bridge WhatsApp su quel loop restavano congelati. Qui:
+
+  - la richiesta di rete gira in un thread (il loop resta libero);
+  - cache TTL processo-wide short link -> URL canonico (SHORTLINK_TTL_HOURS),
+    condivisa da tutti i frontend: lo stesso vm.tiktok.com ripostato non rifà rete;
+  - lookup concorrenti dello stesso short code coalescenti (inflight.coalesce);
+  - latenza delle risoluzioni registrata (stats()).
+
+Le risoluzioni fallite (URL invariato) NON si mettono in cache.
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict
+
+import core
+import inflight
+
+logger = logging.getLogger(__name__)
+
+TTL = int(float(os.getenv('SHORTLINK_TTL_HOURS', '24')) * 3600)
+CACHE_MAX = 2000
+
+_lock = threading.Lock()
+_cache: 'OrderedDict[str, tuple]' = OrderedDict()   # short key -> (url canonico, scadenza)
+_stats = {'hits': 0, 'resolved': 0, 'failed': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'last_ms': 0.0}
+
+
+def is_short_link(url: str) -> bool:
+    return ('vm.tiktok.com' in url or 'vt.tiktok.com' in url
+            or 'facebook.com/share/' in url)
+
+
+def _cached(key: str):
+    with _lock:
+        hit = _cache.get(key)
+        if not hit:
+            return None
+        target, expires = hit
+        if expires < time.time():
+            _cache.pop(key, None)
+            return None
+        _cache.move_to_end(key)
+        _stats['hits'] += 1
+        return target
+
+
+def _store(key: str, target: str):
+    with _lock:
+        _cache[key] = (target, time.time() + TTL)
+        _cache.move_to_end(key)
+        while len(_cache) > CACHE_MAX:
+            _cache.popitem(last=False)
+
+
+async def resolve(url: str, fetch: Callable[[], Awaitable[str]]) -> str:
+    """URL canonico di uno short link. `fetch()` fa la risoluzione vera (già non
+    bloccante, es. asyncio.to_thread) e ritorna l'URL finale, o quello originale
+    se non è riuscita."""
+    key = core.link_key(url)
+    target = _cached(key)
+    if target:
+        return target
+
+    async def _timed():
+        t0 = time.monotonic()
+        final = await fetch()
+        ms = (time.monotonic() - t0) * 1000
+        ok = bool(final) and core.link_key(final) != key
+        with _lock:
+            _stats['resolved' if ok else 'failed'] += 1
+            _stats['total_ms'] += ms
+            _stats['last_ms'] = ms
+            _stats['max_ms'] = max(_stats['max_ms'], ms)
+        if ok:
+            _store(key, final)
+            logger.info(f"Short link risolto in {ms:.0f} ms: {url} -> {final}")
+        else:
+            logger.info(f"Short link NON risolto ({ms:.0f} ms): {url}")
+        return final or url
+
+    target, _joined = await inflight.coalesce('short:' + key, _timed, clone=lambda r: r)
+    return target
+
+
+def stats() -> Dict:
+    with _lock:
+        n = _stats['resolved'] + _stats['failed']
+        return dict(_stats, entries=len(_cache),
+                    avg_ms=(_stats['total_ms'] / n) if n else 0.0)
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""Limite di dimensione per download, deciso da chi chiede (il frontend).
+
+Solo yt-dlp aveva un tetto (max_filesize 50 MB): caroselli, Cobalt, i video di
+Facebook e le slide dell'API Instagram scaricavano il file intero, e il limite
+vero del frontend (Telegram 50 MB, WhatsApp 16 MB, Discord) si controllava solo
+a file già su disco. Qui:
+
+  - download_video(url, max_bytes=...) apre un "budget" (limited()) valido per
+    tutta la richiesta: contextvar, quindi arriva alle strategie di hedge.race,
+    ai thread di hedge.in_thread e ai fetch paralleli di smd_fetch;
+  - ogni scaricamento controlla prima il Content-Length della risposta (o la
+    dimensione annunciata da yt-dlp nell'info) e poi i byte scritti: oltre il
+    limite interrompe subito con TooBig (il file parziale si elimina);
+  - il budget ricorda lo scarto, così download_video risponde con un esito
+    distinto ({'success': False, 'too_big': True, ...}) invece del generico
+    "download fallito";
+  - stats(): scarti per tipo e byte non scaricati.
+"""
+
+import os
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_stats = {'rejected': 0, 'header': 0, 'stream': 0, 'info': 0, 'cached': 0, 'bytes_avoided': 0}
+
+
+class TooBig(Exception):
+    def __init__(self, size: int, limit: int, where: str):
+        super().__init__(f"{size} byte oltre il limite di {limit} ({where})")
+        self.size = size
+        self.limit = limit
+        self.where = where
+
+
+class Budget:
+    """Limite di una richiesta. limit=0: nessun controllo (chiamate senza
+    max_bytes, come prima)."""
+
+    def __init__(self, limit: int = 0):
+        self.limit = max(0, int(limit or 0))
+        self.rejected: Optional[TooBig] = None   # lo scarto più grande
+        self.rejections = 0
+
+    def __bool__(self) -> bool:
+        return self.limit > 0
+
+    def _reject(self, size: int, where: str, avoided: int = 0):
+        err = TooBig(size, self.limit, where)
+        with _lock:
+            self.rejections += 1
+            if self.rejected is None or size > self.rejected.size:
+                self.rejected = err
+            _stats['rejected'] += 1
+            _stats[where] += 1
+            _stats['bytes_avoided'] += max(0, avoided)
+        logger.info(f"Size guard: scartato, {err}")
+        raise err
+
+    def check_size(self, size: Optional[int], where: str = 'info') -> None:
+        """Dimensione annunciata (Content-Length, filesize di yt-dlp...)."""
+        if self.limit and size and size > self.limit:
+            self._reject(int(size), where, avoided=int(size))
+
+    def check_headers(self, headers) -> None:
+        """Content-Length di una risposta HTTP (se c'è e non è compresso)."""
+        if not self.limit or headers is None:
+            return
+        if headers.get('Content-Encoding') not in (None, '', 'identity'):
+            return   # la lunghezza è quella compressa: decide il conteggio in streaming
+        try:
+            size = int(headers.get('Content-Length') or 0)
+        except (TypeError, ValueError):
+            return
+        self.check_size(size, 'header')
+
+    def check_stream(self, written: int, declared: Optional[int] = None) -> None:
+        """Byte scritti finora: oltre il limite si interrompe lo scaricamento."""
+        if self.limit and written > self.limit:
+            self._reject(int(written), 'stream', avoided=int(declared or 0) - written)
+
+
+_budget: contextvars.ContextVar = contextvars.ContextVar('size_budget', default=None)
+
+
+def current() -> Budget:
+    """Budget della richiesta in corso (senza limite se non ce n'è una)."""
+    return _budget.get() or Budget(0)
+
+
+@contextmanager
+def limited(max_bytes: Optional[int]) -> Iterator[Budget]:
+    budget = Budget(max_bytes or 0)
+    token = _budget.set(budget)
+    try:
+        yield budget
+    finally:
+        _budget.reset(token)
+
+
+def info_size(info: Optional[Dict]) -> Optional[int]:
+    """Dimensione che yt-dlp annuncia per il formato scelto (somma dei formati
+    uniti, se video+audio separati). None se non la conosce. filesize_approx è
+    una stima dal bitrate: conta al 90%, per non scartare file che ci stanno."""
+    if not isinstance(info, dict):
+        return None
+    parts = info.get('requested_formats') or [info]
+    total = 0
+    for f in parts:
+        if f.get('filesize'):
+            total += int(f['filesize'])
+        elif f.get('filesize_approx'):
+            total += int(f['filesize_approx'] * 0.9)
+        else:
+            return None
+    return total or None
+
+
+def oversized(paths: Iterable[Optional[str]], limit: int) -> Optional[int]:
+    """Dimensione del primo file oltre `limit` (None se stanno tutti dentro)."""
+    if not limit:
+        return None
+    for p in paths:
+        try:
+            if p and os.path.getsize(p) > limit:
+                return os.path.getsize(p)
+        except OSError:
+            continue
+    return None
+
+
+def note_cached() -> None:
+    """Risultato in cache più grande del limite di chi lo chiede."""
+    with _lock:
+        _stats['rejected'] += 1
+        _stats['cached'] += 1
+
+
+def stats() -> Dict:
+    with _lock:
+        return dict(_stats)
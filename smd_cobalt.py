@@ -7,17 +7,16 @@ import re
 import json
 import html
 import time
-import asyncio
 import logging
 from datetime import datetime
 from typing import Dict, List, Optional, Tuple
 
-import requests
-
-try:
-    import cloudscraper
-except ImportError:
-    cloudscraper = None
+import cobalt_health
+import hedge
+import inflight
+import janitor
+import media_cache
+import size_guard
 
 logger = logging.getLogger(__name__)
 
@@ -30,20 +29,10 @@ class CobaltMixin:
         Ottimo per YouTube/Insta/TikTok su server bloccati.
         Supporta failover su più istanze pubbliche.
         """
-        # Lista di istanze pubbliche (V10 compatible)
-        # Nota: api.cobalt.tools richiede Turnstile/Key ora, quindi, usiamo mirror community
-        # Aggiornato al 2026/02
-        # Lista ridotta: molte istanze pubbliche muoiono in fretta (DNS inesistente).
-        # Sovrascrivibile via env COBALT_INSTANCES (separate da virgola).
-        cobalt_instances = [
-            "https://cobalt.stream",
-            "https://cobalt.tools",
-            "https://cobalt.q11.app",
-            "https://cobalt.154.be",
-        ]
-        env_instances = os.getenv("COBALT_INSTANCES")
-        if env_instances:
-            cobalt_instances = [u.strip() for u in env_instances.split(",") if u.strip()]
+        # Istanze pubbliche (V10 compatible): ordine e salti decisi dallo stato
+        # di salute (cobalt_health: circuit breaker + latenza EWMA)
+        cobalt_instances = cobalt_health.order(cobalt_health.instances())
+        cobalt_health.start_probing(self._probe_cobalt)
 
         headers = {
             "Accept": "application/json",
@@ -62,7 +51,7 @@ class CobaltMixin:
         
         logger.info(f"Cobalt fallback triggered for: {url}")
         
-        loop = asyncio.get_event_loop()
+        budget = size_guard.current()
 
         for base_url in cobalt_instances:
             api_url = f"{base_url}/" # V10 usa root endpoint
@@ -71,19 +60,39 @@ class CobaltMixin:
             try:
                 def _req():
                     # Usa cloudscraper se disponibile per bypassare Cloudflare
-                    # Abbassato timeout a 15s per saltare velocemente se lento
+                    # Abbassato timeout a 15s per saltare velocemente se lento.
+                    # L'esito si registra qui nel thread: conta anche se la
+                    # strategia viene cancellata (gara persa) a metà richiesta.
+                    t0 = time.monotonic()
                     try:
-                        if cloudscraper:
-                            scraper = cloudscraper.create_scraper()
-                            return scraper.post(api_url, json=payload, headers=headers, timeout=15)
+                        # Sessione cloudscraper unica per il downloader (niente
+                        # scraper + handshake nuovi per ogni istanza provata)
+                        scraper = self.http.scraper()
+                        if scraper is not None:
+                            resp = scraper.post(api_url, json=payload, headers=headers, timeout=15,
+                                                proxies=self.http.proxies)
                         else:
-                            return requests.post(api_url, json=payload, headers=headers, timeout=15)
+                            resp = self.http.post(api_url, json=payload, headers=headers, timeout=15)
                     except Exception as e:
                         logger.warning(f"Cobalt request failed for {base_url}: {e}")
+                        cobalt_health.record(base_url, False, error=str(e))
                         return None
-                    
-                r = await loop.run_in_executor(None, _req)
-                
+                    latency = time.monotonic() - t0
+                    if resp.status_code != 200:
+                        cobalt_health.record(base_url, False, latency, f"HTTP {resp.status_code}")
+                        return resp
+                    try:
+                        body = resp.json()
+                    except ValueError:
+                        cobalt_health.record(base_url, False, latency, "risposta non JSON")
+                        return resp
+                    if cobalt_health.is_instance_error(body):
+                        cobalt_health.record(base_url, False, latency, json.dumps(body.get('error'))[:120])
+                    else:
+                        cobalt_health.record(base_url, True, latency)
+                    return resp
+
+                r = await hedge.in_thread(_req)
                 if r and r.status_code == 200:
                     data = r.json()
                     
@@ -112,51 +121,67 @@ class CobaltMixin:
                     if download_url:
                         logger.info(f"Cobalt download URL found via {base_url}: {download_url}")
                         
-                        # Scarica il file
+                        # Scarica il file (anche la scrittura nel thread: niente I/O
+                        # sul loop; se la strategia perde la gara il file si elimina)
                         def _dl_file():
-                            return requests.get(download_url, stream=True, timeout=60)
-                        
-                        resp = await loop.run_in_executor(None, _dl_file)
-                        
-                        if resp.status_code == 200:
-                            # Salva su file temp
-                            ext = "mp4" # Default
-                            # Tentativo di indovinare estensione da Content-Type
-                            ctype = resp.headers.get("Content-Type", "")
-                            if "image" in ctype:
-                                ext = "jpg"
-                            elif "audio" in ctype:
-                                ext = "mp3"
-                                
-                            filename = os.path.join(self.temp_dir, f"cobalt_{int(time.time())}.{ext}")
-                            
-                            with open(filename, 'wb') as f:
-                                for chunk in resp.iter_content(chunk_size=1024 * 1024):
-                                    if chunk:
-                                        f.write(chunk)
-                                        
-                            if os.path.getsize(filename) > 0:
-                                # mp4 -> video singolo; immagini/audio -> 'carousel'
-                                # (il bot gestisce solo 'video' e 'carousel', non 'image':
-                                # restituire 'image' faceva sparire il media senza inviarlo).
-                                if ext == "mp4":
-                                    return {
-                                        "success": True,
-                                        "type": "video",
-                                        "file_path": filename,
-                                        "title": f"Downloaded via Cobalt ({base_url})",
-                                        "platform": self.detect_platform(url),
-                                        "url": url,
-                                    }
-                                else:
-                                    return {
-                                        "success": True,
-                                        "type": "carousel",
-                                        "files": [filename],
-                                        "title": f"Downloaded via Cobalt ({base_url})",
-                                        "platform": self.detect_platform(url),
-                                        "url": url,
-                                    }
+                            with self.http.get(download_url, stream=True, timeout=60) as resp:
+                                if resp.status_code != 200:
+                                    return None
+                                ext = "mp4" # Default
+                                # Tentativo di indovinare estensione da Content-Type
+                                ctype = resp.headers.get("Content-Type", "")
+                                if "image" in ctype:
+                                    ext = "jpg"
+                                elif "audio" in ctype:
+                                    ext = "mp3"
+
+                                # I tunnel spesso non hanno Content-Length: conta il flusso
+                                budget.check_headers(resp.headers)
+                                declared = resp.headers.get("Content-Length")
+                                filename = os.path.join(self.temp_dir, f"cobalt_{int(time.time())}.{ext}")
+                                h = media_cache.new_hasher()
+                                written = 0
+                                janitor.track(filename)
+                                try:
+                                    with open(filename, 'wb') as f:
+                                        for chunk in resp.iter_content(chunk_size=1024 * 1024):
+                                            if chunk:
+                                                f.write(chunk)
+                                                h.update(chunk)
+                                                written += len(chunk)
+                                                budget.check_stream(written, declared)
+                                except size_guard.TooBig:
+                                    janitor.discard(filename)
+                                    raise
+                                media_cache.remember_digest(filename, h.hexdigest())
+                                return filename, ext
+
+                        saved = await hedge.in_thread(
+                            _dl_file, cleanup=lambda r: r and inflight.drop_result_files({'file_path': r[0]}))
+
+                        if saved and os.path.getsize(saved[0]) > 0:
+                            filename, ext = saved
+                            # mp4 -> video singolo; immagini/audio -> 'carousel'
+                            # (il bot gestisce solo 'video' e 'carousel', non 'image':
+                            # restituire 'image' faceva sparire il media senza inviarlo).
+                            if ext == "mp4":
+                                return {
+                                    "success": True,
+                                    "type": "video",
+                                    "file_path": filename,
+                                    "title": f"Downloaded via Cobalt ({base_url})",
+                                    "platform": self.detect_platform(url),
+                                    "url": url,
+                                }
+                            else:
+                                return {
+                                    "success": True,
+                                    "type": "carousel",
+                                    "files": [filename],
+                                    "title": f"Downloaded via Cobalt ({base_url})",
+                                    "platform": self.detect_platform(url),
+                                    "url": url,
+                                }
                 
                 # Se status code != 200 o data parsing fallito, logga e continua
                 if r:
@@ -164,6 +189,9 @@ class CobaltMixin:
                 else:
                      logger.warning(f"Cobalt instance {base_url} failed (connection error)")
 
+            except size_guard.TooBig:
+                # Stesso file su tutte le istanze: inutile riprovarlo altrove
+                return None
             except Exception as e:
                 logger.warning(f"Cobalt instance {base_url} error: {e}")
                 continue # Prova la prossima istanza
@@ -171,3 +199,14 @@ class CobaltMixin:
         logger.error("All Cobalt instances failed.")
         return None
 
+    def _probe_cobalt(self, base_url: str) -> bool:
+        """Probe per cobalt_health: la root di un'istanza v10 risponde con le sue
+        info ({"cobalt": {...}}). Bloccante (gira nel thread di probing)."""
+        r = self.http.get(f"{base_url}/", headers={"Accept": "application/json"}, timeout=10)
+        if r.status_code != 200:
+            return False
+        try:
+            return 'cobalt' in (r.json() or {})
+        except ValueError:
+            return False
+
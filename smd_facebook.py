@@ -12,7 +12,12 @@ import logging
 from datetime import datetime
 from typing import Dict, List, Optional, Tuple
 
-import requests
+import hedge
+import inflight
+import janitor
+import media_cache
+import segmented
+import size_guard
 
 logger = logging.getLogger(__name__)
 
@@ -36,9 +41,10 @@ class FacebookMixin:
             cookies = self._load_netscape_cookies(self.facebook_cookies) if hasattr(self, 'facebook_cookies') else None
 
             loop = asyncio.get_event_loop()
+            budget = size_guard.current()
             
             def _fetch():
-                return requests.get(url, headers=headers, cookies=cookies, timeout=15)
+                return self.http.get(url, headers=headers, cookies=cookies, timeout=15)
             
             resp = await loop.run_in_executor(None, _fetch)
             if resp.status_code != 200:
@@ -90,20 +96,17 @@ class FacebookMixin:
                     tmp_mp4 = os.path.join(self.temp_dir, f"fb_{ts}_fallback.mp4")
                     
                     def _dl_mp4():
+                        # mp4 progressivo: a segmenti se la CDN accetta Range
                         try:
-                            r = requests.get(mp4_url, headers=headers, stream=True, timeout=60)
-                            if r.status_code == 200:
-                                with open(tmp_mp4, 'wb') as f:
-                                    for chunk in r.iter_content(chunk_size=1024*1024):
-                                        if chunk:
-                                            f.write(chunk)
-                                return True
+                            return segmented.fetch(self.http, mp4_url, tmp_mp4, headers, timeout=60)
                         except Exception:
+                            # anche lo scarto per dimensione (size_guard): niente parziali
+                            janitor.discard(tmp_mp4)
                             return False
-                        return False
                     
                     try:
-                        mp4_success = await loop.run_in_executor(None, _dl_mp4)
+                        mp4_success = await hedge.in_thread(
+                            _dl_mp4, cleanup=lambda ok: inflight.drop_result_files({'file_path': tmp_mp4}))
                         if mp4_success and os.path.exists(tmp_mp4) and os.path.getsize(tmp_mp4) > 1000:
                              # Estrai la descrizione del video per la didascalia
                              try:
@@ -206,14 +209,29 @@ class FacebookMixin:
             tmp_name = os.path.join(self.temp_dir, f"fb_{ts}_fallback.jpg")
             
             def _dl_img():
-                r = requests.get(img_url, headers=headers, timeout=15)
-                if r.status_code == 200:
-                    with open(tmp_name, 'wb') as f:
-                        f.write(r.content)
+                with self.http.get(img_url, headers=headers, timeout=15, stream=True) as r:
+                    if r.status_code != 200:
+                        return False
+                    declared = r.headers.get('Content-Length')
+                    h = media_cache.new_hasher()
+                    written = 0
+                    try:
+                        budget.check_headers(r.headers)
+                        with open(janitor.track(tmp_name), 'wb') as f:
+                            for chunk in r.iter_content(chunk_size=1024 * 256):
+                                if chunk:
+                                    f.write(chunk)
+                                    h.update(chunk)
+                                    written += len(chunk)
+                                    budget.check_stream(written, declared)
+                    except size_guard.TooBig:
+                        janitor.discard(tmp_name)
+                        return False
+                    media_cache.remember_digest(tmp_name, h.hexdigest())
                     return True
-                return False
                 
-            success = await loop.run_in_executor(None, _dl_img)
+            success = await hedge.in_thread(
+                _dl_img, cleanup=lambda ok: inflight.drop_result_files({'file_path': tmp_name}))
             if success:
                 # Try to get title too
                 t_m = re.search(r'<title>(.*?)</title>', text)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""Mixin per scaricare in parallelo le slide di caroselli e post foto.
+
+Prima ogni slide era un requests.get in serie (10 slide = 10 round trip uno dopo
+l'altro, per di più bloccando l'event loop nel caso del carosello yt-dlp). Qui un
+pool di thread condiviso dal processo scarica tutte le slide insieme, con un
+limite di connessioni contemporanee PER HOST (le CDN di Instagram/TikTok non
+amano raffiche da uno stesso IP) e restituendo i file nell'ordine delle slide.
+
+I video (job con 'segmented') passano da segmented.fetch: se il file è grande
+e la CDN accetta Range arriva con più connessioni in parallelo.
+
+Ogni job può avere un passo `after(path)` eseguito appena QUELLA slide è finita
+(es. merge dell'audio DASH), senza aspettare le altre.
+
+Ogni file rispetta il limite di dimensione della richiesta (size_guard): una
+slide oltre il limite si interrompe appena lo si sa, e con lei si scarta tutto
+il post (il frontend non lo manderebbe comunque a metà)."""
+
+import os
+import asyncio
+import logging
+import threading
+import contextvars
+import concurrent.futures
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+import janitor
+import size_guard
+import segmented as segmented_dl
+
+logger = logging.getLogger(__name__)
+
+FETCH_MAX_WORKERS = max(1, int(os.getenv('FETCH_MAX_WORKERS', '8')))
+FETCH_PER_HOST = max(1, int(os.getenv('FETCH_PER_HOST', '4')))
+
+_pool = concurrent.futures.ThreadPoolExecutor(max_workers=FETCH_MAX_WORKERS,
+                                              thread_name_prefix='smd-fetch')
+_host_lock = threading.Lock()
+_host_slots: Dict[str, threading.BoundedSemaphore] = {}
+
+
+def _host_slot(url: str) -> threading.BoundedSemaphore:
+    host = (urlparse(url).hostname or '').lower()
+    with _host_lock:
+        sem = _host_slots.get(host)
+        if sem is None:
+            sem = _host_slots[host] = threading.BoundedSemaphore(FETCH_PER_HOST)
+        return sem
+
+
+def _remove_quietly(path: str):
+    janitor.discard(path)
+
+
+class FetchMixin:
+    def _fetch_to_file(self, url: str, path: str, headers: Optional[Dict] = None,
+                       timeout: int = 20, cookies=None, segmented: bool = False) -> Optional[str]:
+        """Scarica `url` in `path` (a blocchi, bloccante) rispettando il limite per
+        host. `segmented`: i file grandi arrivano con più richieste Range in
+        parallelo (vedi segmented.py). Ritorna il path se il file è non vuoto,
+        altrimenti None (e pulisce)."""
+        try:
+            with _host_slot(url):
+                ok = segmented_dl.fetch(self.http, url, path, headers, timeout, cookies,
+                                        parts=None if segmented else 1)
+            if ok and os.path.getsize(path) > 0:
+                return path
+        except Exception as e:
+            logger.warning(f"Fetch fallito {url[:100]}: {str(e)[:120]}")
+        _remove_quietly(path)
+        return None
+
+    def _run_fetch_job(self, job: Dict) -> Optional[str]:
+        path = self._fetch_to_file(job['url'], job['path'], job.get('headers'),
+                                   job.get('timeout', 20), job.get('cookies'),
+                                   job.get('segmented', False))
+        after = job.get('after')
+        if path and after:
+            try:
+                path = after(path) or path
+            except Exception as e:
+                logger.warning(f"Fetch: post-elaborazione fallita per {os.path.basename(path)}: {e}")
+        return path
+
+    def _submit(self, job: Dict) -> concurrent.futures.Future:
+        # Il job gira col contesto di chi lo chiede (limite di dimensione compreso)
+        return _pool.submit(contextvars.copy_context().run, self._run_fetch_job, job)
+
+    @staticmethod
+    def _drop_if_rejected(files: List[str], budget: 'size_guard.Budget', before: int) -> List[str]:
+        """Una slide scartata per dimensione durante QUESTO fetch: via tutto il post."""
+        if budget.rejections > before:
+            for p in files:
+                _remove_quietly(p)
+            return []
+        return files
+
+    def _fetch_many_sync(self, jobs: List[Dict]) -> List[str]:
+        """Versione bloccante di _fetch_many (per i fallback che girano già in un
+        executor). Da NON chiamare dai thread del pool di fetch."""
+        budget = size_guard.current()
+        before = budget.rejections
+        futures = [self._submit(j) for j in jobs]
+        return self._drop_if_rejected([p for p in (f.result() for f in futures) if p], budget, before)
+
+    async def _fetch_many(self, jobs: List[Dict]) -> List[str]:
+        """Scarica tutti i job in parallelo e ritorna i file riusciti NELL'ORDINE
+        dei job. Job: {'url', 'path', 'headers', 'timeout', 'cookies', 'segmented', 'after'}."""
+        if not jobs:
+            return []
+        budget = size_guard.current()
+        before = budget.rejections
+        futures = [self._submit(j) for j in jobs]
+        try:
+            results = await asyncio.gather(*(asyncio.wrap_future(f) for f in futures))
+        except asyncio.CancelledError:
+            # Chi ha chiesto le slide non le vuole più: niente file orfani in temp_dir
+            for f in futures:
+                if not f.cancel():
+                    f.add_done_callback(lambda fut: _remove_quietly(fut.result()) if not fut.exception() else None)
+            raise
+        return self._drop_if_rejected([p for p in results if p], budget, before)
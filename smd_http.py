@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""Sessioni HTTP condivise dai mixin del downloader (keep-alive + retry).
+
+Prima ogni fallback usava requests.get/post/head "nudi" (e Cobalt creava un
+cloudscraper nuovo per OGNI istanza provata): ogni chiamata pagava un handshake
+TCP+TLS nuovo verso le stesse CDN. Qui ogni SocialMediaDownloader ha il suo
+registro `self.http` con:
+
+  - una requests.Session con HTTPAdapter: pool di connessioni keep-alive per host
+    (HTTP_POOL_HOSTS host tenuti, HTTP_POOL_PER_HOST connessioni per host) e
+    retry sui soli errori di connessione / 502-503-504 delle GET/HEAD;
+  - una sessione cloudscraper (se installato) creata una volta sola;
+  - il proxy del downloader applicato a TUTTE le richieste.
+
+La sessione NON accumula cookie: i cookie delle piattaforme si passano per
+richiesta (cookies=...) come prima, così i Set-Cookie di TikTok non finiscono
+nelle richieste a Instagram e viceversa.
+"""
+
+import os
+import logging
+import threading
+import http.cookiejar
+from typing import Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+HTTP_POOL_HOSTS = max(1, int(os.getenv('HTTP_POOL_HOSTS', '16')))
+HTTP_POOL_PER_HOST = max(1, int(os.getenv('HTTP_POOL_PER_HOST', '8')))
+HTTP_RETRIES = max(0, int(os.getenv('HTTP_RETRIES', '2')))
+
+
+def _make_adapter() -> HTTPAdapter:
+    retry = Retry(
+        total=HTTP_RETRIES,
+        connect=HTTP_RETRIES,
+        read=0,                       # un body a metà non si riprova in automatico
+        status=HTTP_RETRIES,
+        backoff_factor=0.3,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset({'GET', 'HEAD'}),
+        raise_on_status=False,        # dopo i retry torna la risposta, come prima
+    )
+    return HTTPAdapter(pool_connections=HTTP_POOL_HOSTS, pool_maxsize=HTTP_POOL_PER_HOST,
+                       max_retries=retry)
+
+
+def _no_cookie_jar() -> http.cookiejar.CookieJar:
+    """Jar che rifiuta tutto: i cookie passati per richiesta funzionano, quelli
+    ricevuti non restano nella sessione."""
+    return requests.cookies.RequestsCookieJar(
+        policy=http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+
+
+class HttpSessions:
+    def __init__(self, proxies: Optional[Dict[str, str]] = None):
+        self.proxies = proxies
+        self._lock = threading.Lock()
+        self._session = self._new_session()
+        self._scraper = None
+        self._scraper_failed = False
+
+    def _new_session(self) -> requests.Session:
+        s = requests.Session()
+        adapter = _make_adapter()
+        s.mount('https://', adapter)
+        s.mount('http://', adapter)
+        s.cookies = _no_cookie_jar()
+        return s
+
+    @property
+    def session(self) -> requests.Session:
+        return self._session
+
+    def scraper(self):
+        """Sessione cloudscraper condivisa (None se il modulo non c'è): il
+        challenge Cloudflare risolto e le connessioni restano per le chiamate dopo."""
+        if self._scraper is not None or self._scraper_failed:
+            return self._scraper
+        with self._lock:
+            if self._scraper is None and not self._scraper_failed:
+                try:
+                    import cloudscraper
+                    self._scraper = cloudscraper.create_scraper()
+                except Exception as e:
+                    logger.info(f"HTTP: cloudscraper non disponibile ({e}), uso requests")
+                    self._scraper_failed = True
+        return self._scraper
+
+    # Stesse firme di requests.get/post/head, col proxy del downloader di default
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault('proxies', self.proxies)
+        return self._session.request(method, url, **kwargs)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault('allow_redirects', True)
+        return self.request('GET', url, **kwargs)
+
+    def head(self, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault('allow_redirects', False)
+        return self.request('HEAD', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def stats(self) -> Dict:
+        """Pool per host: connessioni aperte in totale, richieste servite e
+        connessioni libere (keep-alive) in questo momento."""
+        pools = {}
+        sessions = [('requests', self._session)]
+        if self._scraper is not None:
+            sessions.append(('cloudscraper', self._scraper))
+        for name, s in sessions:
+            seen = set()
+            for adapter in s.adapters.values():
+                if id(adapter) in seen:
+                    continue
+                seen.add(id(adapter))
+                pm = getattr(adapter, 'poolmanager', None)
+                if pm is None:
+                    continue
+                for key in list(pm.pools.keys()):
+                    pool = pm.pools.get(key)
+                    if pool is None:
+                        continue
+                    # la coda del pool è pre-riempita di None: contano solo le connessioni vere
+                    q = getattr(pool, 'pool', None)
+                    idle = sum(1 for c in list(q.queue) if c is not None) if q is not None else 0
+                    pools[f"{name}:{pool.host}"] = {
+                        'connections': pool.num_connections,
+                        'requests': pool.num_requests,
+                        'idle': idle,
+                    }
+        return {
+            'hosts': len(pools),
+            'connections': sum(p['connections'] for p in pools.values()),
+            'requests': sum(p['requests'] for p in pools.values()),
+            'pools': pools,
+        }
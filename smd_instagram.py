@@ -12,10 +12,15 @@ import logging
 from datetime import datetime
 from typing import Dict, List, Optional, Tuple
 
-import requests
+import hedge
+import html_islands
+import inflight
 
 logger = logging.getLogger(__name__)
 
+# Un'isola JSON della pagina serve solo se contiene le immagini dei media
+_IG_IMAGE_KEYS = ('image_versions2',)
+
 
 class InstagramMixin:
     def _from_base62(self, s: str) -> int:
@@ -46,7 +51,7 @@ class InstagramMixin:
 
             api_url = f"https://www.instagram.com/api/v1/media/{media_id}/info/"
 
-            cookies = self._load_netscape_cookies(self.instagram_cookies)
+            cookies = self.cookies.view(self.instagram_cookies)
             if not cookies:
                  logger.warning("Instagram API: cookies missing, cannot use API fallback")
                  return []
@@ -68,7 +73,7 @@ class InstagramMixin:
             if not cookies.get('sessionid'):
                 logger.warning("Instagram API: manca 'sessionid' nei cookie -> sessione non loggata (cookie probabilmente scaduti)")
 
-            r = requests.get(api_url, headers=headers, cookies=cookies, timeout=15, proxies=self.proxy_dict)
+            r = self.http.get(api_url, headers=headers, cookies=cookies.jar(), timeout=15)
             if r.status_code != 200:
                 if r.status_code in (401, 403, 429):
                     logger.warning(f"Instagram API: status {r.status_code} -> cookie Instagram probabilmente SCADUTI/invalidi. Rigenera INSTAGRAM_COOKIES.")
@@ -124,7 +129,8 @@ class InstagramMixin:
                     if imgs:
                         candidates_urls.append((imgs[0]['url'], 'jpg', False))
 
-            # Download items
+            # Download items (in parallelo, ordine delle slide preservato)
+            jobs = []
             for idx, (media_url, ext, is_video) in enumerate(candidates_urls, start=1):
                 # Adjust ext if query param hints otherwise (like .heic?stp=dst-jpg)
                 if '.heic' in media_url and 'dst-jpg' in media_url:
@@ -132,30 +138,21 @@ class InstagramMixin:
 
                 filename = os.path.join(self.temp_dir, f"insta_api_{shortcode}_{idx}.{ext}")
                 logger.info(f"Instagram API: downloading item {idx} to {filename}")
-                
-                try:
-                    rr = requests.get(media_url, headers=headers, stream=True, timeout=30, proxies=self.proxy_dict)
-                    rr.raise_for_status()
-                    with open(filename, 'wb') as f:
-                        for chunk in rr.iter_content(chunk_size=1024 * 256):
-                             if chunk:
-                                 f.write(chunk)
-                    
-                    if os.path.exists(filename) and os.path.getsize(filename) > 0:
-                        files.append(filename)
-                except Exception as e:
-                    logger.warning(f"Instagram API: download failed for {media_url}: {e}")
+                jobs.append({'url': media_url, 'path': filename, 'headers': headers, 'timeout': 30,
+                             'segmented': is_video})
 
-            return files
+            return self._fetch_many_sync(jobs)
 
         except Exception as e:
             logger.warning(f"Instagram API fallback exception: {e}")
             return files
 
     async def _instagram_api_fallback(self, url: str) -> List[str]:
-        """Wrapper asincrono per _instagram_api_fallback_sync"""
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(None, self._instagram_api_fallback_sync, url)
+        """Wrapper asincrono per _instagram_api_fallback_sync. Se viene cancellato
+        (strategia perdente in hedge.race) i file che il thread scarica lo stesso
+        vengono eliminati."""
+        return await hedge.in_thread(self._instagram_api_fallback_sync, url,
+                                     cleanup=lambda files: inflight.drop_result_files({'files': files}))
 
     async def _instagram_photo_fallback(self, url: str) -> List[str]:
         """
@@ -174,12 +171,11 @@ class InstagramMixin:
 
         try:
             logger.info(f"Instagram Fallback: fetching {url}")
-            r = requests.get(
+            r = self.http.get(
                 url,
                 headers=headers,
                 timeout=15,
-                cookies=cookies,
-                proxies=self.proxy_dict
+                cookies=cookies
             )
             logger.info(f"Instagram Fallback: status {r.status_code}, len {len(r.text)}")
             r.raise_for_status()
@@ -239,54 +235,19 @@ class InstagramMixin:
         MAX = 30
         uniq = uniq[:MAX]
 
+        jobs = []
         for idx, img_url in enumerate(uniq, start=1):
             ext = os.path.splitext(img_url.split('?')[0])[1].lstrip('.').lower() or 'jpg'
             if ext not in ('jpg', 'jpeg', 'png', 'webp'):
                 ext = 'jpg'
+            jobs.append({'url': img_url, 'headers': headers, 'timeout': 20, 'cookies': cookies,
+                         'path': os.path.join(self.temp_dir, f"instagram_photo_{idx}.{ext}")})
 
-            filename = os.path.join(self.temp_dir, f"instagram_photo_{idx}.{ext}")
-            try:
-                rr = requests.get(
-                    img_url,
-                    headers=headers,
-                    stream=True,
-                    timeout=20,
-                    cookies=cookies,
-                    proxies=self.proxy_dict
-                )
-                rr.raise_for_status()
-                with open(filename, 'wb') as fh:
-                    for chunk in rr.iter_content(1024 * 256):
-                        if chunk:
-                            fh.write(chunk)
-                if os.path.exists(filename) and os.path.getsize(filename) > 0:
-                    files.append(filename)
-                else:
-                    try:
-                        if os.path.exists(filename):
-                            os.remove(filename)
-                    except Exception:
-                        pass
-            except Exception as e:
-                logger.warning(f"Failed download Instagram fallback image {img_url}: {e}")
-                try:
-                    if os.path.exists(filename):
-                        os.remove(filename)
-                except Exception:
-                    pass
-
-        return files
+        return await self._fetch_many(jobs)
 
     def _extract_instagram_image_urls_from_html(self, html: str) -> List[str]:
         import re
 
-        def _dedupe(items: List[str]) -> List[str]:
-            out = []
-            for x in items:
-                if x not in out:
-                    out.append(x)
-            return out
-
         urls: List[str] = []
         seen_ids = set()
 
@@ -321,24 +282,21 @@ class InstagramMixin:
 
         # 1) Struttura MODERNA: JSON embedded (image_versions2/carousel_media), come l'API
         #    ma senza chiamarla (evita il 429). Gli URL qui dentro sono spesso escapati.
-        for blob in re.findall(r'<script[^>]+type="application/json"[^>]*>(.*?)</script>', html, re.DOTALL):
+        # 2) Legacy: window._sharedData / __additionalDataLoaded (vecchi post)
+        # Una sola passata sugli script; si parsano solo le isole con image_versions2
+        # (le decine di script JSON di relay/config della pagina si saltano).
+        legacy = set()
+        for name, data in html_islands.islands(html, keys=_IG_IMAGE_KEYS,
+                                               names=('json', 'sharedData', 'additionalData')):
+            if name != 'json':
+                if name in legacy:
+                    continue        # come prima: solo la prima di ogni tipo
+                legacy.add(name)
             try:
-                _walk(json.loads(blob))
+                _walk(data)
             except Exception:
                 continue
 
-        # 2) Legacy: window._sharedData / __additionalDataLoaded (vecchi post)
-        for pat in (
-            r'window\._sharedData\s*=\s*(\{.*?\})\s*;\s*</script>',
-            r'__additionalDataLoaded\([^,]+,\s*(\{.*?\})\s*\);',
-        ):
-            m = re.search(pat, html, re.DOTALL)
-            if m:
-                try:
-                    _walk(json.loads(m.group(1)))
-                except Exception:
-                    pass
-
         # 3) Ultima risorsa: de-escapa l'HTML (\/ -> /, & -> &) e cerca URL immagine.
         #    Senza il de-escape gli URL del contenuto (escapati nel JSON) NON venivano trovati:
         #    era il motivo per cui restavano solo gli asset statici della pagina.
@@ -355,5 +313,5 @@ class InstagramMixin:
             pattern = re.compile(r'https?://[^"\'>\s\\]+\.(?:jpg|jpeg|png|webp)(?:\?[^"\'>\s\\]*)?', re.IGNORECASE)
             urls.extend(u for u in pattern.findall(unescaped) if 'cdninstagram' in u or 'fbcdn' in u)
 
-        return _dedupe(urls)
+        return html_islands.unique(urls)
 
@@ -12,10 +12,14 @@ import logging
 from datetime import datetime
 from typing import Dict, List, Optional, Tuple
 
-import requests
+import html_islands
 
 logger = logging.getLogger(__name__)
 
+# Chiavi che un'isola JSON deve contenere per valere il parse (imagePost.images,
+# imageURL / displayImage della ricerca larga)
+_TIKTOK_IMAGE_KEYS = ('imagePost', 'imageURL', 'displayImage')
+
 
 class TikTokMixin:
     async def _tiktok_photo_fallback(self, url: str) -> List[str]:
@@ -42,12 +46,11 @@ class TikTokMixin:
 
         try:
             logger.info(f"TikTok Fallback: fetching {url}")
-            r = requests.get(
+            r = self.http.get(
                 url,
                 headers=headers,
                 timeout=15,
-                cookies=cookies,
-                proxies=self.proxy_dict
+                cookies=cookies
             )
             logger.info(f"TikTok Fallback: status {r.status_code}, len {len(r.text)}")
             r.raise_for_status()
@@ -103,7 +106,7 @@ class TikTokMixin:
              logger.info("TikTok Fallback: interrogo TIKWM API (immagini/titolo)...")
              try:
                  api_url = "https://www.tikwm.com/api/"
-                 r = requests.post(api_url, data={'url': url, 'count': 35, 'cursor': 0, 'web': 1, 'hd': 1}, timeout=15, proxies=self.proxy_dict)
+                 r = self.http.post(api_url, data={'url': url, 'count': 35, 'cursor': 0, 'web': 1, 'hd': 1}, timeout=15)
                  if r.status_code == 200:
                      data = r.json()
                      if data.get('code') == 0:
@@ -131,86 +134,37 @@ class TikTokMixin:
         MAX = 35
         uniq = uniq[:MAX]
 
+        jobs = []
         for idx, img_url in enumerate(uniq, start=1):
             ext = os.path.splitext(img_url.split('?')[0])[1].lstrip('.').lower() or 'jpg'
             if ext not in ('jpg', 'jpeg', 'png', 'webp'):
                 ext = 'jpg'
+            jobs.append({'url': img_url, 'headers': headers, 'timeout': 20, 'cookies': cookies,
+                         'path': os.path.join(self.temp_dir, f"tiktok_photo_{idx}.{ext}")})
 
-            filename = os.path.join(self.temp_dir, f"tiktok_photo_{idx}.{ext}")
-            try:
-                rr = requests.get(
-                    img_url,
-                    headers=headers,
-                    stream=True,
-                    timeout=20,
-                    cookies=cookies,
-                    proxies=self.proxy_dict
-                )
-                rr.raise_for_status()
-                with open(filename, 'wb') as fh:
-                    for chunk in rr.iter_content(1024 * 256):
-                        if chunk:
-                            fh.write(chunk)
-                if os.path.exists(filename) and os.path.getsize(filename) > 0:
-                    files.append(filename)
-                else:
-                    try:
-                        if os.path.exists(filename):
-                            os.remove(filename)
-                    except Exception:
-                        pass
-            except Exception as e:
-                logger.warning(f"Failed download fallback image {img_url}: {e}")
-                try:
-                    if os.path.exists(filename):
-                        os.remove(filename)
-                except Exception:
-                    pass
-
-        return files
+        return await self._fetch_many(jobs)
 
     def _extract_tiktok_photo_urls_from_html(self, html: str) -> List[str]:
         import re
 
-        def _dedupe(items: List[str]) -> List[str]:
-            out = []
-            for x in items:
-                if x not in out:
-                    out.append(x)
-            return out
-
         urls: List[str] = []
 
-        # 1) Prova SIGI_STATE o UNIVERSAL_DATA
-        # Pattern vecchio: window.SIGI_STATE = {...}
-        sigi_match = re.search(r'window\.__SIGI_STATE__\s*=\s*(\{.*?\})\s*;\s*</script>', html, re.DOTALL)
-        if not sigi_match:
-            # Pattern alternativo: "SIGI_STATE": {...}
-            sigi_match = re.search(r'\"SIGI_STATE\"\s*:\s*(\{.*?\})\s*,\s*\"AppContext', html, re.DOTALL)
-        if not sigi_match:
-             # Pattern script tag: <script id="SIGI_STATE">...</script>
-             sigi_match = re.search(r'<script[^>]+id="SIGI_STATE"[^>]*>(.*?)</script>', html, re.DOTALL)
-
-        # Newer TikTok structure: UNIVERSAL_DATA_FOR_REHYDRATION
-        # Pattern variabile:
-        univ_match = re.search(r'__UNIVERSAL_DATA_FOR_REHYDRATION__\s*=\s*(\{.*?\})\s*;</script>', html, re.DOTALL)
-        if not univ_match:
-            # Pattern script tag ID (più comune ora):
-            # Relaxed regex to handle spacing and ordering of attributes
-            univ_match = re.search(r'<script[^>]+id=[\'"]__UNIVERSAL_DATA_FOR_REHYDRATION__[\'"][^>]*>(.*?)</script>', html, re.DOTALL)
+        # 1) SIGI_STATE (vecchio) e UNIVERSAL_DATA_FOR_REHYDRATION (attuale), come
+        #    tag <script id=...> o come assegnazione nel corpo di uno script: una
+        #    sola passata sulla pagina, e si parsa solo l'isola che parla di immagini
+        #    (in debug tutte, per il dump)
+        found = {}
+        for name, data in html_islands.islands(html, keys=() if self.debug else _TIKTOK_IMAGE_KEYS,
+                                               names=('SIGI_STATE', 'UNIVERSAL_DATA')):
+            found.setdefault(name, data)
+            if len(found) == 2:
+                break
+        json_data_list = [found[n] for n in ('SIGI_STATE', 'UNIVERSAL_DATA') if n in found]
 
-        json_data_list = []
-        if sigi_match:
-            json_data_list.append(sigi_match.group(1))
-        if univ_match:
-            json_data_list.append(univ_match.group(1))
-            
         logger.info(f"TikTok Fallback: extracted {len(json_data_list)} JSON blobs")
 
-        for idx_json, json_str in enumerate(json_data_list):
+        for idx_json, data in enumerate(json_data_list):
             try:
-                data = json.loads(json_str)
-
                 # DEBUG: Dump JSON to file (solo in debug, dentro la debug_dir)
                 if self.debug:
                     try:
@@ -262,7 +216,7 @@ class TikTokMixin:
                     recursive_find_images(data)
                 logger.info(f"TikTok Fallback: JSON blob {idx_json} processed, total urls: {len(urls)}")
             except Exception as e:
-                logger.warning(f"TikTok Fallback: JSON blob {idx_json} parse error: {e}")
+                logger.warning(f"TikTok Fallback: JSON blob {idx_json} error: {e}")
                 pass
 
         # 2) Regex generico immagini
@@ -290,5 +244,5 @@ class TikTokMixin:
                 mm = mp.findall(html)
                 urls.extend(mm)
 
-        return _dedupe(urls)
+        return html_islands.unique(urls)
 
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""Statistiche di successo/latenza per (piattaforma, strategia), persistite su disco.
+
+get_ydl_opts ha un ordine fisso di tentativi per piattaforma (senza cookie poi
+con cookie; client YouTube tv -> web_safari -> android) e download_video partiva
+sempre dal tentativo 0. Quando una strategia "muore" (es. Instagram senza cookie
+bloccato per ore) ogni download pagava comunque estrazione fallita + sleep
+prima di arrivare a quella buona.
+
+Qui teniamo gli ultimi esiti di ogni strategia (finestra mobile: al massimo
+WINDOW_SIZE esiti, non più vecchi di STRATEGY_WINDOW_MIN minuti) e:
+
+  - plan() ordina i tentativi per tasso di successo (poi latenza media), a
+    parità resta l'ordine di sempre;
+  - salta le strategie che nella finestra hanno fallito SEMPRE (almeno
+    MIN_SAMPLES esiti); se fossero tutte morte si tiene comunque la migliore.
+
+Uscendo dalla finestra gli esiti vecchi scadono da soli: una strategia saltata
+torna in prova quando i suoi fallimenti invecchiano.
+"""
+
+import os
+import json
+import atexit
+import time
+import logging
+import threading
+from typing import Dict, List, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+WINDOW = int(float(os.getenv('STRATEGY_WINDOW_MIN', '60')) * 60)
+WINDOW_SIZE = 30
+MIN_SAMPLES = 3
+SAVE_EVERY = 15  # secondi minimi tra due salvataggi su disco
+
+
+class StrategyStats:
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        # "piattaforma/strategia" -> lista di [timestamp, ok(0/1), latenza_s]
+        self._data: Dict[str, List[list]] = {}
+        self._dirty = False
+        self._last_save = 0.0
+        self._load()
+
+    def _load(self):
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self._data = json.load(f) or {}
+                logger.info(f"Strategy stats: caricate {len(self._data)} strategie da {self.path}")
+        except Exception as e:
+            logger.warning(f"Strategy stats: file illeggibile, riparto da zero: {e}")
+            self._data = {}
+
+    def _save_locked(self, force: bool = False):
+        now = time.time()
+        if not self._dirty or (not force and now - self._last_save < SAVE_EVERY):
+            return
+        try:
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(self._data, f)
+            os.replace(tmp, self.path)
+            self._dirty = False
+            self._last_save = now
+        except Exception as e:
+            logger.warning(f"Strategy stats: save fallito: {e}")
+
+    def _recent_locked(self, key: str, now: float) -> List[list]:
+        rows = [r for r in self._data.get(key, []) if now - r[0] <= WINDOW]
+        if rows:
+            self._data[key] = rows[-WINDOW_SIZE:]
+        else:
+            self._data.pop(key, None)
+        return rows[-WINDOW_SIZE:]
+
+    def record(self, platform: str, strategy: str, ok: bool, latency: float):
+        key = f"{platform}/{strategy}"
+        with self._lock:
+            rows = self._data.setdefault(key, [])
+            rows.append([time.time(), 1 if ok else 0, round(latency, 2)])
+            del rows[:-WINDOW_SIZE]
+            self._dirty = True
+            self._save_locked()
+
+    def flush(self):
+        with self._lock:
+            self._save_locked(force=True)
+
+    def _summary_locked(self, key: str, now: float) -> Tuple[int, int, float]:
+        rows = self._recent_locked(key, now)
+        n = len(rows)
+        ok = sum(r[1] for r in rows)
+        lat = sum(r[2] for r in rows) / n if n else 0.0
+        return n, ok, lat
+
+    def plan(self, platform: str, attempts: Sequence[Tuple[int, str]]) -> List[Tuple[int, str]]:
+        """Riordina i tentativi [(attempt, nome)] e toglie quelli morti."""
+        now = time.time()
+        scored = []
+        with self._lock:
+            for pos, (attempt, name) in enumerate(attempts):
+                n, ok, lat = self._summary_locked(f"{platform}/{name}", now)
+                dead = n >= MIN_SAMPLES and ok == 0
+                # Successo con smoothing di Laplace: senza dati vale 0.5 e non
+                # scavalca una strategia che funziona davvero
+                rate = (ok + 1) / (n + 2)
+                scored.append((dead, -rate, lat if n else 0.0, pos, attempt, name))
+        alive = [s for s in scored if not s[0]]
+        skipped = [s[5] for s in scored if s[0]]
+        if not alive:
+            alive = [min(scored, key=lambda s: s[1:4])]   # tutte morte: tieni la migliore
+            skipped = [s[5] for s in scored if s is not alive[0]]
+        ordered = sorted(alive, key=lambda s: (s[1], s[2], s[3]))
+        plan = [(s[4], s[5]) for s in ordered]
+        if plan != list(attempts):
+            logger.info(f"Strategie {platform}: ordine {[n for _, n in plan]}"
+                        + (f", saltate (sempre fallite) {skipped}" if skipped else ""))
+        return plan
+
+    def is_dead(self, platform: str, strategy: str) -> bool:
+        with self._lock:
+            n, ok, _ = self._summary_locked(f"{platform}/{strategy}", time.time())
+        return n >= MIN_SAMPLES and ok == 0
+
+    def stats(self) -> Dict[str, Dict]:
+        now = time.time()
+        out = {}
+        with self._lock:
+            for key in sorted(list(self._data)):
+                n, ok, lat = self._summary_locked(key, now)
+                if n:
+                    out[key] = {'n': n, 'ok': ok, 'rate': ok / n, 'latency': lat,
+                                'dead': n >= MIN_SAMPLES and ok == 0}
+        return out
+
+
+_instances: Dict[str, StrategyStats] = {}
+_instances_lock = threading.Lock()
+
+
+def get_stats(temp_dir: str) -> StrategyStats:
+    """Tracker condiviso dal processo (tutti i downloader dei frontend).
+    STRATEGY_STATS_PATH permette di metterlo su un disco persistente."""
+    path = os.getenv('STRATEGY_STATS_PATH') or os.path.join(temp_dir, 'nello_strategy_stats.json')
+    with _instances_lock:
+        if path not in _instances:
+            _instances[path] = StrategyStats(path)
+            atexit.register(_instances[path].flush)   # gli ultimi esiti non salvati
+        return _instances[path]
@@ -0,0 +1,548 @@
+#!/usr/bin/env python3
+"""Ricompressione dei video per i limiti dei frontend (servizio condiviso).
+
+Prima ricomprimeva solo Discord (discord_bot._compress_video), in linea, senza
+un limite globale ai processi ffmpeg (a 512 MB due encode insieme = OOM) e
+buttando via il risultato dopo l'invio; WhatsApp oltre WHATSAPP_MAX_MB e
+Telegram oltre 50 MB rinunciavano e basta. Qui:
+
+  - profili per frontend: 'discord' (DISCORD_MAX_MB, 10), 'whatsapp'
+    (WHATSAPP_MAX_MB, 16), 'telegram' (50, limite della Bot API);
+  - fit(path, profile, owner): il file se ci sta già, altrimenti una copia
+    ricompressa sotto il limite del profilo (o None se non ci sta nemmeno così);
+  - coda: gli encode passano dallo slot 'ffmpeg' dello scheduler, il cui limite
+    si calcola da CPU e RAM del container (TRANSCODE_WORKERS per forzarlo); prima
+    di partire ogni encode aspetta che ci siano TRANSCODE_JOB_MB di RAM libera;
+  - cache su disco (temp_dir/nello_transcode_cache) per (digest sorgente,
+    profilo), LRU con budget TRANSCODE_CACHE_MAX_MB: lo stesso video chiesto da
+    Telegram, Discord e WhatsApp si ricomprime una volta per profilo. Si
+    ricordano anche i video che non ci stanno (niente encode da minuti ripetuti
+    a vuoto), ma non gli errori di ffmpeg (timeout, crash, OOM);
+  - richieste uguali contemporanee fanno un solo encode (inflight);
+  - encode in UNA passata: il probe del sorgente (media_probe, condiviso e in
+    cache per digest: durata, risoluzione, fps, audio) e plan() sceglie
+    risoluzione e tetto di bitrate perché il primo tentativo stia sotto il
+    limite (CRF con tetto VBV), invece di provare a 0.92 e poi rifare tutto a
+    0.72 sempre a 480/540p. I video che ci stanno già ma non sono mp4 (webm/mkv
+    con H.264) o hanno il moov in fondo si rimpacchettano senza ricodificare.
+  bench_transcode.py confronta encode per successo e tempi con la versione
+  precedente.
+
+Il chiamante riceve sempre un file suo (hard link del risultato in cache, come
+la cache media) e lo cancella dopo l'invio come prima.
+"""
+
+import os
+import time
+import shutil
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import janitor
+import inflight
+import scheduler
+import media_cache
+import media_probe
+from media_probe import MediaInfo
+
+logger = logging.getLogger(__name__)
+
+TIMEOUT = int(os.getenv('TRANSCODE_TIMEOUT', os.getenv('DISCORD_COMPRESS_TIMEOUT', '420')))
+# Thread ffmpeg: compromesso memoria/velocità. 1 era troppo lento (timeout sui video
+# lunghi), il default (tutti i core) usava troppa RAM (OOM sul free tier da 512MB).
+THREADS = os.getenv('TRANSCODE_THREADS', os.getenv('DISCORD_COMPRESS_THREADS', '2'))
+JOB_BYTES = int(float(os.getenv('TRANSCODE_JOB_MB', '180')) * 1024 * 1024)
+RESERVE_BYTES = 256 * 1024 * 1024   # il bot stesso (python, yt-dlp, frontend)
+MEMORY_WAIT = 60                    # secondi massimi di attesa per la RAM
+# Piano di encode (vedi plan())
+MAX_HEIGHT = int(os.getenv('TRANSCODE_MAX_HEIGHT', '720'))
+HEIGHTS = (1080, 720, 576, 540, 480, 360, 288, 240)
+MIN_BPP = 0.04          # bit per pixel sotto cui H.264 'superfast' si vede a blocchi
+MIN_VIDEO_K = 120       # sotto questo bitrate video non vale la pena codificare
+CRF = 23
+# Pixel al secondo che ffmpeg codifica su questa CPU (milioni, con THREADS thread):
+# serve a scegliere una risoluzione che finisca ben dentro TRANSCODE_TIMEOUT
+PIXEL_RATE = float(os.getenv('TRANSCODE_PIXEL_RATE', '12'))
+CACHE_MAX_BYTES = int(float(os.getenv('TRANSCODE_CACHE_MAX_MB', '128')) * 1024 * 1024)
+CACHE_DIRNAME = 'nello_transcode_cache'
+FAILED_MAX = 256
+
+
+class Profile:
+    def __init__(self, name: str, limit_mb: float):
+        self.name = name
+        self.limit = int(limit_mb * 1024 * 1024)
+        # Obiettivo degli encode: un po' sotto il cap reale, per non prendere 413
+        # sui file al limite. Chi ci sta già (<= limit) si manda così com'è
+        self.target = int(self.limit * 0.95)
+
+
+PROFILES = {
+    'discord': Profile('discord', float(os.getenv('DISCORD_MAX_MB', '10'))),
+    'whatsapp': Profile('whatsapp', float(os.getenv('WHATSAPP_MAX_MB', '16'))),
+    'telegram': Profile('telegram', 50),
+}
+
+_lock = threading.Lock()
+_failed: 'OrderedDict[str, bool]' = OrderedDict()   # "digest:profilo" che non ci stanno
+_stats = {'requests': 0, 'fits': 0, 'encodes': 0, 'encoded': 0, 'cache_hits': 0,
+          'joined': 0, 'failed': 0, 'known_failed': 0, 'mem_waits': 0, 'evictions': 0,
+          'encode_seconds': 0.0, 'bytes_in': 0, 'bytes_out': 0, 'remuxes': 0, 'remuxed': 0,
+          'unplannable': 0, 'errors': 0}
+
+
+# --- Capacità: quanti ffmpeg insieme ---
+
+def _read_int(path: str) -> Optional[int]:
+    try:
+        with open(path) as f:
+            raw = f.read().strip()
+        return int(raw) if raw.isdigit() else None
+    except OSError:
+        return None
+
+
+def _meminfo(field: str) -> Optional[int]:
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def memory_limit() -> Optional[int]:
+    """RAM a disposizione del processo: limite del cgroup (container) o totale."""
+    cg = _read_int('/sys/fs/cgroup/memory.max') or _read_int('/sys/fs/cgroup/memory/memory.limit_in_bytes')
+    total = _meminfo('MemTotal')
+    if cg and total:
+        return min(cg, total)
+    return cg or total
+
+
+def memory_available() -> Optional[int]:
+    """RAM libera adesso (nel cgroup se c'è un limite, altrimenti MemAvailable)."""
+    cg_max = _read_int('/sys/fs/cgroup/memory.max')
+    cg_cur = _read_int('/sys/fs/cgroup/memory.current')
+    avail = _meminfo('MemAvailable')
+    if cg_max and cg_cur is not None:
+        free = cg_max - cg_cur
+        return min(free, avail) if avail is not None else free
+    return avail
+
+
+def workers() -> int:
+    """Encode contemporanei: uno per gruppo di THREADS core, finché la RAM
+    (tolta la riserva del bot) regge TRANSCODE_JOB_MB a testa. Minimo 1."""
+    forced = int(os.getenv('TRANSCODE_WORKERS', '0') or 0)
+    if forced > 0:
+        return forced
+    try:
+        threads = max(1, int(THREADS))
+    except ValueError:
+        threads = 1
+    by_cpu = max(1, (os.cpu_count() or 1) // threads)
+    mem = memory_limit()
+    by_ram = max(1, (mem - RESERVE_BYTES) // JOB_BYTES) if mem else 1
+    return int(min(by_cpu, by_ram))
+
+
+WORKERS = scheduler.set_default_limit('ffmpeg', workers())
+
+
+async def _wait_for_memory():
+    """Prima di un encode: aspetta (al massimo MEMORY_WAIT s) TRANSCODE_JOB_MB
+    liberi. Se la RAM non si libera si parte lo stesso: lo slot è già nostro."""
+    t0 = time.monotonic()
+    counted = False
+    while time.monotonic() - t0 < MEMORY_WAIT:
+        free = memory_available()
+        if free is None or free >= JOB_BYTES:
+            return
+        if not counted:
+            counted = True
+            with _lock:
+                _stats['mem_waits'] += 1
+            logger.info(f"Transcode: RAM libera {free / (1024 * 1024):.0f} MB, aspetto prima di ffmpeg")
+        await asyncio.sleep(1)
+
+
+# --- Encoder ---
+
+def _remove(path: Optional[str]):
+    try:
+        if path and os.path.exists(path):
+            os.remove(path)
+    except OSError:
+        pass
+
+
+class Plan:
+    """Come ricomprimere: risoluzione, bitrate video (tetto VBV), audio."""
+
+    def __init__(self, height: int, width: int, video_k: int, audio_k: int,
+                 audio_copy: bool, fps_cap: Optional[int], scale: bool, est_seconds: float):
+        self.height = height
+        self.width = width
+        self.video_k = video_k
+        self.audio_k = audio_k          # 0 = niente traccia audio
+        self.audio_copy = audio_copy
+        self.fps_cap = fps_cap
+        self.scale = scale
+        self.est_seconds = est_seconds
+
+    def __repr__(self):
+        audio = 'copy' if self.audio_copy else (f"{self.audio_k}k" if self.audio_k else 'no')
+        return f"{self.width}x{self.height} v={self.video_k}k a={audio} ~{self.est_seconds:.0f}s"
+
+
+def plan(info: MediaInfo, target_bytes: int) -> Optional[Plan]:
+    """Risoluzione e bitrate perché il PRIMO encode stia sotto target_bytes.
+
+    Bit a disposizione = target (meno il 3% di container) sulla durata + 1 s:
+    quel secondo in più è il buffer VBV (bufsize = 1 s di maxrate), l'unico
+    sforamento possibile di un encode con tetto maxrate. La risoluzione è la più
+    alta (lato corto fino a MAX_HEIGHT, mai sopra il sorgente) con ancora MIN_BPP bit per
+    pixel e che si codifica entro metà del timeout (TRANSCODE_PIXEL_RATE).
+    None se non ci sta nemmeno al minimo: meglio non provarci."""
+    dur = info.duration or 0
+    if dur <= 0:
+        return None
+    total_k = target_bytes * 8 * 0.97 / (dur + 1) / 1000
+    # Audio: l'AAC del sorgente si copia se non è troppo pesante per il budget
+    src_ak = int((info.abit_rate or 0) / 1000)
+    if not info.acodec:
+        audio_k, audio_copy = 0, False
+    elif info.acodec == 'aac' and 0 < src_ak <= 128 and src_ak <= total_k * 0.2:
+        audio_k, audio_copy = src_ak, True
+    else:
+        audio_k = 128 if total_k >= 1000 else (96 if total_k >= 500 else 64)
+        audio_copy = False
+    video_k = int(total_k - audio_k)
+    if video_k < MIN_VIDEO_K:
+        return None
+
+    src_w, src_h = info.width or 0, info.height or 0
+    fps = info.fps or 30.0
+    fps_cap = 30 if fps > 31 else None
+    fps = min(fps, 30.0)
+    if src_w <= 0 or src_h <= 0:
+        src_w, src_h = 960, 540         # sconosciuta: come il vecchio tetto
+    # "720p" è il lato corto: vale anche per i video verticali
+    short = min(src_w, src_h)
+    top = min(short, MAX_HEIGHT)
+    chosen = None
+    for s in sorted({s for s in HEIGHTS if s < top} | {top}, reverse=True):
+        w = max(2, int(round(src_w * s / short / 2)) * 2)
+        h = max(2, int(round(src_h * s / short / 2)) * 2)
+        pixels = w * h * fps
+        est = pixels * dur / (PIXEL_RATE * 1e6)
+        chosen = (h, w, est)
+        if video_k * 1000 / pixels >= MIN_BPP and est <= TIMEOUT * 0.5:
+            break
+    h, w, est = chosen
+    return Plan(h, w, video_k, audio_k, audio_copy, fps_cap, (w, h) != (src_w, src_h), est)
+
+
+def _remuxable(info: Optional[MediaInfo]) -> bool:
+    """Basta cambiare contenitore (-> mp4) senza ricodificare?"""
+    return bool(info and info.vcodec == 'h264' and info.acodec in (None, 'aac', 'mp3'))
+
+
+async def _ffmpeg(cmd, timeout: int, what: str) -> bool:
+    proc = None
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *cmd, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
+        await asyncio.wait_for(proc.wait(), timeout=timeout)
+    except asyncio.TimeoutError:
+        try:
+            proc.kill()
+        except Exception:
+            pass
+        logger.warning(f"Transcode: TIMEOUT dopo {timeout}s ({what})")
+        return False
+    except Exception as e:
+        logger.warning(f"Transcode: errore ffmpeg: {e}")
+        return False
+    return proc.returncode == 0
+
+
+async def _remux(path: str, out: str) -> bool:
+    """Stesso audio e video, contenitore mp4 con moov in testa."""
+    with _lock:
+        _stats['remuxes'] += 1
+    cmd = ['ffmpeg', '-y', '-v', 'error', '-i', path, '-map', '0:v:0', '-map', '0:a:0?',
+           '-c', 'copy', '-movflags', '+faststart', out]
+    if await _ffmpeg(cmd, 120, 'remux') and os.path.exists(out) and os.path.getsize(out) > 0:
+        return True
+    _remove(out)
+    return False
+
+
+def _encode_cmd(path: str, out: str, p: Plan) -> list:
+    vf = [f'scale={p.width}:{p.height}'] if p.scale else []
+    cmd = ['ffmpeg', '-y', '-v', 'error', '-threads', THREADS, '-i', path,
+           # mappatura esplicita: primo video + primo audio (opzionale, '?'),
+           # così l'audio è SEMPRE incluso se presente nel sorgente.
+           '-map', '0:v:0', '-map', '0:a:0?',
+           # CRF con tetto VBV ("capped CRF"): una passata sola, qualità costante
+           # dove il budget basta e maxrate/bufsize che garantiscono la dimensione
+           # dove non basta; le scene facili escono anche più piccole.
+           '-c:v', 'libx264', '-preset', 'superfast', '-crf', str(CRF),
+           '-maxrate', f'{p.video_k}k', '-bufsize', f'{p.video_k}k',
+           '-pix_fmt', 'yuv420p']
+    if p.fps_cap:
+        cmd += ['-r', str(p.fps_cap)]
+    if vf:
+        cmd += ['-vf', ','.join(vf)]
+    if p.audio_copy:
+        cmd += ['-c:a', 'copy']
+    elif p.audio_k:
+        cmd += ['-c:a', 'aac', '-b:a', f'{p.audio_k}k', '-ar', '48000', '-ac', '2']
+    cmd += ['-movflags', '+faststart', out]
+    return cmd
+
+
+def _seconds(v) -> float:
+    try:
+        return float(v or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+async def _encode(path: str, out: str, target_bytes: int, duration=None) -> Optional[bool]:
+    """Ricomprime `path` in `out` sotto target_bytes con il piano di plan().
+    True se ci sta; False se non ci può stare (plan() rinuncia o anche dopo la
+    correzione resta troppo grande); None se ffmpeg è fallito (timeout sotto
+    carico, crash, OOM): un'altra volta potrebbe andare."""
+    info = await media_probe.probe(path)
+    if info is None:
+        info = MediaInfo(duration=_seconds(duration), acodec='unknown')
+    elif info.duration <= 0:
+        info.duration = _seconds(duration)
+    p = plan(info, target_bytes)
+    src_size = os.path.getsize(path) if os.path.exists(path) else 0
+    if p is None:
+        with _lock:
+            _stats['unplannable'] += 1
+        logger.warning(f"Transcode: {src_size} bytes in {int(info.duration or 0)}s "
+                       f"non stanno in {target_bytes} nemmeno al minimo, niente encode")
+        return False
+    # Di norma un solo encode; se sfora lo stesso (audio copiato più pesante del
+    # dichiarato, container) un secondo con un tetto più basso dello sforamento.
+    for attempt in range(2):
+        with _lock:
+            _stats['encodes'] += 1
+        ok = await _ffmpeg(_encode_cmd(path, out, p), TIMEOUT, f"{p}, src={src_size}B")
+        size = os.path.getsize(out) if ok and os.path.exists(out) else 0
+        if 0 < size <= target_bytes:
+            logger.info(f"Transcode OK: {src_size} -> {size} bytes ({p}, tentativo {attempt + 1})")
+            return True
+        _remove(out)
+        if not size:
+            return None
+        p.video_k = int(p.video_k * target_bytes / size * 0.95)
+        if p.video_k < MIN_VIDEO_K:
+            break
+        if p.audio_copy and size > target_bytes * 1.05:
+            p.audio_copy, p.audio_k = False, min(p.audio_k or 96, 96)
+    logger.warning(f"Transcode: non rientrato nel target ({src_size} bytes, {p})")
+    return False
+
+
+# --- Cache (digest sorgente, profilo) ---
+
+class _Cache:
+    def __init__(self, root: str, max_bytes: int = CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, digest: str, profile: str) -> str:
+        return os.path.join(self.root, f"{digest}_{profile}.mp4")
+
+    def get(self, digest: str, profile: str) -> Optional[str]:
+        p = self.path(digest, profile)
+        with self._lock:
+            try:
+                if os.path.getsize(p) <= 0:
+                    return None
+                os.utime(p)            # ultimo uso: per lo sfratto LRU
+            except OSError:
+                return None
+        return p
+
+    def put(self, src: str, digest: str, profile: str) -> Optional[str]:
+        dest = self.path(digest, profile)
+        with self._lock:
+            try:
+                os.replace(src, dest)
+            except OSError as e:
+                logger.warning(f"Transcode cache: put fallito: {e}")
+                return None
+            janitor.discard(src)
+            self._enforce_budget(keep=dest)
+        return dest
+
+    def _enforce_budget(self, keep: str):
+        try:
+            files = [os.path.join(self.root, n) for n in os.listdir(self.root) if n.endswith('.mp4')]
+            sized = [(os.path.getmtime(p), os.path.getsize(p), p) for p in files]
+        except OSError:
+            return
+        total = sum(s for _, s, _ in sized)
+        for _, size, p in sorted(sized):
+            if total <= self.max_bytes:
+                break
+            if p == keep:
+                continue
+            _remove(p)
+            total -= size
+            with _lock:
+                _stats['evictions'] += 1
+
+    def usage(self) -> Dict:
+        with self._lock:
+            try:
+                files = [os.path.join(self.root, n) for n in os.listdir(self.root) if n.endswith('.mp4')]
+                return {'entries': len(files), 'bytes': sum(os.path.getsize(p) for p in files)}
+            except OSError:
+                return {'entries': 0, 'bytes': 0}
+
+
+_caches: Dict[str, _Cache] = {}
+_caches_lock = threading.Lock()
+
+
+def _cache_for(temp_dir: str) -> _Cache:
+    root = os.path.join(temp_dir, CACHE_DIRNAME)
+    with _caches_lock:
+        if root not in _caches:
+            _caches[root] = _Cache(root)
+        return _caches[root]
+
+
+def _hand_out(cached: str, src: str, profile: str) -> Optional[str]:
+    """Copia del risultato in cache per il chiamante (accanto al sorgente)."""
+    base = f"{os.path.splitext(src)[0]}_{profile}"
+    for n in range(0, 1000):
+        dst = f"{base}{n or ''}_tc.mp4"
+        if os.path.exists(dst):
+            continue
+        try:
+            os.link(cached, dst)
+        except FileExistsError:
+            continue
+        except OSError:
+            try:
+                shutil.copyfile(cached, dst)
+            except OSError:
+                return None
+        return janitor.track(dst)
+    return None
+
+
+def _note_failed(key: str, remember: bool = True):
+    """Encode non riuscito. Si ricorda per il resto del processo solo se il video
+    davvero non ci sta (`remember`); gli errori di ffmpeg no."""
+    with _lock:
+        _stats['failed'] += 1
+        if not remember:
+            _stats['errors'] += 1
+            return
+        _failed[key] = True
+        _failed.move_to_end(key)
+        while len(_failed) > FAILED_MAX:
+            _failed.popitem(last=False)
+
+
+async def fit(path: str, profile: str, owner: str, duration=None) -> Optional[str]:
+    """File che sta nel limite di `profile` ('discord', 'whatsapp', 'telegram'):
+    `path` stesso se ci sta già (o un mp4 rimpacchettato, se era webm/mkv H.264),
+    altrimenti una copia ricompressa (file NUOVO del chiamante, che cancella lui
+    sia questo sia `path`). None se non ci sta."""
+    prof = PROFILES[profile]
+    try:
+        size = os.path.getsize(path)
+    except (OSError, TypeError):
+        return None
+    with _lock:
+        _stats['requests'] += 1
+    if size <= prof.limit:
+        # Ci sta: al massimo va sistemato il contenitore (webm/mkv con H.264, o
+        # mp4 col moov in fondo, che non parte finché non è scaricato tutto)
+        is_mp4 = os.path.splitext(path)[1].lower() == '.mp4'
+        needs_box = not is_mp4 or media_probe.moov_first(path) is False
+        if needs_box and _remuxable(await media_probe.probe(path)):
+            out = janitor.track(f"{os.path.splitext(path)[0]}_{profile}_tc.mp4")
+            if await _remux(path, out):
+                with _lock:
+                    _stats['remuxed'] += 1
+                return out
+            janitor.discard(out)
+        with _lock:
+            _stats['fits'] += 1
+        return path
+
+    digest = await asyncio.to_thread(media_cache.digest_of, path)
+    key = f"{digest}:{profile}"
+    with _lock:
+        known_bad = key in _failed
+        if known_bad:
+            _stats['known_failed'] += 1
+    if known_bad:
+        return None
+    # I download stanno al primo livello di temp_dir: la cache sta lì accanto
+    cache = _cache_for(os.path.dirname(os.path.abspath(path)))
+    cached = cache.get(digest, profile)
+    if cached:
+        with _lock:
+            _stats['cache_hits'] += 1
+        return _hand_out(cached, path, profile)
+
+    async def _produce():
+        out = janitor.track(f"{os.path.splitext(path)[0]}_{profile}_enc.mp4")
+        t0 = time.monotonic()
+        # Priorità bassa: chi aspetta un download passa davanti agli encode
+        async with scheduler.slot('ffmpeg', owner, scheduler.HEAVY):
+            hit = cache.get(digest, profile)       # fatto mentre eravamo in coda
+            if hit:
+                return hit
+            await _wait_for_memory()
+            ok = await _encode(path, out, prof.target, duration)
+        if not ok:
+            janitor.discard(out)
+            _note_failed(key, remember=ok is False)
+            return None
+        with _lock:
+            _stats['encoded'] += 1
+            _stats['encode_seconds'] += time.monotonic() - t0
+            _stats['bytes_in'] += size
+            _stats['bytes_out'] += os.path.getsize(out)
+        stored = cache.put(out, digest, profile)
+        if not stored:
+            janitor.discard(out)
+        return stored
+
+    cached, joined = await inflight.coalesce(f"transcode:{key}", _produce, clone=lambda r: r)
+    if joined:
+        with _lock:
+            _stats['joined'] += 1
+    if not cached:
+        return None
+    return _hand_out(cached, path, profile)
+
+
+def stats(temp_dir: Optional[str] = None) -> Dict:
+    with _lock:
+        out = dict(_stats, workers=scheduler.LIMITS.get('ffmpeg', WORKERS))
+    if temp_dir:
+        out.update(_cache_for(temp_dir).usage())
+    return out
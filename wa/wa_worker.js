@@ -177,7 +177,7 @@ async function handleMessages(sock, upsert) {
           const info = await bridge('/download', {
             method: 'POST',
             headers: { 'content-type': 'application/json' },
-            body: JSON.stringify({ url, sender_name: ownerName }),
+            body: JSON.stringify({ url, sender_name: ownerName, chat_id: jid, sender_id: ownerId }),
           });
 
           if (!info.success) {
@@ -26,6 +26,8 @@ import requests
 from aiohttp import web
 
 import core
+import scheduler
+import transcode
 
 logger = logging.getLogger(__name__)
 
@@ -33,6 +35,10 @@ BRIDGE_PORT = int(os.getenv('WA_BRIDGE_PORT', '8765'))
 DOWNLOAD_TIMEOUT = int(os.getenv('DOWNLOAD_TIMEOUT', '300'))
 WHATSAPP_MAX_MB = float(os.getenv('WHATSAPP_MAX_MB', '16'))
 WHATSAPP_MAX_BYTES = int(WHATSAPP_MAX_MB * 1024 * 1024)
+# Dimensione massima scaricata: i video oltre WHATSAPP_MAX_MB si ricomprimono
+# (transcode.py, profilo 'whatsapp'), oltre questa soglia non si scaricano nemmeno.
+WHATSAPP_SOURCE_MAX_MB = max(float(os.getenv('WHATSAPP_SOURCE_MAX_MB', '50')), WHATSAPP_MAX_MB)
+WHATSAPP_SOURCE_MAX_BYTES = int(WHATSAPP_SOURCE_MAX_MB * 1024 * 1024)
 VIDEO_EXTS = core.VIDEO_EXTS
 
 _last_notify = [0.0]  # timestamp ultimo avviso admin (anti-spam)
@@ -54,8 +60,12 @@ def build_app(ns):
         sender_name = body.get('sender_name')
         if not url:
             return web.json_response({'success': False, 'error': 'no url'})
+        owner = f"wa:{body.get('chat_id') or '?'}:{body.get('sender_id') or sender_name or '?'}"
         try:
-            info = await asyncio.wait_for(dl.download_video(url), timeout=DOWNLOAD_TIMEOUT)
+            queue, prio = dl.schedule_class(url)
+            info = await scheduler.run(lambda: dl.download_video(url, max_bytes=WHATSAPP_SOURCE_MAX_BYTES),
+                                       queue, owner, prio,
+                                       timeout=DOWNLOAD_TIMEOUT)
         except asyncio.TimeoutError:
             return web.json_response({'success': False, 'error': 'timeout'})
         except Exception as e:
@@ -64,6 +74,12 @@ def build_app(ns):
 
         if info and info.get('skip_long'):
             return web.json_response({'success': False, 'skip_long': True})
+        if info and info.get('too_big'):
+            # Scartato prima di scaricarlo tutto: il worker manderà solo il link
+            caption = core.build_caption(info, url, sender_name or '', info.get('title') or 'Contenuto',
+                                         dialect='whatsapp', invite=False, max_desc=1500)
+            return web.json_response({'success': False, 'too_big': True, 'caption': caption,
+                                      'max_mb': WHATSAPP_MAX_MB})
         if not info or not info.get('success'):
             return web.json_response({'success': False, 'error': (info or {}).get('error', 'errore')})
 
@@ -86,6 +102,20 @@ def build_app(ns):
         caption = core.build_caption(info, url, sender_name or '', info.get('title') or 'Contenuto',
                                      dialect='whatsapp', invite=False, max_desc=1500)
 
+        # Video oltre il limite: ricompressi dal servizio condiviso (coda ffmpeg,
+        # risultato in cache anche per gli altri gruppi); gli altri al massimo
+        # passano a mp4 senza ricodificare
+        for f in files:
+            if f['video']:
+                newp = await transcode.fit(f['path'], 'whatsapp', owner, info.get('duration'))
+                if newp and newp != f['path']:
+                    try:
+                        os.remove(f['path'])
+                    except Exception:
+                        pass
+                    f['path'] = os.path.abspath(newp)
+                    f['size'] = os.path.getsize(newp)
+
         oversized = any(f['size'] > WHATSAPP_MAX_BYTES for f in files)
         if oversized:
             # WhatsApp non gradisce file troppo grandi: il worker manderà solo il link
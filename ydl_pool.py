@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""Pool "caldo" di istanze yt_dlp.YoutubeDL riutilizzabili.
+
+extract_info, download_with_ytdlp, download_audio e get_random_video_url
+creavano un YoutubeDL nuovo a ogni chiamata: ogni volta si ricaricavano gli
+extractor, il cookie jar (parse del cookiefile), la configurazione del runtime
+JS e le sessioni HTTP. Qui le istanze si prendono in prestito con lease(opts) e
+si restituiscono al pool a fine uso:
+
+  - chiave = impronta delle opzioni (piattaforma/tentativo/formato... tutto ciò
+    che get_ydl_opts mette nel dict, tranne lo User-Agent scelto a caso, che si
+    imposta sull'istanza a ogni prestito) + mtime del cookiefile: dopo
+    /setcookies l'impronta cambia e le istanze col jar vecchio non vengono più
+    date;
+  - il cookiefile si salva a fine prestito e solo se è ancora quello che
+    l'istanza ha caricato: un jar vecchio (istanza ritirata, sfrattata o chiusa
+    all'uscita) non sovrascrive mai quello messo da /setcookies;
+  - un'istanza è in uso da UN solo thread alla volta (YoutubeDL non è
+    thread-safe); tra un uso e l'altro si azzera lo stato per-download;
+  - al massimo YDL_POOL_PER_KEY istanze libere per chiave e YDL_POOL_SIZE in
+    tutto (LRU: le chiavi fredde escono per prime e vengono chiuse);
+  - YDL_POOL_SIZE=0 disattiva il pool (un'istanza nuova per chiamata, come prima);
+  - stats(): hit rate e tempo di costruzione risparmiato.
+"""
+
+import os
+import json
+import atexit
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Dict, Iterator, List
+
+if TYPE_CHECKING:
+    import yt_dlp
+
+logger = logging.getLogger(__name__)
+
+POOL_SIZE = max(0, int(os.getenv('YDL_POOL_SIZE', '6')))
+POOL_PER_KEY = max(1, int(os.getenv('YDL_POOL_PER_KEY', '2')))
+
+_lock = threading.Lock()
+_idle: 'OrderedDict[str, List]' = OrderedDict()   # impronta -> istanze libere (LRU)
+_stats = {'hits': 0, 'misses': 0, 'evicted': 0, 'discarded': 0, 'build_ms': 0.0}
+
+
+def _yt_dlp():
+    """yt_dlp importato al primo uso: è l'import più pesante del bot (centinaia
+    di extractor) e non deve pesare sull'avvio."""
+    import yt_dlp
+    return yt_dlp
+
+
+def _cookie_stamp(opts: Dict) -> str:
+    """Versione del cookiefile delle opzioni ('' se non ce n'è uno)."""
+    cookiefile = opts.get('cookiefile')
+    if not cookiefile:
+        return ''
+    try:
+        return str(os.stat(cookiefile).st_mtime_ns)
+    except OSError:
+        return 'missing'
+
+
+def fingerprint(opts: Dict) -> str:
+    """Impronta stabile delle opzioni. Hook e logger sono funzioni/oggetti del
+    processo: entrano col loro repr (stessa identità -> stessa impronta). Lo
+    User-Agent resta fuori: get_ydl_opts lo pesca a caso a ogni chiamata e
+    dividerebbe su chiavi diverse richieste per il resto identiche."""
+    headers = opts.get('http_headers')
+    if headers and 'User-Agent' in headers:
+        opts = dict(opts, http_headers={k: v for k, v in headers.items() if k != 'User-Agent'})
+    raw = json.dumps(opts, sort_keys=True, default=repr) + _cookie_stamp(opts)
+    return hashlib.sha1(raw.encode('utf-8', 'replace')).hexdigest()
+
+
+def _close(ydl) -> None:
+    """Chiude le sessioni HTTP dell'istanza SENZA salvare i cookie (close() di
+    YoutubeDL lo farebbe): il jar di un'istanza ritirata può essere più vecchio
+    del cookiefile. Il salvataggio si fa solo a fine prestito (_save_cookies)."""
+    try:
+        ydl.params['cookiefile'] = None
+        ydl.close()
+    except Exception as e:
+        logger.debug(f"YDL pool: close fallito: {e}")
+
+
+def _save_cookies(ydl, opts: Dict, stamp: str, key: str) -> str:
+    """Fine prestito: salva il jar nel cookiefile (come l'uscita dal `with`), ma
+    solo se il file è ancora quello che l'istanza ha caricato (`stamp`); se nel
+    frattempo è cambiato (/setcookies, un altro prestito) il jar è vecchio e non
+    si scrive. Ritorna la chiave con cui restituire l'istanza: dopo il
+    salvataggio il file è il suo jar, quindi vale per la nuova impronta."""
+    if not stamp or stamp == 'missing' or _cookie_stamp(opts) != stamp:
+        return key
+    try:
+        ydl.save_cookies()
+    except Exception as e:
+        logger.debug(f"YDL pool: salvataggio cookie fallito: {e}")
+        return key
+    return fingerprint(opts)
+
+
+def _reset(ydl) -> None:
+    """Azzera lo stato lasciato dal download precedente."""
+    ydl._download_retcode = 0
+    ydl._num_downloads = 0
+    if hasattr(ydl, '_playlist_level'):
+        ydl._playlist_level = 0
+    if hasattr(ydl, '_playlist_urls'):
+        ydl._playlist_urls = set()
+
+
+def _build(opts: Dict):
+    t0 = time.monotonic()
+    ydl = _yt_dlp().YoutubeDL(opts)
+    with _lock:
+        _stats['misses'] += 1
+        _stats['build_ms'] += (time.monotonic() - t0) * 1000
+    return ydl
+
+
+def _acquire(key: str):
+    with _lock:
+        free = _idle.get(key)
+        if free:
+            ydl = free.pop()
+            if not free:
+                del _idle[key]
+            _stats['hits'] += 1
+            return ydl
+    return None
+
+
+def _release(key: str, ydl) -> None:
+    evicted = []
+    with _lock:
+        free = _idle.setdefault(key, [])
+        _idle.move_to_end(key)
+        if len(free) >= POOL_PER_KEY:
+            evicted.append(ydl)
+        else:
+            free.append(ydl)
+        while sum(len(v) for v in _idle.values()) > POOL_SIZE:
+            old_key, old = next(iter(_idle.items()))
+            evicted.append(old.pop(0))
+            if not old:
+                del _idle[old_key]
+        if not _idle.get(key):
+            _idle.pop(key, None)
+        _stats['evicted'] += len(evicted)
+    for old in evicted:
+        _close(old)
+
+
+@contextmanager
+def lease(opts: Dict) -> Iterator['yt_dlp.YoutubeDL']:
+    """Sostituto di `with yt_dlp.YoutubeDL(opts) as ydl:` (da usare nel thread
+    che fa il lavoro bloccante)."""
+    yt_dlp = _yt_dlp()
+    if POOL_SIZE <= 0:
+        with yt_dlp.YoutubeDL(opts) as ydl:
+            yield ydl
+        return
+    stamp = _cookie_stamp(opts)
+    key = fingerprint(opts)
+    ydl = _acquire(key) or _build(opts)
+    ua = (opts.get('http_headers') or {}).get('User-Agent')
+    if ua:
+        ydl.params['http_headers']['User-Agent'] = ua   # letto a ogni richiesta
+    try:
+        yield ydl
+    except BaseException as e:
+        # Gli errori di estrazione/download lasciano l'istanza sana; tutto il
+        # resto (interruzioni, errori interni) la scarta
+        if isinstance(e, yt_dlp.utils.YoutubeDLError):
+            _reset(ydl)
+            _release(_save_cookies(ydl, opts, stamp, key), ydl)
+        else:
+            with _lock:
+                _stats['discarded'] += 1
+            _close(ydl)
+        raise
+    else:
+        _reset(ydl)
+        _release(_save_cookies(ydl, opts, stamp, key), ydl)
+
+
+def clear() -> None:
+    """Chiude tutte le istanze libere (es. dopo un aggiornamento di yt-dlp)."""
+    with _lock:
+        old = [y for v in _idle.values() for y in v]
+        _idle.clear()
+    for ydl in old:
+        _close(ydl)
+
+
+atexit.register(clear)   # i cookie si sono già salvati a fine prestito
+
+
+def stats() -> Dict:
+    with _lock:
+        h, m = _stats['hits'], _stats['misses']
+        return dict(_stats,
+                    idle=sum(len(v) for v in _idle.values()),
+                    keys=len(_idle),
+                    hit_rate=(h / (h + m)) if (h + m) else 0.0,
+                    build_avg_ms=(_stats['build_ms'] / m) if m else 0.0,
+                    size=POOL_SIZE)